@@ -0,0 +1 @@
+default_app_config = 'incuna_auth.apps.IncunaAuthConfig'
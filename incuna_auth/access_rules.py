@@ -0,0 +1,176 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core.cache import caches, DEFAULT_CACHE_ALIAS
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from . import access_state_cache
+
+
+GENERATION_KEY = 'incuna_auth:credentials:generation'
+SESSION_KEY = '_incuna_auth_credentials'
+
+# Cache backends that are never shared between processes.
+PROCESS_LOCAL_CACHES = (DummyCache, LocMemCache)
+
+# The registry of access state -> AccessRule.
+rules = {}
+
+
+class AccessRule(object):
+    """
+    Who may see resources with a particular access state.
+
+    A user must be logged in and active, and (unless they're a superuser) must be in
+    at least one of `groups` (given by name) if there are any, must have all of
+    `permissions` ('app_label.codename'), and must be staff if `staff` is True.
+    """
+    def __init__(self, groups=(), permissions=(), staff=False):
+        self.groups = tuple(groups)
+        self.permissions = frozenset(permissions)
+        self.staff = staff
+        self.group_ids = None
+
+    def get_group_ids(self, generation):
+        """
+        Returns the ids of the rule's groups, looked up once per generation (or every
+        time, if the generation is None).
+        """
+        stale = self.group_ids is None or self.group_ids[0] != generation
+        if generation is None or stale:
+            groups = Group.objects.filter(name__in=self.groups)
+            self.group_ids = (generation, frozenset(groups.values_list('pk', flat=True)))
+        return self.group_ids[1]
+
+    def allows(self, user, credentials):
+        """Returns True if the user, with the given Credentials, satisfies the rule."""
+        if not (user.is_authenticated and user.is_active):
+            return False
+        if user.is_superuser:
+            return True
+        if self.staff and not user.is_staff:
+            return False
+        if self.groups:
+            group_ids = self.get_group_ids(credentials.generation)
+            if group_ids.isdisjoint(credentials.group_ids):
+                return False
+        return self.permissions <= credentials.permissions
+
+
+def register(access_state, groups=(), permissions=(), staff=False):
+    """Registers the rule for users to see resources with the access state."""
+    rules[access_state] = AccessRule(groups, permissions, staff)
+
+
+class Credentials(object):
+    """A user's group ids and permissions, as of a generation of credentials."""
+    def __init__(self, generation, user_pk, group_ids, permissions):
+        self.generation = generation
+        self.user_pk = user_pk
+        self.group_ids = frozenset(group_ids)
+        self.permissions = frozenset(permissions)
+
+    @classmethod
+    def for_user(cls, user, generation):
+        """Looks up a user's credentials in the database."""
+        group_ids = user.groups.values_list('pk', flat=True)
+        return cls(generation, user.pk, group_ids, user.get_all_permissions())
+
+    def to_session(self):
+        return [
+            self.generation,
+            self.user_pk,
+            sorted(self.group_ids),
+            sorted(self.permissions),
+        ]
+
+
+def get_cache():
+    """
+    Returns the cache holding the generation of credentials, or None.
+
+    That's the INCUNA_AUTH_ACCESS_STATE_CACHE cache, if it's set, or the default cache.
+    It must be shared between processes for them to notice each other's changes to
+    groups and permissions, so None is returned if it's a local memory (or dummy)
+    cache.
+    """
+    cache = access_state_cache.get_cache() or caches[DEFAULT_CACHE_ALIAS]
+    if isinstance(cache, PROCESS_LOCAL_CACHES):
+        return None
+    return cache
+
+
+def get_generation():
+    """
+    Returns the current generation of credentials, or None if there isn't a shared
+    cache to keep it in.
+    """
+    cache = get_cache()
+    if cache is None:
+        return None
+    return access_state_cache.get_generation(cache, GENERATION_KEY)
+
+
+def bump_generation(sender=None, **kwargs):
+    """
+    Signal receiver. Invalidates every user's saved credentials.
+
+    Connected to changes to groups, group membership and permissions.
+    """
+    cache = get_cache()
+    if cache is not None:
+        access_state_cache.increment_generation(cache, GENERATION_KEY)
+
+
+def get_credentials(request):
+    """
+    Returns the Credentials of request.user.
+
+    They're looked up once per session, or again if groups or permissions have changed
+    since (see bump_generation), and kept on the request. Without a shared cache (see
+    get_cache) they're looked up once per request instead.
+    """
+    credentials = getattr(request, '_incuna_auth_credentials', None)
+    if credentials is not None:
+        return credentials
+
+    user = request.user
+    generation = get_generation()
+    session = getattr(request, 'session', None) if generation is not None else None
+    saved = session.get(SESSION_KEY) if session is not None else None
+
+    if saved and saved[0] == generation and saved[1] == user.pk:
+        credentials = Credentials(*saved)
+    else:
+        credentials = Credentials.for_user(user, generation)
+        if session is not None:
+            session[SESSION_KEY] = credentials.to_session()
+
+    request._incuna_auth_credentials = credentials
+    return credentials
+
+
+def connect_receivers():
+    """
+    Connects bump_generation to the signals for changes to credentials.
+
+    Called by IncunaAuthConfig.ready, once the user model can be looked up.
+    """
+    User = get_user_model()
+    uid = 'incuna_auth.access_rules.{0}'.format
+    post_save.connect(bump_generation, sender=Group, dispatch_uid=uid('group'))
+    post_delete.connect(bump_generation, sender=Group, dispatch_uid=uid('group'))
+    m2m_changed.connect(
+        bump_generation,
+        sender=Group.permissions.through,
+        dispatch_uid=uid('group_permissions'),
+    )
+    for name in ('groups', 'user_permissions'):
+        field = getattr(User, name, None)
+        if field is not None:
+            m2m_changed.connect(
+                bump_generation,
+                sender=field.through,
+                dispatch_uid=uid('user_' + name),
+            )
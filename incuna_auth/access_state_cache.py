@@ -0,0 +1,134 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils.encoding import force_bytes
+
+
+GENERATION_KEY = 'incuna_auth:access_state:generation'
+
+# Cached in place of None, which the cache can't tell apart from a missing key.
+NO_ACCESS_STATE = ''
+
+
+def get_cache():
+    """
+    Returns the cache named by INCUNA_AUTH_ACCESS_STATE_CACHE, or None if it isn't set.
+    """
+    alias = getattr(settings, 'INCUNA_AUTH_ACCESS_STATE_CACHE', None)
+    return caches[alias] if alias else None
+
+
+def get_timeout():
+    """Returns INCUNA_AUTH_ACCESS_STATE_CACHE_TIMEOUT, or the cache's default timeout."""
+    return getattr(settings, 'INCUNA_AUTH_ACCESS_STATE_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+
+
+def get_generation(cache, key=GENERATION_KEY):
+    """
+    Returns the current generation of cached access states (or of whatever else `key`
+    counts generations of).
+
+    A missing generation (never set, or evicted) starts again from the current time
+    rather than from 1, so it can't bring back entries from an earlier generation.
+    """
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, int(time.time() * 1000), None)
+        generation = cache.get(key)
+    return generation
+
+
+def increment_generation(cache, key=GENERATION_KEY):
+    """Moves on to the next generation of whatever `key` counts generations of."""
+    try:
+        cache.incr(key)
+    except ValueError:
+        # The generation was missing, so there's nothing cached to invalidate.
+        get_generation(cache, key)
+
+
+def invalidate():
+    """Invalidates every cached access state (and snapshot), in every process."""
+    cache = get_cache()
+    if cache is not None:
+        increment_generation(cache)
+
+
+def bump_generation(sender=None, using=None, **kwargs):
+    """
+    Signal receiver. Invalidates every cached access state, in every process, once the
+    current transaction on the `using` database commits.
+
+    Connected (by AccessStateExtensionMixin) to the saving, moving and deleting of
+    resources, since any of them can change the access state of any number of paths.
+    Until the change is committed other processes still read the resource as it was,
+    and would cache that under the new generation if it had already started.
+    """
+    transaction.on_commit(invalidate, using=using)
+
+
+def get_shared_cache():
+    """
+    Returns the cache named by INCUNA_AUTH_ACCESS_STATE_CACHE, for use by something
+    that has to notice changes made by other processes.
+
+    Raises ImproperlyConfigured if the setting isn't set.
+    """
+    cache = get_cache()
+    if cache is None:
+        raise ImproperlyConfigured(
+            'INCUNA_AUTH_ACCESS_STATE_CACHE must name a cache shared between '
+            'processes, for them to notice changes to access states.'
+        )
+    return cache
+
+
+def get_version():
+    """
+    Returns a value that changes whenever a change to a resource is committed, in any
+    process.
+
+    That needs a shared cache (see get_shared_cache).
+    """
+    return get_generation(get_shared_cache())
+
+
+def make_key(path, resolution=''):
+    """
+    Returns the cache key for a path's access state, as resolved by `resolution`.
+
+    `resolution` identifies how the access state was worked out (see
+    FeinCMSPermissionMiddleware.get_resolution_id), so middlewares resolving access
+    states differently never share entries.
+    """
+    digest = hashlib.md5(force_bytes(resolution) + b'\0' + force_bytes(path))
+    return 'incuna_auth:access_state:{0}'.format(digest.hexdigest())
+
+
+def get_current(cache, key):
+    """
+    Returns (generation, value): the current generation, and the value cached for
+    `key` in it (or None).
+
+    Values are cached along with their generation (see set_current), so both are
+    fetched in a single round trip.
+    """
+    values = cache.get_many([GENERATION_KEY, key])
+    generation = values.get(GENERATION_KEY)
+    if generation is None:
+        generation = get_generation(cache)
+
+    cached = values.get(key)
+    if cached is not None and cached[0] == generation:
+        return generation, cached[1]
+    return generation, None
+
+
+def set_current(cache, key, generation, value):
+    """Caches a value for `key`, as of `generation` (as returned by get_current)."""
+    cache.set(key, (generation, value), get_timeout())
@@ -0,0 +1,339 @@
+from collections import defaultdict
+
+from django.db import connections, router
+from django.db.models import OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from . import access_state_cache
+from .models import AccessStateExtensionMixin as AccessState
+
+
+# Keep the number of query parameters in a single UPDATE within SQLite's limits, and
+# the number of rows each one locks modest.
+UPDATE_BATCH_SIZE = 500
+
+# Keep the number of query parameters in a single lookup (such as the recursive query
+# of get_inherited_access_states) within SQLite's limit of 999.
+LOOKUP_BATCH_SIZE = 900
+
+# Database backends whose recursive common table expressions work with
+# get_inherited_access_states.
+RECURSIVE_CTE_VENDORS = ('postgresql', 'sqlite')
+
+# Walks up from each starting resource, one parent at a time, for as long as the
+# resources reached have STATE_INHERIT, then keeps the first resource that doesn't.
+INHERITED_ACCESS_STATES_SQL = '''
+WITH RECURSIVE chain (start_id, parent_id, access_state, depth) AS (
+    SELECT {pk}, {parent}, {access_state}, 0
+    FROM {table}
+    WHERE {pk} IN ({placeholders})
+    UNION ALL
+    SELECT chain.start_id, resource.{parent}, resource.{access_state}, chain.depth + 1
+    FROM {table} resource
+    INNER JOIN chain ON resource.{pk} = chain.parent_id
+    WHERE chain.access_state = %s
+)
+SELECT start_id, access_state FROM chain
+WHERE access_state != %s
+ORDER BY start_id, depth
+'''
+
+
+def effective_states(rows, parent_state=AccessState.STATE_ALL_ALLOWED):
+    """
+    Works out the effective access states of a tree (or subtree) of resources.
+
+    A resource with STATE_INHERIT effectively has the access state of its nearest
+    ancestor that doesn't, or STATE_ALL_ALLOWED if there's no such ancestor.
+
+    `rows` is an iterable of (pk, parent_id, access_state) tuples in tree order (every
+    resource after its parent). `parent_state` is the effective access state of the
+    parent of any resource whose parent isn't in `rows`.
+
+    Returns a dictionary of effective access state -> list of pks.
+    """
+    INHERIT = AccessState.STATE_INHERIT
+    states = {}
+    pks_by_state = defaultdict(list)
+    for pk, parent_id, access_state in rows:
+        if access_state == INHERIT:
+            access_state = states.get(parent_id, parent_state)
+        states[pk] = access_state
+        pks_by_state[access_state].append(pk)
+    return pks_by_state
+
+
+def bulk_update_effective_states(model, pks_by_state):
+    """Saves effective access states with one UPDATE per state (per batch of pks)."""
+    manager = model._base_manager
+    for access_state, pks in pks_by_state.items():
+        for start in range(0, len(pks), UPDATE_BATCH_SIZE):
+            batch = pks[start:start + UPDATE_BATCH_SIZE]
+            manager.filter(pk__in=batch).update(effective_access_state=access_state)
+
+
+def get_parent_effective_state(page):
+    """Returns the effective access state of a page's parent (from the database)."""
+    if page.parent_id is None:
+        return AccessState.STATE_ALL_ALLOWED
+
+    parents = type(page)._base_manager.filter(pk=page.parent_id)
+    parent_state = parents.values_list('effective_access_state', flat=True).first()
+    return parent_state or AccessState.STATE_ALL_ALLOWED
+
+
+def update_effective_states(page, include_self=True):
+    """
+    Recomputes effective_access_state for an MPTT page and its descendants, in bulk.
+
+    The subtree is read in a single query, and written back with one UPDATE per
+    distinct effective access state.
+    """
+    if include_self:
+        parent_state = get_parent_effective_state(page)
+    else:
+        parent_state = page.effective_access_state
+
+    subtree = page.get_descendants(include_self=include_self)
+    subtree = subtree.order_by(page._mptt_meta.left_attr)
+    rows = subtree.values_list('pk', 'parent_id', 'access_state')
+    bulk_update_effective_states(type(page), effective_states(rows, parent_state))
+
+
+def rebuild_effective_states(model):
+    """
+    Recomputes effective_access_state for every instance of an MPTT model.
+
+    Use this (for instance, in a data migration) after adding the field.
+    """
+    opts = model._mptt_meta
+    tree = model._base_manager.order_by(opts.tree_id_attr, opts.left_attr)
+    rows = tree.values_list('pk', 'parent_id', 'access_state')
+    bulk_update_effective_states(model, effective_states(rows))
+
+
+def subtree_roots(queryset):
+    """
+    Returns the resources in a queryset of an MPTT model that aren't descendants of
+    other resources in it, in tree order.
+    """
+    opts = queryset.model._mptt_meta
+    roots = []
+    for page in queryset.order_by(opts.tree_id_attr, opts.left_attr):
+        tree_id = getattr(page, opts.tree_id_attr)
+        right = getattr(page, opts.right_attr)
+        if roots:
+            root = roots[-1]
+            in_root = (
+                tree_id == getattr(root, opts.tree_id_attr) and
+                right <= getattr(root, opts.right_attr)
+            )
+            if in_root:
+                continue
+        roots.append(page)
+    return roots
+
+
+def set_subtree_access_state(queryset, access_state):
+    """
+    Sets the access_state of the resources in a queryset and all their descendants.
+
+    The resources are updated with a single UPDATE, over the MPTT tree ranges of the
+    selected resources, so no signals are sent for each one. Instead, effective access
+    states (if the model has them) are recomputed once per subtree and cached access
+    states are invalidated once (when the transaction commits).
+
+    Returns the number of resources updated.
+    """
+    model = queryset.model
+    opts = model._mptt_meta
+    roots = subtree_roots(queryset)
+    if not roots:
+        return 0
+
+    subtrees = Q()
+    for root in roots:
+        subtrees |= Q(**{
+            opts.tree_id_attr: getattr(root, opts.tree_id_attr),
+            opts.left_attr + '__gte': getattr(root, opts.left_attr),
+            opts.right_attr + '__lte': getattr(root, opts.right_attr),
+        })
+    count = model._base_manager.filter(subtrees).update(access_state=access_state)
+
+    if has_effective_access_state(model):
+        for root in roots:
+            root.access_state = access_state
+            update_effective_states(root)
+
+    access_state_cache.bump_generation(sender=model, using=queryset.db)
+    return count
+
+
+def has_effective_access_state(model):
+    """Returns True if the model has an effective_access_state field."""
+    return any(
+        field.name == 'effective_access_state' for field in model._meta.get_fields()
+    )
+
+
+def effective_access_state(model):
+    """
+    Returns an expression for the effective access state of each row of an MPTT model.
+
+    That's the effective_access_state field, if the model has one. Otherwise it's a
+    subquery for the access state of the nearest ancestor (or the row itself) without
+    STATE_INHERIT, found using the tree columns.
+    """
+    # Use the model's own field, so that AccessStateFields are converted properly.
+    field = model._meta.get_field('access_state')
+    all_allowed = Value(AccessState.STATE_ALL_ALLOWED, output_field=field)
+    if has_effective_access_state(model):
+        return Coalesce('effective_access_state', all_allowed)
+
+    opts = model._mptt_meta
+    ancestors = model._base_manager.filter(**{
+        opts.tree_id_attr: OuterRef(opts.tree_id_attr),
+        opts.left_attr + '__lte': OuterRef(opts.left_attr),
+        opts.right_attr + '__gte': OuterRef(opts.right_attr),
+    })
+    ancestors = ancestors.exclude(access_state=AccessState.STATE_INHERIT)
+    ancestors = ancestors.order_by('-' + opts.left_attr).values('access_state')[:1]
+    return Coalesce(Subquery(ancestors, output_field=field), all_allowed)
+
+
+def visible_to(queryset, user, protected_states=None):
+    """
+    Filters a queryset of resources down to those the user may see.
+
+    This applies the same rules as FeinCMSLoginRequiredMiddleware, in the database: a
+    user who isn't logged in can't see resources whose effective access state is in
+    `protected_states` (by default, [STATE_AUTH_ONLY]). Logged-in users can see them
+    all. The queryset's model must be an MPTT model, or have an
+    effective_access_state field.
+    """
+    if user.is_authenticated:
+        return queryset
+
+    if protected_states is None:
+        protected_states = [AccessState.STATE_AUTH_ONLY]
+    never_restricted = (AccessState.STATE_INHERIT, AccessState.STATE_ALL_ALLOWED)
+    protected_states = [s for s in protected_states if s not in never_restricted]
+    if not protected_states:
+        return queryset
+
+    queryset = queryset.annotate(
+        _effective_access_state=effective_access_state(queryset.model),
+    )
+    return queryset.exclude(_effective_access_state__in=protected_states)
+
+
+class AccessStateQuerySetMixin(object):
+    """
+    Adds visible_to to a QuerySet (or, with Manager.from_queryset, a Manager).
+
+        class PageQuerySet(AccessStateQuerySetMixin, models.QuerySet):
+            pass
+
+        Page.objects.visible_to(request.user)
+    """
+    def visible_to(self, user, protected_states=None):
+        """Returns the resources the user may see (see access_states.visible_to)."""
+        return visible_to(self.all(), user, protected_states)
+
+
+def get_database(model):
+    """Returns the connection to read a model's resources from."""
+    return connections[router.db_for_read(model)]
+
+
+def supports_recursive_cte(model):
+    """Returns True if get_inherited_access_states can be used with the model."""
+    return get_database(model).vendor in RECURSIVE_CTE_VENDORS
+
+
+def get_inherited_access_states(model, pks):
+    """
+    Returns a dictionary of pk -> effective access state for the given resources.
+
+    Inheritance is followed through `parent` with a recursive common table expression,
+    so any number of resources (in batches of LOOKUP_BATCH_SIZE) are resolved in one
+    statement however deep they are. Resources that inherit from the top of the tree
+    get STATE_INHERIT, as FeinCMSPermissionMiddleware._get_inherited_access_state
+    does. Check supports_recursive_cte before using this.
+    """
+    connection = get_database(model)
+    quote = connection.ops.quote_name
+    opts = model._meta
+    field = opts.get_field('access_state')
+    columns = {
+        'table': quote(opts.db_table),
+        'pk': quote(opts.pk.column),
+        'parent': quote(opts.get_field('parent').column),
+        'access_state': quote(field.column),
+    }
+    INHERIT = AccessState.STATE_INHERIT
+    inherit = field.get_db_prep_value(INHERIT, connection)
+
+    pks = list(pks)
+    states = dict.fromkeys(pks, INHERIT)
+    with connection.cursor() as cursor:
+        for start in range(0, len(pks), LOOKUP_BATCH_SIZE):
+            batch = pks[start:start + LOOKUP_BATCH_SIZE]
+            placeholders = ', '.join(['%s'] * len(batch))
+            sql = INHERITED_ACCESS_STATES_SQL.format(placeholders=placeholders, **columns)
+            cursor.execute(sql, batch + [inherit, inherit])
+
+            # Rows come nearest first, so only keep the first for each resource.
+            found = set()
+            for pk, access_state in cursor.fetchall():
+                if pk not in found:
+                    found.add(pk)
+                    states[pk] = field.to_python(access_state)
+    return states
+
+
+def set_effective_state(sender, instance, raw=False, **kwargs):
+    """
+    pre_save receiver. Sets the effective access state of the page being saved.
+
+    Also notes whether it has changed, so that update_descendant_states knows if the
+    page's descendants need updating.
+    """
+    if raw:
+        return
+
+    access_state = instance.access_state
+    if access_state == AccessState.STATE_INHERIT:
+        access_state = get_parent_effective_state(instance)
+
+    previous_state = None
+    if instance.pk is not None:
+        pages = sender._base_manager.filter(pk=instance.pk)
+        previous_state = pages.values_list('effective_access_state', flat=True).first()
+
+    instance.effective_access_state = access_state
+    instance._effective_access_state_changed = access_state != previous_state
+
+
+def update_descendant_states(sender, instance, created=False, raw=False,
+                             update_fields=None, **kwargs):
+    """
+    post_save receiver. Updates the descendants of a page whose state changed.
+
+    If the page was saved with update_fields leaving out effective_access_state, the
+    page's own new effective access state is written too.
+    """
+    if raw or not getattr(instance, '_effective_access_state_changed', False):
+        return
+
+    if update_fields is not None and 'effective_access_state' not in update_fields:
+        pages = sender._base_manager.filter(pk=instance.pk)
+        pages.update(effective_access_state=instance.effective_access_state)
+
+    if not created and not instance.is_leaf_node():
+        update_effective_states(instance, include_self=False)
+
+
+def update_moved_states(sender, instance, **kwargs):
+    """node_moved receiver. Updates a moved page and its descendants."""
+    update_effective_states(instance)
@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class IncunaAuthConfig(AppConfig):
+    name = 'incuna_auth'
+
+    def ready(self):
+        from . import access_rules
+        access_rules.connect_receivers()
@@ -1,4 +1,6 @@
+from django.conf import settings
 from django.contrib.auth.backends import ModelBackend
+from django.db.models.functions import Lower
 try:
     from django.contrib.auth import get_user_model
     User = get_user_model()
@@ -8,14 +10,39 @@ except ImportError:
 
 
 class CustomUserModelBackend(ModelBackend):
+    """
+    Lets users log in with their email as well as their username.
+
+    How emails are looked up is set by INCUNA_AUTH_EMAIL_LOOKUP:
+    - 'iexact' (the default) compares them case-insensitively, with UPPER() on both
+      sides, which can't use an index.
+    - 'lower' compares LOWER(email) with the lowercased address, which can use an
+      index on LOWER(email) (see operations.CreateLowerEmailIndex).
+    - 'exact' compares email with the lowercased address, for sites that store emails
+      in lowercase. It can use a plain index on email.
+
+    If several users match, the one with the lowest pk is used.
+    """
+    def get_email_lookup(self):
+        """Hook method. Returns INCUNA_AUTH_EMAIL_LOOKUP, or 'iexact' if it isn't set."""
+        return getattr(settings, 'INCUNA_AUTH_EMAIL_LOOKUP', 'iexact')
+
+    def get_users_by_email(self, email):
+        lookup = self.get_email_lookup()
+        if lookup == 'lower':
+            users = User.objects.annotate(email_lower=Lower('email'))
+            return users.filter(email_lower=email.lower())
+        if lookup == 'exact':
+            return User.objects.filter(email=email.lower())
+        return User.objects.filter(email__iexact=email)
+
     def authenticate(self, username=None, password=None):
         """Allow users to log in with their email as well as username."""
-        kw = 'email__iexact' if '@' in username else 'username'
-        kwargs = {kw: username}
-        try:
-            user = User.objects.get(**kwargs)
-        except User.DoesNotExist:
-            pass
+        if '@' in username:
+            users = self.get_users_by_email(username)
         else:
-            if user.check_password(password):
-                return user
+            users = User.objects.filter(username=username)
+
+        user = users.order_by('pk').first()
+        if user is not None and user.check_password(password):
+            return user
@@ -0,0 +1,69 @@
+import io
+import sys
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+from ...middleware.policy import EXEMPT, PROTECTED, UNPROTECTED
+
+
+class Command(BaseCommand):
+    help = ' '.join((
+        'Classify URL paths (one per line) as exempt, protected or unprotected by a',
+        'UrlPermissionMiddleware, and show the pattern that decided each one.',
+    ))
+    stealth_options = ('stdin',)
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths',
+            nargs='?',
+            default='-',
+            help='File of paths to classify. Reads from standard input if omitted.',
+        )
+        parser.add_argument(
+            '--middleware',
+            default='incuna_auth.middleware.LoginRequiredMiddleware',
+            help='Dotted path to the UrlPermissionMiddleware (sub)class to use.',
+        )
+        parser.add_argument(
+            '--summary',
+            action='store_true',
+            help="Only show the number of paths with each decision.",
+        )
+
+    def read_paths(self, lines):
+        """Yields the path from each line, dropping any query string and blank lines."""
+        for line in lines:
+            path = line.strip().split('?', 1)[0]
+            if path:
+                yield path
+
+    def handle(self, *args, **options):
+        middleware = import_string(options['middleware'])()
+        policy = middleware.get_url_policy()
+
+        if options['paths'] == '-':
+            counts = self.classify(policy, options.get('stdin', sys.stdin), options)
+        else:
+            with io.open(options['paths'], encoding='utf-8') as lines:
+                counts = self.classify(policy, lines, options)
+
+        summary = ', '.join(
+            '{0} {1}'.format(counts[decision], decision)
+            for decision in (EXEMPT, PROTECTED, UNPROTECTED)
+        )
+        (self.stdout if options['summary'] else self.stderr).write(summary)
+
+    def classify(self, policy, lines, options):
+        """Writes out the decision for each path, returning a count of each decision."""
+        counts = Counter({EXEMPT: 0, PROTECTED: 0, UNPROTECTED: 0})
+        for path, decision, pattern in policy.classify(self.read_paths(lines)):
+            counts[decision] += 1
+            if not options['summary']:
+                if pattern is None:
+                    pattern = '-'
+                pattern = getattr(pattern, 'pattern', pattern)
+                self.stdout.write('\t'.join((decision, pattern, path)))
+        return counts
@@ -0,0 +1,57 @@
+import re
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ...middleware.login_required import get_login_exempt_urls, get_login_protected_urls
+from ...middleware.policy import policy_checksum, UrlPolicy, write_policy_file
+from ...middleware.utils import compile_url
+
+
+class Command(BaseCommand):
+    help = ' '.join((
+        "Validate LoginRequiredMiddleware's exempt and protected URL lists and save",
+        'them, ready compiled, to a file for LOGIN_URL_POLICY_FILE.',
+    ))
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'output',
+            nargs='?',
+            help='File to write the policy to. Defaults to LOGIN_URL_POLICY_FILE.',
+        )
+
+    def compile_urls(self, urls, setting):
+        """Compiles a list of URLs, raising a CommandError for any invalid ones."""
+        patterns = []
+        errors = []
+        for url in urls:
+            try:
+                patterns.append(compile_url(url))
+            except re.error as error:
+                errors.append('{0} in {1}: {2}'.format(url, setting, error))
+
+        if errors:
+            raise CommandError('Invalid URL patterns:\n' + '\n'.join(errors))
+        return patterns
+
+    def handle(self, *args, **options):
+        output = options['output'] or getattr(settings, 'LOGIN_URL_POLICY_FILE', None)
+        if not output:
+            raise CommandError('Give an output file or set LOGIN_URL_POLICY_FILE.')
+
+        exempt_urls = get_login_exempt_urls()
+        protected_urls = get_login_protected_urls()
+        policy = UrlPolicy(
+            self.compile_urls(exempt_urls, 'LOGIN_EXEMPT_URLS'),
+            self.compile_urls(protected_urls, 'LOGIN_PROTECTED_URLS'),
+        )
+
+        checksum = policy_checksum(exempt_urls, protected_urls)
+        write_policy_file(output, policy, checksum)
+
+        self.stdout.write('Wrote {0} URL patterns ({1} dynamic) to {2}'.format(
+            len(policy.decisions),
+            len(policy.dynamic_indexes),
+            output,
+        ))
@@ -1,34 +1,99 @@
+import binascii
+import hashlib
+import hmac
+import os
 from base64 import b64decode
 
 from django.conf import settings
+from django.core.signals import setting_changed
 from django.http import HttpResponse
-from django.utils.translation import ugettext as _
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.encoding import force_bytes
+from django.utils.translation import get_language, ugettext as _
 
+from .htpasswd import PasswordFile
+from .permission import ALL_URLS
+from .policy import UrlPolicy
+from .utils import compile_urls, LRUCache
 
-def challenge():
+
+BASIC_AUTH_SETTINGS = (
+    'BASIC_WWW_AUTHENTICATION',
+    'BASIC_WWW_AUTHENTICATION_USERNAME',
+    'BASIC_WWW_AUTHENTICATION_PASSWORD',
+    'BASIC_WWW_AUTHENTICATION_CACHE_SIZE',
+    'BASIC_WWW_AUTHENTICATION_FILE',
+    'BASIC_WWW_AUTHENTICATION_EXEMPT_URLS',
+    'WWW_AUTHENTICATION_REALM',
+)
+
+
+def get_challenge_header():
+    """Returns the WWW-Authenticate header for the realm, in the active language."""
     realm = getattr(settings, 'WWW_AUTHENTICATION_REALM', _('Restricted Access'))
+    return 'Basic realm="{0}"'.format(realm)
 
+
+def challenge(header=None):
+    """Returns a 401 response asking for credentials, with the given header."""
     response = HttpResponse(content_type='text/plain', status=401)
-    response['WWW-Authenticate'] = 'Basic realm="{0}"'.format(realm)
+    response['WWW-Authenticate'] = header or get_challenge_header()
     return response
 
 
-def is_authenticated(authentication):
-    method, auth = authentication.split(' ', 1)
+def parse_authorization(authentication):
+    """
+    Returns the (username, password) from a Basic Authorization header, as bytes.
+
+    Returns None if the header uses another method, and False if it's malformed.
+    """
+    method, _space, auth = authentication.partition(' ')
     if method.lower() != 'basic':
         return None
-    auth = b64decode(auth.strip()).decode('utf-8')
-    username, password = auth.split(':', 1)
-    AUTHENTICATION_USERNAME = settings.BASIC_WWW_AUTHENTICATION_USERNAME
-    AUTHENTICATION_PASSWORD = settings.BASIC_WWW_AUTHENTICATION_PASSWORD
-    return username == AUTHENTICATION_USERNAME and password == AUTHENTICATION_PASSWORD
+
+    try:
+        auth = b64decode(force_bytes(auth.strip()))
+        auth.decode('utf-8')
+    except (binascii.Error, TypeError, ValueError):
+        # ValueError includes UnicodeDecodeError.
+        return False
+
+    username, colon, password = auth.partition(b':')
+    if not colon:
+        return False
+    return username, password
 
 
-class BasicAuthenticationMiddleware(object):
+def is_authenticated(authentication, username=None, password=None):
+    """
+    Checks a Basic Authorization header against a username and password.
+
+    These default to the BASIC_WWW_AUTHENTICATION_USERNAME and
+    BASIC_WWW_AUTHENTICATION_PASSWORD settings. They're compared in constant time.
+    Returns None if the header uses another method.
+    """
+    credentials = parse_authorization(authentication)
+    if not credentials:
+        return credentials
+
+    if username is None:
+        username = getattr(settings, 'BASIC_WWW_AUTHENTICATION_USERNAME', None)
+    if password is None:
+        password = getattr(settings, 'BASIC_WWW_AUTHENTICATION_PASSWORD', None)
+    if username is None or password is None:
+        return False
+
+    # Compare both parts, so the time taken doesn't show which one was wrong.
+    username_matches = hmac.compare_digest(credentials[0], force_bytes(username))
+    password_matches = hmac.compare_digest(credentials[1], force_bytes(password))
+    return username_matches and password_matches
+
+
+class BasicAuthenticationMiddleware(MiddlewareMixin):
     """
     Add HTTP Basic Auth to a site.
 
-    Add this to your `MIDDLEWARE_CLASSES` at the beginning:
+    Add this to your `MIDDLEWARE` (or `MIDDLEWARE_CLASSES`) at the beginning:
         'incuna_auth.middleware.BasicAuthenticationMiddleware',
 
     By default this will do nothing until you add some other settings:
@@ -36,18 +101,104 @@ class BasicAuthenticationMiddleware(object):
         BASIC_WWW_AUTHENTICATION_PASSWORD = 'pass'
         BASIC_WWW_AUTHENTICATION = bool(os.environ.get('BASIC_AUTH', False))
 
+    The settings are read when the middleware is created, and again if they change.
+    Authorization headers that have been accepted are remembered (as keyed digests,
+    never as the credentials themselves) so a client sending the same header again
+    isn't checked again. BASIC_WWW_AUTHENTICATION_CACHE_SIZE sets how many headers are
+    remembered (default 128).
+
+    To let several accounts in, name an htpasswd-style file of usernames and hashed
+    passwords instead (see htpasswd.PasswordFile):
+        BASIC_WWW_AUTHENTICATION_FILE = '/etc/staging.htpasswd'
+
+    Hashes can be in the MD5 (the default), bcrypt (-B, if BCryptPasswordHasher is in
+    PASSWORD_HASHERS) or SHA-1 (-s) formats of Apache's `htpasswd`, or any format
+    Django's PASSWORD_HASHERS understand. Crypt (-d) and plain (-p) passwords aren't
+    supported, and are warned about when the file is read.
+
+    The file is read again whenever it changes, and successful password checks are
+    remembered by the PasswordFile instead.
+
+    Paths that don't need credentials, such as those used by health checks, can be
+    listed as regular expressions (like LOGIN_EXEMPT_URLS):
+        BASIC_WWW_AUTHENTICATION_EXEMPT_URLS = [r'^health/$']
+
+    The challenge's WWW-Authenticate header is worked out once per language.
+
     This was adapted from:
     http://stackoverflow.com/questions/9399835/htaccess-on-heroku-for-django-app
     """
+    def __init__(self, get_response=None):
+        MiddlewareMixin.__init__(self, get_response)
+        # Digests of accepted headers are keyed with a secret known only to this
+        # process, so they're no use to anyone who reads them.
+        self.digest_key = os.urandom(32)
+        self.load_settings()
+        setting_changed.connect(self.reload_settings)
+
+    def load_settings(self):
+        """Reads the settings, and forgets every header accepted so far."""
+        self.enabled = getattr(settings, 'BASIC_WWW_AUTHENTICATION', False)
+        self.username = getattr(settings, 'BASIC_WWW_AUTHENTICATION_USERNAME', None)
+        self.password = getattr(settings, 'BASIC_WWW_AUTHENTICATION_PASSWORD', None)
+        cache_size = getattr(settings, 'BASIC_WWW_AUTHENTICATION_CACHE_SIZE', 128)
+        self.accepted = LRUCache(cache_size)
+        self.challenge_headers = {}
+
+        exempt_urls = getattr(settings, 'BASIC_WWW_AUTHENTICATION_EXEMPT_URLS', [])
+        self.url_policy = None
+        if exempt_urls:
+            self.url_policy = UrlPolicy(compile_urls(exempt_urls), ALL_URLS)
+
+        filename = getattr(settings, 'BASIC_WWW_AUTHENTICATION_FILE', None)
+        self.password_file = None
+        if self.enabled and filename:
+            self.password_file = PasswordFile(filename, cache_size)
+
+    def reload_settings(self, setting, **kwargs):
+        if setting in BASIC_AUTH_SETTINGS:
+            self.load_settings()
+
+    def get_digest(self, authentication):
+        """Returns the key under which an accepted header is remembered."""
+        digest = hmac.new(self.digest_key, force_bytes(authentication), hashlib.sha256)
+        return digest.digest()
+
+    def is_authenticated(self, authentication):
+        """Returns True if the Authorization header has, or had, the right credentials."""
+        if self.password_file is not None:
+            credentials = parse_authorization(authentication)
+            return bool(credentials) and self.password_file.check(*credentials)
+
+        digest = self.get_digest(authentication)
+        if self.accepted.get(digest):
+            return True
+
+        if is_authenticated(authentication, self.username, self.password):
+            self.accepted.set(digest, True)
+            return True
+        return False
+
+    def is_exempt(self, request):
+        """Returns True if the request's path doesn't need credentials."""
+        if self.url_policy is None:
+            return False
+        return not self.url_policy.is_protected(request.path_info.lstrip('/'))
+
+    def challenge(self):
+        """Returns a 401 response, with the header for the active language."""
+        language = get_language()
+        header = self.challenge_headers.get(language)
+        if header is None:
+            header = self.challenge_headers[language] = get_challenge_header()
+        return challenge(header)
 
     def process_request(self, request):
-        if not getattr(settings, 'BASIC_WWW_AUTHENTICATION', False):
+        if not self.enabled or self.is_exempt(request):
             return
 
-        if 'HTTP_AUTHORIZATION' not in request.META:
-            return challenge()
-
-        if is_authenticated(request.META['HTTP_AUTHORIZATION']):
+        authentication = request.META.get('HTTP_AUTHORIZATION')
+        if authentication and self.is_authenticated(authentication):
             return
 
-        return challenge()
+        return self.challenge()
@@ -0,0 +1,211 @@
+import hashlib
+import hmac
+import os
+import threading
+import warnings
+from base64 import b64encode
+
+from django.contrib.auth.hashers import check_password, identify_hasher
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.encoding import force_bytes
+
+from .utils import LRUCache
+
+
+# Prefixes of the bcrypt hashes written by `htpasswd -B` and other bcrypt tools.
+BCRYPT_PREFIXES = ('$2a$', '$2b$', '$2y$')
+
+# Prefix of the MD5 hashes written by `htpasswd` by default (or with -m).
+APR1_PREFIX = '$apr1$'
+
+# The alphabet of the base 64 encoding used by crypt-style hashes.
+CRYPT_ALPHABET = b'./0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+
+
+def crypt_b64encode(digest, order):
+    """Encodes the bytes of a digest in the given order, as crypt-style hashes do."""
+    alphabet, digest = bytearray(CRYPT_ALPHABET), bytearray(digest)
+    encoded = bytearray()
+    for start in range(0, len(order), 3):
+        group = order[start:start + 3]
+        value = 0
+        for index in group:
+            value = (value << 8) | digest[index]
+        for _ in range(len(group) + 1):
+            encoded.append(alphabet[value & 0x3f])
+            value >>= 6
+    return bytes(encoded)
+
+
+def apr1_hash(password, salt):
+    """
+    Returns Apache's MD5 hash (as written by `htpasswd -m`) of a password, as bytes.
+
+    This is the MD5-based crypt algorithm with a '$apr1$' prefix.
+    """
+    prefix = force_bytes(APR1_PREFIX)
+    salt = salt[:8]
+    digest = hashlib.md5(password + salt + password).digest()
+    context = password + prefix + salt
+    for length in range(len(password), 0, -16):
+        context += digest[:min(length, 16)]
+    length = len(password)
+    while length:
+        context += b'\0' if length & 1 else password[:1]
+        length >>= 1
+    digest = hashlib.md5(context).digest()
+
+    for i in range(1000):
+        context = password if i & 1 else digest
+        if i % 3:
+            context += salt
+        if i % 7:
+            context += password
+        context += digest if i & 1 else password
+        digest = hashlib.md5(context).digest()
+
+    order = (0, 6, 12, 1, 7, 13, 2, 8, 14, 3, 9, 15, 4, 10, 5, 11)
+    # The last byte is encoded on its own, in two characters.
+    encoded = crypt_b64encode(digest, order[:-1]) + crypt_b64encode(digest, order[-1:])
+    return prefix + salt + b'$' + encoded
+
+
+def is_supported(encoded):
+    """Returns True if verify_password can check passwords against a hash."""
+    if encoded.startswith(('{SHA}', APR1_PREFIX)):
+        return True
+    if encoded.startswith(BCRYPT_PREFIXES):
+        encoded = 'bcrypt$' + encoded
+    try:
+        identify_hasher(encoded)
+    except ValueError:
+        return False
+    return True
+
+
+def verify_password(password, encoded):
+    """
+    Returns True if a password (as bytes) matches a hash from a password file.
+
+    Hashes can be in any format Django's PASSWORD_HASHERS understand (see
+    django.contrib.auth.hashers.make_password), MD5 hashes from `htpasswd` (its
+    default), bcrypt hashes from `htpasswd -B` (if BCryptPasswordHasher is in
+    PASSWORD_HASHERS) or SHA-1 hashes from `htpasswd -s`. Other formats, such as the
+    crypt hashes of `htpasswd -d` and the plain passwords of `htpasswd -p`, never
+    match.
+    """
+    if encoded.startswith('{SHA}'):
+        digest = b64encode(hashlib.sha1(password).digest())
+        return hmac.compare_digest(digest, force_bytes(encoded[len('{SHA}'):]))
+
+    if encoded.startswith(APR1_PREFIX):
+        salt = force_bytes(encoded[len(APR1_PREFIX):].split('$', 1)[0])
+        return hmac.compare_digest(apr1_hash(password, salt), force_bytes(encoded))
+
+    if encoded.startswith(BCRYPT_PREFIXES):
+        encoded = 'bcrypt$' + encoded
+    return check_password(password.decode('utf-8'), encoded)
+
+
+def parse_password_file(lines):
+    """
+    Returns a dictionary of username -> hash from the lines of a password file.
+
+    Each line holds a username and a hash, separated by a colon, as in Apache's
+    htpasswd files. Blank lines and lines starting with '#' are ignored. Usernames are
+    bytes, to compare with those in Authorization headers.
+    """
+    entries = {}
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith(b'#'):
+            continue
+        username, colon, encoded = line.partition(b':')
+        if colon:
+            entries[username] = encoded.decode('ascii')
+    return entries
+
+
+class PasswordFile(object):
+    """
+    The accounts in an htpasswd-style password file (see parse_password_file).
+
+    The file is read when the PasswordFile is created, and read again whenever its
+    modification time changes. If it can't be read or parsed again (say, it's
+    half-written, or has a hash that isn't ASCII), a warning is given and the accounts
+    already read are kept. A warning is also given for accounts whose hashes are in
+    formats verify_password doesn't support.
+
+    Hashes are meant to be slow to check, so checks that succeed are remembered (up to
+    `cache_size` of them, as keyed digests of the username, password and hash). A
+    client sending the same credentials again only pays for a digest, until the
+    account's entry in the file changes.
+    """
+    def __init__(self, filename, cache_size=128):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.digest_key = os.urandom(32)
+        self.verified = LRUCache(cache_size)
+        try:
+            self.mtime = os.stat(filename).st_mtime
+            self.entries = self.read()
+        except (IOError, OSError, ValueError) as e:
+            # ValueError includes UnicodeDecodeError.
+            message = 'The password file {0} could not be read: {1}'
+            raise ImproperlyConfigured(message.format(filename, e))
+
+    def read(self):
+        """
+        Returns the file's accounts, warning about any whose hash can't be checked (see
+        verify_password), since they could never log in.
+        """
+        with open(self.filename, 'rb') as password_file:
+            entries = parse_password_file(password_file)
+
+        unsupported = sorted(
+            username.decode('utf-8', 'replace')
+            for username, encoded in entries.items() if not is_supported(encoded)
+        )
+        if unsupported:
+            message = 'The password file {0} has hashes in unsupported formats for: {1}'
+            warnings.warn(message.format(self.filename, ', '.join(unsupported)))
+        return entries
+
+    def get_entries(self):
+        """Returns the file's accounts, reading the file again if it has changed."""
+        try:
+            mtime = os.stat(self.filename).st_mtime
+        except OSError:
+            return self.entries
+
+        if mtime != self.mtime:
+            with self.lock:
+                if mtime != self.mtime:
+                    try:
+                        self.entries = self.read()
+                    except (IOError, OSError, ValueError) as e:
+                        message = 'The password file {0} could not be read again: {1}'
+                        warnings.warn(message.format(self.filename, e))
+                        return self.entries
+                    self.mtime = mtime
+        return self.entries
+
+    def get_digest(self, username, password, encoded):
+        """Returns the key under which a successful check is remembered."""
+        message = b'\0'.join((username, password, force_bytes(encoded)))
+        return hmac.new(self.digest_key, message, hashlib.sha256).digest()
+
+    def check(self, username, password):
+        """Returns True if the username and password (as bytes) match an account."""
+        encoded = self.get_entries().get(username)
+        if encoded is None:
+            return False
+
+        digest = self.get_digest(username, password, encoded)
+        if self.verified.get(digest):
+            return True
+
+        if verify_password(password, encoded):
+            self.verified.set(digest, True)
+            return True
+        return False
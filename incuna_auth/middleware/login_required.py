@@ -1,8 +1,14 @@
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
 
 from .permission import LoginPermissionMiddlewareMixin, UrlPermissionMiddleware
-from .utils import compile_urls
+from .policy import policy_checksum, read_policy_file
+from .utils import LazyUrlPatterns
+
+
+URL_SETTINGS = ('LOGIN_URL', 'LOGOUT_URL', 'LOGIN_EXEMPT_URLS', 'LOGIN_PROTECTED_URLS')
 
 
 def check_request_has_user():
@@ -10,19 +16,80 @@ def check_request_has_user():
     Check that LoginRequiredMiddleware isn't being used without its dependency.
 
     LoginRequiredMiddleware needs django.contrib.auth.middleware.AuthenticationMiddleware.
+    It's looked for in MIDDLEWARE, or in MIDDLEWARE_CLASSES if MIDDLEWARE is empty.
     """
-    middlewares = settings.MIDDLEWARE_CLASSES
+    setting = 'MIDDLEWARE'
+    middlewares = getattr(settings, setting, None)
+    if not middlewares:
+        setting = 'MIDDLEWARE_CLASSES'
+        middlewares = getattr(settings, setting, ())
 
     if 'django.contrib.auth.middleware.AuthenticationMiddleware' in middlewares:
         return
 
     error_message = ' '.join((
-        "MIDDLEWARE_CLASSES does not contain AuthenticationMiddleware.",
+        "{0} does not contain AuthenticationMiddleware.",
         "LoginRequiredMiddleware requires authentication middleware to be",
-        "installed. Ensure that your MIDDLEWARE_CLASSES setting includes",
+        "installed. Ensure that your {0} setting includes",
         "'django.contrib.auth.middleware.AuthenticationMiddleware'.",
     ))
-    raise ImproperlyConfigured(error_message)
+    raise ImproperlyConfigured(error_message.format(setting))
+
+
+def get_login_exempt_urls():
+    """Returns LOGIN_URL, LOGOUT_URL and the contents of LOGIN_EXEMPT_URLS."""
+    login_exempt_urls = [settings.LOGIN_URL, settings.LOGOUT_URL]
+    login_exempt_urls += getattr(settings, 'LOGIN_EXEMPT_URLS', [])
+    return login_exempt_urls
+
+
+def get_login_protected_urls():
+    """Returns LOGIN_PROTECTED_URLS, defaulting to protecting every URL."""
+    return getattr(settings, 'LOGIN_PROTECTED_URLS', [r'^'])
+
+
+def get_saved_url_policy(cache_size=None):
+    """
+    Returns the policy saved to LOGIN_URL_POLICY_FILE by the compile_url_policy command.
+
+    Returns None if the setting is empty, or if the file can't be used (see
+    policy.read_policy_file).
+    """
+    filename = getattr(settings, 'LOGIN_URL_POLICY_FILE', None)
+    if not filename:
+        return None
+
+    checksum = policy_checksum(get_login_exempt_urls(), get_login_protected_urls())
+    return read_policy_file(filename, checksum, cache_size=cache_size)
+
+
+class SettingsUrls(object):
+    """
+    A read-only class attribute holding `get_urls()`, as it is when it's read.
+
+    This keeps the login_exempt_urls and login_protected_urls attributes that
+    LoginRequiredMiddleware had before its URL lists were compiled lazily.
+    """
+    def __init__(self, get_urls):
+        self.get_urls = get_urls
+
+    def __get__(self, instance, owner):
+        return self.get_urls()
+
+    def __set__(self, instance, value):
+        raise AttributeError('Set LOGIN_EXEMPT_URLS or LOGIN_PROTECTED_URLS instead.')
+
+
+exempt_urls = LazyUrlPatterns(get_login_exempt_urls)
+protected_urls = LazyUrlPatterns(get_login_protected_urls)
+
+
+@receiver(setting_changed)
+def reset_url_patterns(setting, **kwargs):
+    """Recompile LoginRequiredMiddleware's patterns when their settings change."""
+    if setting in URL_SETTINGS:
+        exempt_urls.reset()
+        protected_urls.reset()
 
 
 class LoginRequiredMiddleware(LoginPermissionMiddlewareMixin, UrlPermissionMiddleware):
@@ -45,20 +112,46 @@ class LoginRequiredMiddleware(LoginPermissionMiddlewareMixin, UrlPermissionMiddl
 
     This version has been modified to allow us to define areas of the site to
     password protect instead of protecting everything under /.
+
+    The URL lists are compiled when they're first used rather than on import, and
+    are recompiled if any of the settings they're built from change.
+
+    Alternatively, the lists can be compiled ahead of time with the
+    compile_url_policy management command, and the resulting file named in
+    LOGIN_URL_POLICY_FILE. The file is then loaded when the middleware is created,
+    unless the settings have changed since it was written.
     """
     base_unauthorised_redirect_url = settings.LOGIN_URL
 
-    login_exempt_urls = [settings.LOGIN_URL, settings.LOGOUT_URL]
-    login_exempt_urls += getattr(settings, 'LOGIN_EXEMPT_URLS', [])
-    login_protected_urls = getattr(settings, 'LOGIN_PROTECTED_URLS', [r'^'])
+    EXEMPT_URLS = exempt_urls
+    PROTECTED_URLS = protected_urls
 
-    EXEMPT_URLS = compile_urls(login_exempt_urls)
-    PROTECTED_URLS = compile_urls(login_protected_urls)
+    login_exempt_urls = SettingsUrls(get_login_exempt_urls)
+    login_protected_urls = SettingsUrls(get_login_protected_urls)
 
-    def __init__(self, check=True):
+    def __init__(self, check=True, get_response=None):
+        # Django passes get_response as the only positional argument, while older code
+        # may pass check positionally, so tell them apart.
+        if callable(check):
+            check, get_response = True, check
+        UrlPermissionMiddleware.__init__(self, get_response)
         if check:
             check_request_has_user()
 
+        self.saved_url_policy = get_saved_url_policy(self.get_decision_cache_size())
+        if self.saved_url_policy is not None:
+            setting_changed.connect(self.discard_saved_url_policy)
+
+    def discard_saved_url_policy(self, setting, **kwargs):
+        """Stop using the saved policy once the settings it was built from change."""
+        if setting in URL_SETTINGS or setting == 'LOGIN_URL_POLICY_FILE':
+            self.saved_url_policy = None
+
+    def get_url_policy(self):
+        if self.saved_url_policy is not None:
+            return self.saved_url_policy
+        return UrlPermissionMiddleware.get_url_policy(self)
+
     def get_exempt_url_patterns(self):
         return self.EXEMPT_URLS
 
@@ -1,15 +1,19 @@
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.views import redirect_to_login
 from django.http import HttpResponseForbidden
+from django.utils.deprecation import MiddlewareMixin
 from django.utils.translation import ugettext_lazy as _
 
+from .policy import UrlPolicy
 from .utils import compile_urls
 
 
 ALL_URLS = compile_urls([r'^'])
+NO_URLS = []
 
 
-class BasePermissionMiddleware:
+class BasePermissionMiddleware(MiddlewareMixin):
     """
     Base class for middleware that allows or denies access to a resource.
 
@@ -17,6 +21,9 @@ class BasePermissionMiddleware:
     users through, although if by some miracle it does deny access to a user, it'll be
     fine doing that.
 
+    It can be listed in either MIDDLEWARE or MIDDLEWARE_CLASSES (see Django's
+    MiddlewareMixin). Subclasses that define __init__ must accept `get_response`.
+
     Contains the following implemented methods:
     - process_request: the method called on incoming request.
     - deny_access: provides standard "you're not allowed" responses.
@@ -128,6 +135,13 @@ class UrlPermissionMiddleware(BasePermissionMiddleware):
     []) and get_protected_url_patterns (defaults to returning [r'^'], i.e. a regex that
     matches all URLs). Override these in order to supply your own URL lists to the
     middleware.
+
+    Both lists are combined into a single policy.UrlPolicy, so each request is decided
+    by matching its path once rather than once per pattern.
+
+    Decisions for recently requested paths can also be cached by setting
+    INCUNA_AUTH_URL_DECISION_CACHE_SIZE to the number of paths to remember, or by
+    overriding get_decision_cache_size. The cache is disabled by default.
     """
     def get_exempt_url_patterns(self):
         """
@@ -139,7 +153,7 @@ class UrlPermissionMiddleware(BasePermissionMiddleware):
         Override this method to supply your own list of exempt URLs (for instance, from
         Django settings) to this middleware.
         """
-        return []
+        return NO_URLS
 
     def get_protected_url_patterns(self):
         """
@@ -153,20 +167,37 @@ class UrlPermissionMiddleware(BasePermissionMiddleware):
         """
         return ALL_URLS
 
-    def is_resource_protected(self, request, **kwargs):
+    def get_decision_cache_size(self):
         """
-        Returns true if and only if the resource's URL is *not* exempt and *is* protected.
+        Hook method. Returns the number of paths whose decisions should be cached.
+
+        The default implementation returns the INCUNA_AUTH_URL_DECISION_CACHE_SIZE
+        setting, or 0 (no caching) if it isn't set.
+        """
+        return getattr(settings, 'INCUNA_AUTH_URL_DECISION_CACHE_SIZE', 0)
+
+    def get_url_policy(self):
+        """
+        Returns the UrlPolicy built from the exempt and protected URL patterns.
+
+        The policy is rebuilt whenever either hook returns a list of different patterns,
+        so the lists can be swapped out (for instance, in tests). Hooks that build a new
+        list of the same patterns on every call don't cause a rebuild. Lists that are
+        modified in place aren't noticed.
         """
         exempt_urls = self.get_exempt_url_patterns()
         protected_urls = self.get_protected_url_patterns()
-        path = request.path_info.lstrip('/')
-
-        path_is_exempt = any(m.match(path) for m in exempt_urls)
-        if path_is_exempt:
-            return False
 
-        path_is_protected = any(m.match(path) for m in protected_urls)
-        if path_is_protected:
-            return True
+        policy = getattr(self, '_url_policy', None)
+        if policy is None or not policy.built_from(exempt_urls, protected_urls):
+            cache_size = self.get_decision_cache_size()
+            policy = UrlPolicy(exempt_urls, protected_urls, cache_size=cache_size)
+            self._url_policy = policy
+        return policy
 
-        return False
+    def is_resource_protected(self, request, **kwargs):
+        """
+        Returns true if and only if the resource's URL is *not* exempt and *is* protected.
+        """
+        path = request.path_info.lstrip('/')
+        return self.get_url_policy().is_protected(path)
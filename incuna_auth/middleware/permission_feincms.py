@@ -1,7 +1,32 @@
-from .permission import BasePermissionMiddleware
+import hashlib
+
+from django.conf import settings
+from django.utils import six
+from django.utils.encoding import force_bytes
+
+from .permission import BasePermissionMiddleware, UrlPermissionMiddleware
+from .utils import candidate_urls
+from .. import access_state_cache, access_state_snapshot, access_states
 from ..models import AccessStateExtensionMixin as AccessState
 
 
+# The methods of FeinCMSPermissionMiddleware that only decide what to do with a
+# request's access state. Any other method may change how the access state is resolved.
+DECISION_METHODS = (
+    'get_protected_states',
+    'is_resource_protected',
+    'deny_access_condition',
+    'deny_access',
+    'get_unauthorised_redirect_url',
+    'get_access_denied_message',
+    'process_request',
+    'get_resolution_methods',
+    'get_resolution_key',
+    'get_resolution_id',
+    '_get_request_access_state',
+)
+
+
 class FeinCMSPermissionMiddleware(BasePermissionMiddleware):
     """
     Middleware that allows or denies access based on the resource's access state.
@@ -18,7 +43,29 @@ class FeinCMSPermissionMiddleware(BasePermissionMiddleware):
 
     This class protects all pages with an access_state of STATE_AUTH_ONLY. To protect
     a different state or list of states, override get_protected_states.
+
+    To save looking up the page on every request, set INCUNA_AUTH_ACCESS_STATE_CACHE to
+    the alias of a Django cache (shared between processes, such as memcached). Each
+    path's access state is then cached (for INCUNA_AUTH_ACCESS_STATE_CACHE_TIMEOUT
+    seconds, if set) until any resource is saved, moved or deleted.
+
+    Set INCUNA_AUTH_ACCESS_STATE_SNAPSHOT to True to keep every page's access state in
+    memory instead (see access_state_snapshot.get_snapshot). That also needs
+    INCUNA_AUTH_ACCESS_STATE_CACHE, to version the snapshots, but paths' access states
+    aren't cached then.
+
+    Set INCUNA_AUTH_LEAN_PAGE_FETCH to True to fetch only the columns the access
+    decision needs, rather than the whole page (see _get_lean_page_from_path).
+
+    However it's found, the access state is worked out once per request and kept on
+    the request, so stacking several of these middlewares (say, with different
+    get_protected_states) costs no more than one. Middlewares only share it if they
+    have the same implementation of every method except those in decision_methods,
+    so a subclass adding a method that doesn't change how access states are resolved
+    should add its name there too.
     """
+    decision_methods = DECISION_METHODS
+
     def get_protected_states(self):
         """
         Returns a list of access states this middleware should apply to.
@@ -40,6 +87,177 @@ class FeinCMSPermissionMiddleware(BasePermissionMiddleware):
         except Page.DoesNotExist:
             return None
 
+    def _finds_feincms_pages(self):
+        """Returns True if _get_page_from_path hasn't been overridden."""
+        get_page = six.get_unbound_function(type(self)._get_page_from_path)
+        default_get_page = FeinCMSPermissionMiddleware._get_page_from_path
+        return get_page is six.get_unbound_function(default_get_page)
+
+    def use_lean_page_fetch(self):
+        """
+        Hook method. Returns True if pages should be fetched with only the columns the
+        access decision needs.
+
+        The default implementation returns INCUNA_AUTH_LEAN_PAGE_FETCH (default False),
+        unless _get_page_from_path has been overridden.
+        """
+        if not self._finds_feincms_pages():
+            return False
+        return getattr(settings, 'INCUNA_AUTH_LEAN_PAGE_FETCH', False)
+
+    def _get_lean_page_from_path(self, path):
+        """
+        Fetches the page the path points to, like _get_page_from_path, but deferring
+        every column the access decision doesn't need (content, SEO, templates...).
+
+        That makes it a poor page for anything else, so unlike a page from
+        _get_page_from_path it isn't shared with FeinCMS (see _get_request_page).
+        """
+        from feincms.module.page.models import Page
+
+        opts = Page._mptt_meta
+        fields = [
+            'parent',
+            'access_state',
+            opts.tree_id_attr,
+            opts.left_attr,
+            opts.right_attr,
+            opts.level_attr,
+        ]
+        if hasattr(Page, 'effective_access_state'):
+            fields.append('effective_access_state')
+
+        pages = Page.objects.active().filter(_cached_url__in=candidate_urls(path))
+        # Each candidate URL is a prefix of the longer ones, so the best match (the
+        # longest) is also the greatest.
+        page = pages.only(*fields).order_by('-_cached_url').first()
+        if page is None or not page.are_ancestors_active():
+            return None
+        return page
+
+    def _get_request_page(self, request):
+        """
+        Returns the page for the request, sharing it with FeinCMS where that's safe.
+
+        FeinCMS's PageManager.for_request keeps the page it finds for a request in
+        request._feincms_page, where the page view and context processor look for it.
+        Unless _get_page_from_path has been overridden, a page there whose URL is
+        exactly the request's path is reused, and a page found here with exactly that
+        URL is stored there, so a CMS request only looks its page up once.
+
+        Other pages (such as an ancestor found by best match, which FeinCMS would
+        answer with a 404) are never given to FeinCMS. They're kept in
+        request._incuna_auth_pages instead, for middlewares finding pages the same way.
+        """
+        path = request.path_info
+        shared = self._finds_feincms_pages()
+        if shared:
+            page = getattr(request, '_feincms_page', None)
+            if page is not None and getattr(page, '_cached_url', None) == path:
+                return page
+
+        if self.use_lean_page_fetch():
+            return self._get_lean_page_from_path(path.lstrip('/'))
+
+        pages = getattr(request, '_incuna_auth_pages', None)
+        if pages is None:
+            pages = request._incuna_auth_pages = {}
+        key = (path, six.get_unbound_function(type(self)._get_page_from_path))
+        if key in pages:
+            return pages[key]
+
+        page = self._get_page_from_path(path.lstrip('/'))
+        if shared and page is not None and getattr(page, '_cached_url', None) == path:
+            request._feincms_page = page
+        else:
+            pages[key] = page
+        return page
+
+    def get_inheritance_resolver(self):
+        """
+        Hook method. Returns how to follow `parent` for non-MPTT models: 'cte' or 'loop'.
+
+        The default implementation returns INCUNA_AUTH_INHERITANCE_RESOLVER (default
+        'loop').
+        """
+        return getattr(settings, 'INCUNA_AUTH_INHERITANCE_RESOLVER', 'loop')
+
+    def _get_inherited_access_state(self, page):
+        """
+        Returns the access_state a page with STATE_INHERIT inherits from its ancestors.
+
+        That's the access_state of its nearest ancestor without STATE_INHERIT, or
+        STATE_INHERIT if there isn't one.
+
+        For MPTT models (such as FeinCMS pages) the ancestors are fetched in one query
+        using the tree columns, however deep the page is. Other models follow `parent`,
+        in one query if get_inheritance_resolver returns 'cte' and the database
+        supports it (see access_states.get_inherited_access_states), or one query per
+        ancestor otherwise.
+        """
+        INHERIT = AccessState.STATE_INHERIT
+        if hasattr(page, 'get_ancestors'):
+            ancestors = page.get_ancestors(ascending=True).exclude(access_state=INHERIT)
+            states = ancestors.values_list('access_state', flat=True)[:1]
+            return next(iter(states), INHERIT)
+
+        model = type(page)
+        use_cte = self.get_inheritance_resolver() == 'cte'
+        if use_cte and access_states.supports_recursive_cte(model):
+            return access_states.get_inherited_access_states(model, [page.pk])[page.pk]
+
+        while page.access_state == INHERIT and page.parent:
+            page = page.parent
+        return page.access_state
+
+    def use_access_state_snapshot(self):
+        """
+        Hook method. Returns True if access states should be looked up in a snapshot
+        (see get_access_state_snapshot).
+
+        The default implementation returns INCUNA_AUTH_ACCESS_STATE_SNAPSHOT (default
+        False).
+        """
+        return getattr(settings, 'INCUNA_AUTH_ACCESS_STATE_SNAPSHOT', False)
+
+    def get_access_state_snapshot(self):
+        """
+        Hook method. Returns an access_state_snapshot.AccessStateSnapshot, or None.
+
+        The default implementation returns an up to date snapshot of FeinCMS's Page if
+        use_access_state_snapshot returns True, or None (look pages up in the
+        database) otherwise.
+        """
+        if not self.use_access_state_snapshot():
+            return None
+
+        from feincms.module.page.models import Page
+        return access_state_snapshot.get_snapshot(Page)
+
+    def _get_page_access_state(self, request):
+        """
+        Returns the access_state of the request's page, following any INHERITed values.
+
+        Returns None if the accessed URL doesn't contain a Page.
+        """
+        snapshot = self.get_access_state_snapshot()
+        if snapshot is not None:
+            return snapshot.get_access_state(request.path_info)
+
+        feincms_page = self._get_request_page(request)
+        if not feincms_page:
+            return None
+
+        # Chase inherited values up the tree of inheritance, unless the page already
+        # knows its effective access state (see AccessStateExtensionMixin).
+        if hasattr(feincms_page, 'effective_access_state'):
+            return feincms_page.effective_access_state
+
+        access_state = feincms_page.access_state
+        if access_state == AccessState.STATE_INHERIT:
+            access_state = self._get_inherited_access_state(feincms_page)
+        return access_state
+
     def _get_resource_access_state(self, request):
         """
         Returns the FeinCMS resource's access_state, following any INHERITed values.
@@ -50,24 +268,126 @@ class FeinCMSPermissionMiddleware(BasePermissionMiddleware):
 
         Will also return None if the accessed URL doesn't contain a Page.
         """
-        feincms_page = self._get_page_from_path(request.path_info.lstrip('/'))
-        if not feincms_page:
-            return None
-
-        # Chase inherited values up the tree of inheritance.
-        INHERIT = AccessState.STATE_INHERIT
-        while feincms_page.access_state == INHERIT and feincms_page.parent:
-            feincms_page = feincms_page.parent
+        access_state = self._get_page_access_state(request)
 
         # Resources with STATE_ALL_ALLOWED or STATE_INHERIT and no parent should never be
         # access-restricted. This code is here rather than in is_resource_protected to
         # emphasise its importance and help avoid accidentally overriding it.
-        never_restricted = (INHERIT, AccessState.STATE_ALL_ALLOWED)
-        if feincms_page.access_state in never_restricted:
+        never_restricted = (AccessState.STATE_INHERIT, AccessState.STATE_ALL_ALLOWED)
+        if access_state in never_restricted:
             return None
 
         # Return the found value.
-        return feincms_page.access_state
+        return access_state
+
+    def get_access_state_cache(self):
+        """
+        Hook method. Returns the Django cache to keep access states in, or None.
+
+        The default implementation returns the cache named by
+        INCUNA_AUTH_ACCESS_STATE_CACHE, or None (no caching) if that isn't set.
+        """
+        return access_state_cache.get_cache()
+
+    def _get_cached_resource_access_state(self, request):
+        """
+        Returns _get_resource_access_state(request), from the cache if possible.
+
+        Paths without a protectable resource are cached too, so the database is hit at
+        most once per path until a resource changes. Nothing is cached if access states
+        are looked up in a snapshot, which is quicker than the cache.
+        """
+        cache = self.get_access_state_cache()
+        if cache is None or self.use_access_state_snapshot():
+            return self._get_resource_access_state(request)
+
+        path = request.path_info.lstrip('/')
+        key = access_state_cache.make_key(path, self.get_resolution_id())
+        generation, access_state = access_state_cache.get_current(cache, key)
+        if access_state is None:
+            access_state = self._get_resource_access_state(request)
+            cached = access_state_cache.NO_ACCESS_STATE
+            if access_state is not None:
+                cached = access_state
+            access_state_cache.set_current(cache, key, generation, cached)
+        return access_state or None
+
+    @classmethod
+    def get_resolution_methods(cls):
+        """
+        Returns the names of the methods that may change how access states are resolved.
+
+        That's every method (except special methods) not in decision_methods, so
+        overriding any hook, including ones added by a subclass, is taken into account.
+        """
+        methods = cls.__dict__.get('_resolution_methods')
+        if methods is None:
+            names = set()
+            for klass in cls.__mro__:
+                names.update(name for name in vars(klass) if not name.startswith('__'))
+            methods = tuple(sorted(
+                name for name in names
+                if name not in cls.decision_methods and callable(getattr(cls, name))
+            ))
+            cls._resolution_methods = methods
+        return methods
+
+    def get_resolution_key(self):
+        """
+        Returns a key shared by the middlewares that resolve access states the same way.
+
+        That's the implementations of get_resolution_methods, so a subclass overriding
+        any of them gets its own resolution of each request. It's worked out once per
+        class.
+        """
+        cls = type(self)
+        key = cls.__dict__.get('_resolution_key')
+        if key is None:
+            key = tuple(
+                six.get_unbound_function(getattr(cls, name))
+                for name in cls.get_resolution_methods()
+            )
+            cls._resolution_key = key
+        return key
+
+    def get_resolution_id(self):
+        """
+        Returns a stable identity of the way this middleware resolves access states.
+
+        That's a digest of the qualified names of the implementations of
+        get_resolution_methods, worked out once per class. Unlike get_resolution_key,
+        it's the same in every process, so it can be part of shared cache keys.
+        """
+        cls = type(self)
+        resolution_id = cls.__dict__.get('_resolution_id')
+        if resolution_id is None:
+            names = []
+            for name in cls.get_resolution_methods():
+                owner = next(klass for klass in cls.__mro__ if name in vars(klass))
+                qualname = getattr(owner, '__qualname__', owner.__name__)
+                names.append('{0}.{1}.{2}'.format(owner.__module__, qualname, name))
+            resolution_id = hashlib.md5(force_bytes(' '.join(names))).hexdigest()
+            cls._resolution_id = resolution_id
+        return resolution_id
+
+    def _get_request_access_state(self, request):
+        """
+        Returns _get_cached_resource_access_state(request), worked out once per request.
+
+        The result is kept on the request (by path and get_resolution_key), for any
+        other permission middleware resolving access states the same way to reuse.
+        """
+        access_states = getattr(request, '_incuna_auth_access_states', None)
+        if access_states is None:
+            access_states = request._incuna_auth_access_states = {}
+
+        key = (request.path_info, self.get_resolution_key())
+        try:
+            return access_states[key]
+        except KeyError:
+            access_state = self._get_cached_resource_access_state(request)
+            access_states[key] = access_state
+            return access_state
 
     def is_resource_protected(self, request, **kwargs):
         """
@@ -76,6 +396,58 @@ class FeinCMSPermissionMiddleware(BasePermissionMiddleware):
         Returns true if and only if the resource's access_state matches an entry in
         the return value of get_protected_states().
         """
-        access_state = self._get_resource_access_state(request)
+        access_state = self._get_request_access_state(request)
         protected_states = self.get_protected_states()
         return access_state in protected_states
+
+
+class FeinCMSUrlPermissionMiddleware(UrlPermissionMiddleware):
+    """
+    UrlPermissionMiddleware whose URL policy is exported from the FeinCMS page tree.
+
+    Rather than looking up the page for each request, the whole page tree is compiled
+    (see access_state_snapshot.AccessStateSnapshot.page_policy) into a prefix trie of
+    page URLs, protecting those of pages whose effective access state is in
+    get_protected_states. Requests are then checked with no database access at all.
+    The trie is rebuilt whenever the snapshot is, that is after pages change (see
+    access_state_snapshot.get_snapshot). For every process to notice, that needs
+    INCUNA_AUTH_ACCESS_STATE_CACHE to name a cache they share; ImproperlyConfigured is
+    raised when the middleware is created otherwise.
+
+    To require a login for STATE_AUTH_ONLY pages this way:
+
+        class FeinCMSLoginRequiredMiddleware(
+            LoginPermissionMiddlewareMixin,
+            FeinCMSUrlPermissionMiddleware,
+        ):
+            base_unauthorised_redirect_url = settings.LOGIN_URL
+    """
+    def __init__(self, get_response=None):
+        UrlPermissionMiddleware.__init__(self, get_response)
+        access_state_cache.get_shared_cache()
+
+    def get_protected_states(self):
+        """
+        Returns a list of access states this middleware should apply to.
+
+        By default, returns STATE_AUTH_ONLY, as FeinCMSPermissionMiddleware does.
+        """
+        return [AccessState.STATE_AUTH_ONLY]
+
+    def get_page_model(self):
+        """Hook method. Returns the page model (by default, FeinCMS's Page)."""
+        from feincms.module.page.models import Page
+        return Page
+
+    def get_url_policy(self):
+        """
+        Returns the policy.PagePolicy exported from an up to date page tree snapshot.
+        """
+        snapshot = access_state_snapshot.get_snapshot(self.get_page_model())
+        policy = getattr(self, '_url_policy', None)
+        built_from = getattr(self, '_url_policy_snapshot', None)
+        if policy is None or built_from is not snapshot:
+            policy = snapshot.page_policy(self.get_protected_states())
+            self._url_policy = policy
+            self._url_policy_snapshot = snapshot
+        return policy
@@ -0,0 +1,188 @@
+from fnmatch import fnmatchcase
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.urls import get_resolver, Resolver404
+from django.utils.translation import get_language
+
+from .permission import BasePermissionMiddleware
+from .utils import LRUCache
+
+
+def view_path(callback):
+    """Returns the dotted path of a view function, or of its class if it has one."""
+    view = getattr(callback, 'view_class', callback)
+    name = getattr(view, '__qualname__', getattr(view, '__name__', ''))
+    return '{}.{}'.format(getattr(view, '__module__', ''), name)
+
+
+def join_view_name(namespaces, url_name):
+    """Returns a 'namespace:name' view name, or None for an unnamed URL."""
+    if not url_name:
+        return None
+    return ':'.join(list(namespaces) + [url_name])
+
+
+def iter_views(resolver, namespaces=()):
+    """Yields a (callback, view name) tuple for every URL pattern in the resolver."""
+    for pattern in resolver.url_patterns:
+        if hasattr(pattern, 'url_patterns'):
+            nested = namespaces
+            if pattern.namespace:
+                nested += (pattern.namespace,)
+            for view in iter_views(pattern, nested):
+                yield view
+        else:
+            yield pattern.callback, join_view_name(namespaces, pattern.name)
+
+
+def urlconf_name(urlconf=None):
+    """
+    Returns the name of a URLconf module (or of ROOT_URLCONF, if urlconf is None).
+
+    This keys the caches of ResolverPermissionMiddleware, so that they follow
+    changes to ROOT_URLCONF.
+    """
+    if urlconf is None:
+        urlconf = settings.ROOT_URLCONF
+    return getattr(urlconf, '__name__', urlconf)
+
+
+def get_cache_key(urlconf=None):
+    """
+    Returns the key of a URLconf (or of ROOT_URLCONF) in the active language.
+
+    Under i18n_patterns (or translated URL patterns) a path resolves differently in
+    each language, so ResolverPermissionMiddleware caches per language too.
+    """
+    return urlconf_name(urlconf), get_language()
+
+
+def rule_matches(rule, callback, view_name):
+    """
+    Returns True if the rule applies to the view.
+
+    A rule is either a view (function or class), or a string which is matched with
+    shell-style wildcards against the view's name (eg. 'password_reset*' or 'admin:*')
+    and dotted path (eg. 'django.contrib.auth.views.*').
+    """
+    if callable(rule):
+        return rule is callback or rule is getattr(callback, 'view_class', None)
+    if view_name is not None and fnmatchcase(view_name, rule):
+        return True
+    return fnmatchcase(view_path(callback), rule)
+
+
+class ResolverPermissionMiddleware(BasePermissionMiddleware):
+    """
+    Middleware that allows or denies access based on the view a URL resolves to.
+
+    This is the counterpart of UrlPermissionMiddleware for sites that would rather not
+    keep a list of regular expressions in step with their urls.py. Views are exempted
+    or protected by URL name (including namespace), dotted path or the view itself, as
+    described in rule_matches. A view that is both protected and not exempt will have
+    its access controlled by this middleware. URLs that don't resolve are never
+    protected.
+
+    The rules are applied once per URLconf and language, to every view in it, giving a
+    set of protected views. Each request then only needs its (cached) resolved view
+    looked up in that set.
+
+    This class presents two hook methods - get_exempt_views (defaults to returning [])
+    and get_protected_views (defaults to returning ['*'], i.e. all views). For
+    instance, to require a login everywhere but the login and password reset pages:
+
+        class LoginRequiredMiddleware(
+            LoginPermissionMiddlewareMixin,
+            ResolverPermissionMiddleware,
+        ):
+            def get_exempt_views(self):
+                return ['login', 'logout', 'password_reset*']
+
+    The number of paths whose resolved views are cached is set by
+    INCUNA_AUTH_RESOLVE_CACHE_SIZE (default 1000), or by overriding
+    get_resolve_cache_size.
+    """
+    def __init__(self, get_response=None):
+        BasePermissionMiddleware.__init__(self, get_response)
+        self.protected_views = {}
+        self.resolve_cache = LRUCache(self.get_resolve_cache_size())
+        setting_changed.connect(self.clear_caches)
+
+    def clear_caches(self, setting=None, **kwargs):
+        """Forgets the protected views and resolved paths (when ROOT_URLCONF changes)."""
+        if setting is None or setting == 'ROOT_URLCONF':
+            self.protected_views = {}
+            self.resolve_cache.clear()
+
+    def get_exempt_views(self):
+        """
+        Hook method. Returns a list of rules (see rule_matches) for exempt views.
+
+        The default implementation returns [] - no views are exempt.
+        """
+        return []
+
+    def get_protected_views(self):
+        """
+        Hook method. Returns a list of rules (see rule_matches) for protected views.
+
+        The default implementation returns ['*'] - all views are protected.
+        """
+        return ['*']
+
+    def get_resolve_cache_size(self):
+        """Hook method. Returns the number of paths whose resolved views are cached."""
+        return getattr(settings, 'INCUNA_AUTH_RESOLVE_CACHE_SIZE', 1000)
+
+    def get_protected_view_keys(self, urlconf=None):
+        """
+        Returns the set of (callback, view name) tuples of protected views in a URLconf.
+
+        This is worked out once per URLconf and language.
+        """
+        key = get_cache_key(urlconf)
+        protected_views = self.protected_views.get(key)
+        if protected_views is None:
+            exempt_rules = self.get_exempt_views()
+            protected_rules = self.get_protected_views()
+
+            def is_protected(view):
+                if any(rule_matches(rule, *view) for rule in exempt_rules):
+                    return False
+                return any(rule_matches(rule, *view) for rule in protected_rules)
+
+            views = iter_views(get_resolver(urlconf))
+            protected_views = frozenset(filter(is_protected, views))
+            self.protected_views[key] = protected_views
+        return protected_views
+
+    def resolve_view(self, path, urlconf=None):
+        """
+        Returns the (callback, view name) tuple for the view a path resolves to.
+
+        Returns None if the path doesn't resolve. Results are cached per path and
+        language.
+        """
+        key = get_cache_key(urlconf) + (path,)
+        view = self.resolve_cache.get(key, key)
+        if view is not key:
+            return view
+
+        try:
+            match = get_resolver(urlconf).resolve(path)
+        except Resolver404:
+            view = None
+        else:
+            view = (match.func, join_view_name(match.namespaces, match.url_name))
+
+        self.resolve_cache.set(key, view)
+        return view
+
+    def is_resource_protected(self, request, **kwargs):
+        """
+        Returns true if and only if the URL resolves to a protected view.
+        """
+        urlconf = getattr(request, 'urlconf', None)
+        view = self.resolve_view(request.path_info, urlconf)
+        return view is not None and view in self.get_protected_view_keys(urlconf)
@@ -0,0 +1,67 @@
+from django.conf import settings
+from django.http import HttpResponseForbidden
+from django.utils.translation import ugettext_lazy as _
+
+from .permission_feincms import FeinCMSPermissionMiddleware
+from .. import access_rules
+
+
+class RulePermissionMiddleware(FeinCMSPermissionMiddleware):
+    """
+    Middleware that lets users see resources according to rules for their access states.
+
+    Rules say which groups or permissions a user needs to see resources with a given
+    (usually custom) access state. Register them with access_rules.register, or with
+    the STATE_RULES attribute of an AccessStateExtensionMixin subclass:
+
+        class AccessState(AccessStateExtensionMixin, Extension):
+            model = Page
+            CUSTOM_STATES = (
+                ('staff', 'Staff only'),
+                ('members', 'Members group'),
+            )
+            STATE_RULES = {
+                'staff': {'staff': True},
+                'members': {'groups': ['Members']},
+            }
+
+    Resources with any access state that has a rule are protected. Rather than joining
+    the user's groups and permissions on every request, they're kept in the session
+    (see access_rules.get_credentials) until they, or any group, change. That needs a
+    cache shared between processes; see access_rules.get_cache.
+
+    Users who aren't logged in are sent to LOGIN_URL. Logged-in users who don't
+    satisfy a rule get a 403, since logging in again wouldn't help them.
+    """
+    decision_methods = FeinCMSPermissionMiddleware.decision_methods + ('get_rules',)
+
+    def get_rules(self):
+        """Hook method. Returns a dict of access state -> access_rules.AccessRule."""
+        return access_rules.rules
+
+    def get_protected_states(self):
+        """Returns the access states that have rules."""
+        return list(self.get_rules())
+
+    def deny_access_condition(self, request, **kwargs):
+        """Returns True if and only if the user doesn't satisfy the resource's rule."""
+        rule = self.get_rules().get(self._get_request_access_state(request))
+        if rule is None:
+            return False
+
+        user = request.user
+        if not user.is_authenticated:
+            return True
+        return not rule.allows(user, access_rules.get_credentials(request))
+
+    def deny_access(self, request, **kwargs):
+        """Redirects anonymous users to log in, and forbids everyone else."""
+        if request.user.is_authenticated:
+            return HttpResponseForbidden()
+        return FeinCMSPermissionMiddleware.deny_access(self, request, **kwargs)
+
+    def get_unauthorised_redirect_url(self, request):
+        return settings.LOGIN_URL
+
+    def get_access_denied_message(self, request):
+        return _('You do not have permission to view this page.')
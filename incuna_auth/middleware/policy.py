@@ -0,0 +1,419 @@
+import hashlib
+import io
+import json
+import re
+import warnings
+
+from django.utils.encoding import force_text
+from django.utils.functional import cached_property
+
+from .utils import literal_prefix, LRUCache, PrefixIndex
+
+
+EXEMPT = 'exempt'
+PROTECTED = 'protected'
+UNPROTECTED = 'unprotected'
+
+# Bump this whenever the format written by UrlPolicy.to_dict changes.
+POLICY_FILE_VERSION = 1
+
+# Inline flags such as (?i) apply to the whole expression, so a pattern using them
+# can't share a combined expression with other patterns.
+GLOBAL_FLAGS = re.compile(r'\(\?[aiLmsux]+\)')
+
+
+def _rewrite_group(source, i):
+    """
+    Rewrite the group opening at source[i] for use in a combined expression.
+
+    Returns a (replacement, next index) tuple, or None if the group can't be combined.
+    """
+    if source.startswith('(?P<', i):
+        return '(?:', source.index('>', i) + 1
+    if source.startswith('(?P=', i) or source.startswith('(?(', i):
+        return None
+    if source.startswith('(?', i):
+        if GLOBAL_FLAGS.match(source, i):
+            return None
+        return '(', i + 1
+    return '(?:', i + 1
+
+
+def _skip_class(source, i):
+    """Returns the index just past the character class opening at source[i]."""
+    i += 1
+    # A ']' straight after '[' or '[^' is a literal, not the end of the class.
+    if source[i:i + 1] == '^':
+        i += 1
+    if source[i:i + 1] == ']':
+        i += 1
+    while source[i] != ']':
+        i += 2 if source[i] == '\\' else 1
+    return i + 1
+
+
+def as_alternative(pattern):
+    """
+    Return the source of a compiled pattern, ready to be one branch of an alternation.
+
+    Capturing groups (named or not) are made non-capturing, so that the only groups in
+    the combined expression are the ones wrapping each branch.
+
+    Returns None if the pattern can't safely be combined with others: backreferences,
+    conditionals and global inline flags all depend on the rest of the expression.
+    """
+    source = pattern.pattern
+    output = []
+    i = 0
+    while i < len(source):
+        char = source[i]
+
+        if char == '\\':
+            following = source[i + 1:i + 2]
+            if following.isdigit() and following != '0':
+                return None
+            output.append(source[i:i + 2])
+            i += 2
+        elif char == '[':
+            end = _skip_class(source, i)
+            output.append(source[i:end])
+            i = end
+        elif char == '(':
+            rewritten = _rewrite_group(source, i)
+            if rewritten is None:
+                return None
+            replacement, i = rewritten
+            output.append(replacement)
+        else:
+            output.append(char)
+            i += 1
+
+    return ''.join(output)
+
+
+def combine_patterns(patterns):
+    """
+    Combine a list of compiled patterns into a single alternation.
+
+    Each pattern becomes one group of the combined expression, so after a match
+    `match.lastindex - 1` is the index of the pattern that matched. Branches are tried
+    in order, so the first matching pattern in the list always wins.
+
+    Returns None if the patterns can't be combined.
+    """
+    if not patterns:
+        return None
+
+    flags = set(pattern.flags for pattern in patterns)
+    if len(flags) != 1:
+        return None
+
+    alternatives = [as_alternative(pattern) for pattern in patterns]
+    if None in alternatives:
+        return None
+
+    combined = u'|'.join(u'({0})'.format(alternative) for alternative in alternatives)
+    try:
+        return re.compile(combined, flags.pop())
+    except (re.error, AssertionError):
+        # Python 2 raises AssertionError for expressions with over 100 groups.
+        return None
+
+
+def policy_checksum(exempt_urls, protected_urls):
+    """Returns a checksum of the (uncompiled) URL lists a policy is built from."""
+    urls = [
+        POLICY_FILE_VERSION,
+        [force_text(url) for url in exempt_urls],
+        [force_text(url) for url in protected_urls],
+    ]
+    return hashlib.sha256(json.dumps(urls).encode('utf-8')).hexdigest()
+
+
+def pattern_signature(patterns):
+    """Returns what a list of compiled patterns matches: their sources and flags."""
+    return tuple((pattern.pattern, pattern.flags) for pattern in patterns)
+
+
+class LazyPattern(object):
+    """
+    Stands in for a compiled pattern loaded from a policy file.
+
+    The pattern is only compiled if it's actually matched against, which a policy
+    loaded from a file only does for patterns that couldn't be combined.
+    """
+    def __init__(self, pattern, flags):
+        self.pattern = pattern
+        self.flags = flags
+
+    @cached_property
+    def compiled(self):
+        return re.compile(self.pattern, self.flags)
+
+    def match(self, *args, **kwargs):
+        return self.compiled.match(*args, **kwargs)
+
+
+class UrlPolicy(object):
+    """
+    Decides whether a path is exempt, protected or neither, in a single pass.
+
+    Patterns that are just literal prefixes (see utils.literal_prefix) are looked up in
+    a utils.PrefixIndex, which costs the same however many of them there are. The
+    remaining patterns are combined into a single alternation, so a path is matched
+    against them once. Either way, the first pattern to match in the exempt list
+    followed by the protected list decides, so exempt patterns take precedence.
+
+    If the dynamic patterns can't be combined (see as_alternative), the policy falls
+    back to matching them one at a time, with the same result.
+
+    Pass a positive `cache_size` to remember the decisions for that many of the most
+    recently seen paths (see utils.LRUCache); `cache` is None if caching is disabled.
+    """
+    def __init__(self, exempt_patterns, protected_patterns, cache_size=None):
+        self.cache = LRUCache(cache_size) if cache_size else None
+        self.exempt_patterns = exempt_patterns
+        self.protected_patterns = protected_patterns
+        self.signature = (
+            pattern_signature(exempt_patterns),
+            pattern_signature(protected_patterns),
+        )
+
+        self.decisions = (
+            [(EXEMPT, pattern) for pattern in exempt_patterns] +
+            [(PROTECTED, pattern) for pattern in protected_patterns]
+        )
+
+        self.literals = PrefixIndex()
+        self.dynamic_indexes = []
+        for index, (decision, pattern) in enumerate(self.decisions):
+            literal = literal_prefix(pattern)
+            if literal is None:
+                self.dynamic_indexes.append(index)
+            else:
+                text, exact = literal
+                self.literals.add(text, index, exact=exact)
+
+        dynamic_patterns = [self.decisions[i][1] for i in self.dynamic_indexes]
+        self.matcher = combine_patterns(dynamic_patterns)
+
+    @classmethod
+    def from_dict(cls, data, cache_size=None):
+        """
+        Returns a policy from the output of to_dict, without analysing its patterns.
+
+        Only the combined matcher (if any) is compiled straight away.
+        """
+        policy = cls.__new__(cls)
+        policy.cache = LRUCache(cache_size) if cache_size else None
+
+        policy.decisions = [
+            (decision, LazyPattern(pattern, flags))
+            for decision, pattern, flags in data['decisions']
+        ]
+        policy.exempt_patterns = [p for d, p in policy.decisions if d == EXEMPT]
+        policy.protected_patterns = [p for d, p in policy.decisions if d == PROTECTED]
+        policy.signature = (
+            pattern_signature(policy.exempt_patterns),
+            pattern_signature(policy.protected_patterns),
+        )
+
+        policy.literals = PrefixIndex(data['literals'])
+        policy.dynamic_indexes = data['dynamic_indexes']
+        matcher = data['matcher']
+        policy.matcher = matcher and re.compile(*matcher)
+        return policy
+
+    def to_dict(self):
+        """Returns the policy, already analysed, as a JSON-serialisable dictionary."""
+        matcher = self.matcher
+        return {
+            'decisions': [
+                [decision, pattern.pattern, pattern.flags]
+                for decision, pattern in self.decisions
+            ],
+            'literals': self.literals.root,
+            'dynamic_indexes': self.dynamic_indexes,
+            'matcher': matcher and [matcher.pattern, matcher.flags],
+        }
+
+    def built_from(self, exempt_patterns, protected_patterns):
+        """
+        Returns True if the policy was built from these lists, or lists of the same
+        patterns (compared by source and flags).
+        """
+        same_lists = (
+            exempt_patterns is self.exempt_patterns and
+            protected_patterns is self.protected_patterns
+        )
+        if same_lists:
+            return True
+
+        signature = (
+            pattern_signature(exempt_patterns),
+            pattern_signature(protected_patterns),
+        )
+        return signature == self.signature
+
+    def first_dynamic_match(self, path):
+        """Returns the index of the first dynamic pattern matching the path, or None."""
+        if self.matcher is not None:
+            match = self.matcher.match(path)
+            return self.dynamic_indexes[match.lastindex - 1] if match else None
+
+        for index in self.dynamic_indexes:
+            if self.decisions[index][1].match(path):
+                return index
+        return None
+
+    def first_match(self, path):
+        """Returns the index in self.decisions of the first matching pattern, or None."""
+        return self._first_match(path, self.literals.first_match(path))
+
+    def _first_match(self, path, literal):
+        """Like first_match, given the index of the first matching literal pattern."""
+        if literal is not None:
+            # Don't bother matching the dynamic patterns if none of them come first.
+            if not self.dynamic_indexes or literal < self.dynamic_indexes[0]:
+                return literal
+
+        dynamic = self.first_dynamic_match(path)
+        if literal is None or (dynamic is not None and dynamic < literal):
+            return dynamic
+        return literal
+
+    def match(self, path):
+        """
+        Returns a (decision, pattern) tuple for the path.
+
+        The decision is one of EXEMPT, PROTECTED or UNPROTECTED; pattern is the
+        compiled pattern that decided it, or None if no pattern matched.
+        """
+        index = self.first_match(path)
+        if index is None:
+            return UNPROTECTED, None
+        return self.decisions[index]
+
+    def decide(self, path):
+        """Returns EXEMPT, PROTECTED or UNPROTECTED for the path."""
+        if self.cache is None:
+            return self._decide(path)
+
+        decision = self.cache.get(path)
+        if decision is None:
+            decision = self._decide(path)
+            self.cache.set(path, decision)
+        return decision
+
+    def _decide(self, path):
+        literal = self.literals.first_match(path)
+
+        # Every pattern before an exempt one is also exempt, so if an exempt literal
+        # matches there's no need to look for an earlier match.
+        if literal is not None and self.decisions[literal][0] == EXEMPT:
+            return EXEMPT
+
+        index = self._first_match(path, literal)
+        if index is None:
+            return UNPROTECTED
+        return self.decisions[index][0]
+
+    def is_protected(self, path):
+        """Returns True if and only if the path is protected and not exempt."""
+        return self.decide(path) == PROTECTED
+
+    def classify(self, paths):
+        """
+        Yields a (path, decision, pattern) tuple for each path in an iterable.
+
+        Paths are given as in request.path_info, with or without a leading slash;
+        decision and pattern are as returned by match(). Paths are consumed one at a
+        time and the decision cache is bypassed, so any number of them can be
+        classified in constant memory.
+        """
+        for path in paths:
+            decision, pattern = self.match(path.lstrip('/'))
+            yield path, decision, pattern
+
+
+class PagePolicy(object):
+    """
+    Decides whether a path is protected, from the URLs of a tree of CMS pages.
+
+    A path gets the decision of the page with the longest URL it starts with, which is
+    the page FeinCMS's best_match_for_path would find for it. Pages are given as
+    (_cached_url, decision) pairs, and kept in a utils.PrefixIndex, so deciding a path
+    costs the same however many pages there are.
+
+    This has the same interface as UrlPolicy (apart from its cache), so it can be
+    returned by UrlPermissionMiddleware.get_url_policy. The pattern returned by match()
+    is the URL of the deciding page.
+    """
+    def __init__(self, pages=()):
+        self.index = PrefixIndex()
+        for url, decision in pages:
+            self.add(url, decision)
+
+    def add(self, url, decision):
+        """Adds a page, given its URL (such as '/about/') and decision."""
+        text = url.lstrip('/')
+        self.index.add(text, (decision, url))
+        if text:
+            # A page also matches its URL without the trailing slash.
+            self.index.add(text.rstrip('/'), (decision, url), exact=True)
+
+    def match(self, path):
+        """Returns a (decision, URL of the deciding page) tuple for the path."""
+        return self.index.longest_match(path) or (UNPROTECTED, None)
+
+    def decide(self, path):
+        """Returns PROTECTED or UNPROTECTED for the path."""
+        return self.match(path)[0]
+
+    def is_protected(self, path):
+        """Returns True if and only if the path is protected."""
+        return self.decide(path) == PROTECTED
+
+    def classify(self, paths):
+        """Yields a (path, decision, URL) tuple for each path, like UrlPolicy.classify."""
+        for path in paths:
+            decision, url = self.match(path.lstrip('/'))
+            yield path, decision, url
+
+
+def write_policy_file(filename, policy, checksum):
+    """Saves a policy to a file, with the checksum of the URL lists it was built from."""
+    data = dict(policy.to_dict(), version=POLICY_FILE_VERSION, checksum=checksum)
+    with io.open(filename, 'w', encoding='utf-8') as policy_file:
+        policy_file.write(force_text(json.dumps(data, sort_keys=True)))
+
+
+def read_policy_file(filename, checksum, cache_size=None):
+    """
+    Returns the policy saved in a file by write_policy_file.
+
+    Returns None, with a warning, if the file can't be read, is garbled, or was saved
+    from URL lists that don't match the checksum (because the settings have changed
+    since). The caller can then compile the policy from the settings instead.
+    """
+    try:
+        with io.open(filename, encoding='utf-8') as policy_file:
+            data = json.load(policy_file)
+    except (IOError, ValueError) as error:
+        warnings.warn('Could not read URL policy file {0}: {1}'.format(filename, error))
+        return None
+
+    if not isinstance(data, dict):
+        warnings.warn('URL policy file {0} is not a saved policy.'.format(filename))
+        return None
+
+    if data.get('version') != POLICY_FILE_VERSION or data.get('checksum') != checksum:
+        warnings.warn('URL policy file {0} is out of date.'.format(filename))
+        return None
+
+    try:
+        return UrlPolicy.from_dict(data, cache_size=cache_size)
+    except (KeyError, TypeError, ValueError, re.error) as error:
+        message = 'URL policy file {0} is garbled: {1!r}'
+        warnings.warn(message.format(filename, error))
+        return None
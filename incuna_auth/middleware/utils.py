@@ -1,4 +1,6 @@
 import re
+import threading
+from collections import OrderedDict
 
 # Python 2/3 compatibility hackery
 try:
@@ -14,3 +16,198 @@ def compile_url(url):
 
 def compile_urls(urls):
     return [compile_url(expr) for expr in urls]
+
+
+class LazyUrlPatterns(object):
+    """
+    A class attribute holding `compile_urls(get_urls())`, compiled on first access.
+
+    This keeps regex compilation (and the settings lookups get_urls might make) out of
+    import time. Call reset() to have the patterns recompiled on their next access,
+    for instance when the settings they're built from change.
+    """
+    def __init__(self, get_urls):
+        self.get_urls = get_urls
+        self.patterns = None
+
+    def __get__(self, instance, owner):
+        patterns = self.patterns
+        if patterns is None:
+            patterns = self.patterns = compile_urls(self.get_urls())
+        return patterns
+
+    def reset(self):
+        self.patterns = None
+
+
+# Characters that give a regular expression a meaning beyond its literal text.
+METACHARACTERS = frozenset('.^$*+?{}[]|()')
+
+
+def literal_prefix(pattern):
+    """
+    Returns the literal text a compiled URL pattern matches at the start of a path.
+
+    Patterns like r'^static/' or r'^api/public/' (anchored or not, since they're only
+    used with `match`) are really just literal prefixes. Returns a (text, exact) tuple
+    for such patterns, where exact is True if the pattern ends with '$' and so only
+    matches the text itself. Returns None for any other pattern.
+    """
+    if pattern.flags & ~re.UNICODE:
+        return None
+
+    source = pattern.pattern
+    if source.startswith('^'):
+        source = source[1:]
+
+    exact = source.endswith('$') and not source.endswith('\\$')
+    if exact:
+        source = source[:-1]
+
+    text = []
+    characters = iter(source)
+    for char in characters:
+        if char == '\\':
+            char = next(characters, '')
+            if not char or char.isalnum():
+                return None
+        elif char in METACHARACTERS:
+            return None
+        text.append(char)
+
+    return u''.join(text), exact
+
+
+class PrefixIndex(object):
+    """
+    A trie of literal texts, each of which matches either as a prefix or exactly.
+
+    Finding the entries that match a path takes one dictionary lookup per character of
+    the path (at most), however many entries the index holds.
+
+    Nodes are plain dictionaries keyed by single characters. Entries are stored under
+    the PREFIX and EXACT keys, which can't clash with a character.
+    """
+    PREFIX = ''
+    EXACT = '$$'
+
+    def __init__(self, root=None):
+        self.root = {} if root is None else root
+
+    def __bool__(self):
+        return bool(self.root)
+    __nonzero__ = __bool__
+
+    def add(self, text, value, exact=False):
+        """Adds text to the index. An existing value for the same text is kept."""
+        node = self.root
+        for char in text:
+            node = node.setdefault(char, {})
+        node.setdefault(self.EXACT if exact else self.PREFIX, value)
+
+    def matches(self, path):
+        """Yields the values of every entry matching the path, shortest text first."""
+        node = self.root
+        last = len(path) - 1
+        for i, char in enumerate(path):
+            if self.PREFIX in node:
+                yield node[self.PREFIX]
+            # Like the regex '$', an exact entry also matches before a final newline.
+            if i == last and char == '\n' and self.EXACT in node:
+                yield node[self.EXACT]
+            node = node.get(char)
+            if node is None:
+                return
+
+        if self.PREFIX in node:
+            yield node[self.PREFIX]
+        if self.EXACT in node:
+            yield node[self.EXACT]
+
+    def first_match(self, path):
+        """Returns the lowest value of the entries matching the path, or None."""
+        first = None
+        for value in self.matches(path):
+            if first is None or value < first:
+                first = value
+        return first
+
+    def longest_match(self, path):
+        """Returns the value of the longest entry matching the path, or None."""
+        longest = None
+        for longest in self.matches(path):
+            pass
+        return longest
+
+
+class LRUCache(object):
+    """
+    A thread-safe dictionary holding at most `max_size` items.
+
+    When full, the least recently used item is evicted to make room for a new one.
+    Counts hits, misses and evictions so the cache's effectiveness can be checked.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        """Returns the cached value for key (marking it recently used), or default."""
+        with self.lock:
+            try:
+                value = self.data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self.data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Caches value for key, evicting the least recently used item if full."""
+        if self.max_size <= 0:
+            return
+
+        with self.lock:
+            self.data.pop(key, None)
+            if len(self.data) >= self.max_size:
+                self.data.popitem(last=False)
+                self.evictions += 1
+            self.data[key] = value
+
+    def clear(self):
+        """Empties the cache and resets its counters."""
+        with self.lock:
+            self.data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def info(self):
+        """Returns a dictionary of the cache's counters and size."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self.data),
+            'max_size': self.max_size,
+        }
+
+
+def candidate_urls(path):
+    """
+    Returns the _cached_url of every page that could be the best match for the path.
+
+    These are the same URLs FeinCMS's PageManager.best_match_for_path tries: the path
+    itself and each of its parents, down to '/'.
+    """
+    urls = ['/']
+    path = path.strip('/')
+    if path:
+        tokens = path.split('/')
+        for i in range(1, len(tokens) + 1):
+            urls.append('/{0}/'.format('/'.join(tokens[:i])))
+    return urls
@@ -1,5 +1,11 @@
+from django.core.exceptions import ImproperlyConfigured
 from django.db import models
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.utils import six
+from django.utils.functional import cached_property
 from django.utils.six import add_metaclass
+from django.utils.text import format_lazy
+from django.utils.translation import ugettext_lazy, ungettext
 
 # Python 2/3 compatibility hackery
 try:
@@ -9,7 +15,14 @@ except ImportError:
 
 
 class AccessStateSetterMeta(type):
-    """Metaclass that adds (potentially overridden) CUSTOM_STATES to ACCESS_STATES."""
+    """
+    Metaclass that adds (potentially overridden) CUSTOM_STATES to ACCESS_STATES.
+
+    It also numbers the access states, in ACCESS_STATE_CODES (access state -> code),
+    for AccessStateField. The base states come first, so adding custom states never
+    changes their codes. Custom states get their codes from CUSTOM_STATE_CODES, or
+    else from their position in CUSTOM_STATES.
+    """
     def __new__(cls, name, bases, attrs):
         """Create the new class with a complete ACCESS_STATES."""
         custom_states = attrs.get('CUSTOM_STATES', ())
@@ -26,9 +39,52 @@ class AccessStateSetterMeta(type):
             base_states = getattr(base_states_source, base_attr_name)
 
         attrs['ACCESS_STATES'] = custom_states + base_states
+        codes = {state: code for code, (state, label) in enumerate(base_states)}
+        custom_codes = attrs.get('CUSTOM_STATE_CODES', {})
+        for code, (state, label) in enumerate(custom_states, len(base_states)):
+            codes[state] = custom_codes.get(state, code)
+        attrs['ACCESS_STATE_CODES'] = codes
         return super(AccessStateSetterMeta, cls).__new__(cls, name, bases, attrs)
 
 
+class AccessStateField(models.SmallIntegerField):
+    """
+    Stores access states as small integers, while still presenting them as strings.
+
+    `state_codes` maps each access state to its code (see
+    AccessStateExtensionMixin.ACCESS_STATE_CODES). Values are converted on their way to
+    and from the database, so code comparing or filtering on access states works
+    unchanged, but the column (and any index on it) is much smaller.
+    """
+    def __init__(self, *args, **kwargs):
+        self.state_codes = kwargs.pop('state_codes', {})
+        self.state_names = {code: state for state, code in self.state_codes.items()}
+        super(AccessStateField, self).__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(AccessStateField, self).deconstruct()
+        kwargs['state_codes'] = self.state_codes
+        return name, path, args, kwargs
+
+    @cached_property
+    def validators(self):
+        # The integer range validators don't apply to the access states themselves.
+        return list(self._validators)
+
+    def from_db_value(self, value, *args):
+        return self.state_names.get(value, value)
+
+    def to_python(self, value):
+        if isinstance(value, six.string_types) and value.isdigit():
+            value = int(value)
+        return self.state_names.get(value, value)
+
+    def get_prep_value(self, value):
+        return super(AccessStateField, self).get_prep_value(
+            self.state_codes.get(value, value),
+        )
+
+
 @add_metaclass(AccessStateSetterMeta)
 class AccessStateExtensionMixin:
     """
@@ -65,9 +121,33 @@ class AccessStateExtensionMixin:
     - visible only to logged-in users
     - visible to everyone who can see the page's parent, or all users if no parents exist
     - any CUSTOM_STATES added by the class/application extending this mixin
+
+    STATE_RULES maps access states to the groups or permissions needed to see
+    resources with them (see incuna_auth.access_rules.register), for
+    incuna_auth.middleware.permission_rules.RulePermissionMiddleware.
+
+    Set INTEGER_ACCESS_STATES to True to store access states as small integers in an
+    indexed column (see AccessStateField) instead of as strings. The base states are 0
+    to 2, and each custom state must be given its own code in CUSTOM_STATE_CODES (say,
+    {'state1': 10, 'state2': 11}), so that reordering or removing CUSTOM_STATES never
+    changes what stored codes mean. Never reuse a code once data has been stored with
+    it. states_mask and mask_states convert lists of access states to and from
+    bitmasks of their codes.
+
+    Set EFFECTIVE_ACCESS_STATE to True to also add an indexed effective_access_state
+    field to the model (which must be an MPTT model, as FeinCMS pages are). It holds
+    the access state each resource ends up with once STATE_INHERIT has been followed
+    up the tree, and is kept up to date whenever resources are saved or moved. This
+    saves the middleware from following inheritance on every request, and makes
+    listing resources with a given access state a simple filter. Existing resources
+    can be brought up to date with incuna_auth.access_states.rebuild_effective_states.
     """
     model = None
     CUSTOM_STATES = ()
+    CUSTOM_STATE_CODES = {}
+    STATE_RULES = {}
+    EFFECTIVE_ACCESS_STATE = False
+    INTEGER_ACCESS_STATES = False
 
     STATE_ALL_ALLOWED = 'base_all'
     STATE_AUTH_ONLY = 'base_auth'
@@ -78,16 +158,138 @@ class AccessStateExtensionMixin:
         (STATE_INHERIT, 'Inherit from parent (allow all users if no parent exists)'),
     )
 
+    @classmethod
+    def states_mask(cls, access_states):
+        """Returns a bitmask with the bit for each of the access states set."""
+        mask = 0
+        for access_state in access_states:
+            mask |= 1 << cls.ACCESS_STATE_CODES[access_state]
+        return mask
+
+    @classmethod
+    def mask_states(cls, mask):
+        """Returns the list of access states whose bits are set in a bitmask."""
+        return [
+            state for state, code in cls.ACCESS_STATE_CODES.items() if mask & (1 << code)
+        ]
+
+    def check_state_codes(self):
+        """
+        Raise ImproperlyConfigured unless every custom state has its own code in
+        CUSTOM_STATE_CODES, as INTEGER_ACCESS_STATES needs.
+        """
+        missing = [
+            state for state, label in self.CUSTOM_STATES
+            if state not in self.CUSTOM_STATE_CODES
+        ]
+        if missing:
+            message = (
+                'CUSTOM_STATE_CODES must give each custom access state a code when '
+                'INTEGER_ACCESS_STATES is set. Missing: {0}'
+            )
+            raise ImproperlyConfigured(message.format(', '.join(missing)))
+
+        codes = list(self.ACCESS_STATE_CODES.values())
+        if len(set(codes)) != len(codes):
+            raise ImproperlyConfigured(
+                'Access state codes must be unique (the base states use 0 to {0}).'
+                .format(len(self.BASE_ACCESS_STATES) - 1)
+            )
+
+    def make_access_state_field(self, **kwargs):
+        """Returns a field for access states, as set by INTEGER_ACCESS_STATES."""
+        if self.INTEGER_ACCESS_STATES:
+            self.check_state_codes()
+            kwargs.setdefault('db_index', True)
+            return AccessStateField(
+                choices=self.ACCESS_STATES,
+                state_codes=self.ACCESS_STATE_CODES,
+                **kwargs
+            )
+        return models.CharField(max_length=255, choices=self.ACCESS_STATES, **kwargs)
+
     def handle_model(self):
         """Add the ACCESS_STATES choices and the field using them to the model."""
-        access_state = models.CharField(
-            max_length=255,
-            choices=self.ACCESS_STATES,
-            default=self.STATE_INHERIT,
-        )
+        access_state = self.make_access_state_field(default=self.STATE_INHERIT)
         self.model.add_to_class('ACCESS_STATES', self.ACCESS_STATES)
         self.model.add_to_class('access_state', access_state)
+        self.connect_cache_invalidation()
+        self.register_state_rules()
+
+        if self.EFFECTIVE_ACCESS_STATE:
+            self.add_effective_access_state()
+
+    def register_state_rules(self):
+        """Register STATE_RULES with access_rules, for RulePermissionMiddleware."""
+        if not self.STATE_RULES:
+            return
+
+        from . import access_rules
+        for access_state, rule in self.STATE_RULES.items():
+            access_rules.register(access_state, **rule)
+
+    def connect_cache_invalidation(self):
+        """Invalidate cached access states whenever a resource is changed."""
+        from . import access_state_cache
+
+        receiver = access_state_cache.bump_generation
+        post_save.connect(receiver, sender=self.model)
+        post_delete.connect(receiver, sender=self.model)
+        try:
+            from mptt.signals import node_moved
+        except ImportError:
+            pass
+        else:
+            node_moved.connect(receiver, sender=self.model)
+
+    def add_effective_access_state(self):
+        """Add the effective_access_state field, and the receivers that maintain it."""
+        from mptt.signals import node_moved
+        from . import access_states
+
+        effective_access_state = self.make_access_state_field(
+            default=self.STATE_ALL_ALLOWED,
+            db_index=True,
+            editable=False,
+        )
+        self.model.add_to_class('effective_access_state', effective_access_state)
+
+        pre_save.connect(access_states.set_effective_state, sender=self.model)
+        post_save.connect(access_states.update_descendant_states, sender=self.model)
+        node_moved.connect(access_states.update_moved_states, sender=self.model)
 
     def handle_modeladmin(self, modeladmin):
-        """Ensure the model admin gets the access state option too."""
+        """
+        Ensure the model admin gets the access state option too.
+
+        For MPTT models, also add an action for each access state that sets it on the
+        selected resources and all their descendants at once.
+        """
         modeladmin.add_extension_options('access_state')
+
+        if hasattr(self.model, '_mptt_meta'):
+            actions = [
+                self.make_subtree_action(state, label)
+                for state, label in self.ACCESS_STATES
+            ]
+            modeladmin.actions = list(modeladmin.actions or []) + actions
+
+    def make_subtree_action(self, access_state, label):
+        """Returns an admin action setting access_state on whole subtrees."""
+        from . import access_states
+
+        def action(modeladmin, request, queryset):
+            count = access_states.set_subtree_access_state(queryset, access_state)
+            message = ungettext(
+                'Updated the access state of %(count)d resource.',
+                'Updated the access state of %(count)d resources.',
+                count,
+            )
+            modeladmin.message_user(request, message % {'count': count})
+
+        action.__name__ = str('set_subtree_access_state_{0}'.format(access_state))
+        action.short_description = format_lazy(
+            ugettext_lazy('Set access state, including descendants, to "{0}"'),
+            label,
+        )
+        return action
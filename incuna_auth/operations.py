@@ -0,0 +1,59 @@
+from django.conf import settings
+from django.db.backends.utils import truncate_name
+from django.db.migrations.operations.base import Operation
+
+
+class CreateLowerEmailIndex(Operation):
+    """
+    Migration operation adding an index on LOWER(email) to the user model's table.
+
+    That's the index INCUNA_AUTH_EMAIL_LOOKUP = 'lower' uses (see
+    backends.CustomUserModelBackend). Add it to a migration in one of your apps that
+    depends on the user model's:
+
+        dependencies = [migrations.swappable_dependency(settings.AUTH_USER_MODEL)]
+        operations = [CreateLowerEmailIndex()]
+
+    The index is on the column of the `field` (default 'email') of `model` (default
+    AUTH_USER_MODEL), as they are at that point in the migrations. Expression indexes
+    like this are supported by PostgreSQL and SQLite.
+    """
+    reduces_to_sql = True
+    reversible = True
+
+    def __init__(self, model=None, field='email', name=None):
+        self.model = model
+        self.field = field
+        self.name = name
+
+    def state_forwards(self, app_label, state):
+        pass
+
+    def get_table_and_column(self, state):
+        model = state.apps.get_model(self.model or settings.AUTH_USER_MODEL)
+        return model._meta.db_table, model._meta.get_field(self.field).column
+
+    def get_index_name(self, schema_editor, table, column):
+        name = self.name or '{0}_{1}_lower'.format(table, column)
+        return truncate_name(name, schema_editor.connection.ops.max_name_length())
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        table, column = self.get_table_and_column(to_state)
+        name = self.get_index_name(schema_editor, table, column)
+        quote_name = schema_editor.quote_name
+        schema_editor.execute('CREATE INDEX {0} ON {1} (LOWER({2}))'.format(
+            quote_name(name),
+            quote_name(table),
+            quote_name(column),
+        ))
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        table, column = self.get_table_and_column(from_state)
+        name = self.get_index_name(schema_editor, table, column)
+        schema_editor.execute(schema_editor.sql_delete_index % {
+            'name': schema_editor.quote_name(name),
+            'table': schema_editor.quote_name(table),
+        })
+
+    def describe(self):
+        return 'Create an index on LOWER({0})'.format(self.field)
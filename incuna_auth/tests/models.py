@@ -0,0 +1,95 @@
+from django.db import models
+from django.dispatch import Signal
+
+from incuna_auth.models import AccessStateExtensionMixin as AccessState, AccessStateField
+
+
+class TreeOptions(object):
+    """The attributes of django-mptt's MPTTOptions that incuna_auth uses."""
+    tree_id_attr = 'tree_id'
+    left_attr = 'lft'
+    right_attr = 'rght'
+    level_attr = 'level'
+
+
+# Stands in for django-mptt's mptt.signals.node_moved, as django-mptt isn't installed.
+node_moved = Signal(providing_args=['instance', 'target', 'position'])
+
+
+class BaseTreePage(models.Model):
+    """A resource stored as a tree the way django-mptt does."""
+    parent = models.ForeignKey(
+        'self',
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        related_name='children',
+    )
+    tree_id = models.PositiveIntegerField(default=1)
+    lft = models.PositiveIntegerField(default=0)
+    rght = models.PositiveIntegerField(default=0)
+    level = models.PositiveIntegerField(default=0)
+
+    _mptt_meta = TreeOptions()
+
+    class Meta:
+        abstract = True
+
+
+class TreePage(BaseTreePage):
+    """A resource with an access state."""
+    access_state = models.CharField(
+        max_length=255,
+        choices=AccessState.BASE_ACCESS_STATES,
+        default=AccessState.STATE_INHERIT,
+    )
+
+
+class IntegerTreePage(BaseTreePage):
+    """A resource with an access state stored as an integer."""
+    access_state = AccessStateField(
+        choices=AccessState.BASE_ACCESS_STATES,
+        state_codes=AccessState.ACCESS_STATE_CODES,
+        default=AccessState.STATE_INHERIT,
+        db_index=True,
+    )
+
+
+class MPTTTreePage(BaseTreePage):
+    """
+    A resource with an access state, an effective access state and the methods of
+    django-mptt's MPTTModel that incuna_auth uses.
+    """
+    access_state = models.CharField(
+        max_length=255,
+        choices=AccessState.BASE_ACCESS_STATES,
+        default=AccessState.STATE_INHERIT,
+    )
+    effective_access_state = models.CharField(
+        max_length=255,
+        choices=AccessState.BASE_ACCESS_STATES,
+        default=AccessState.STATE_ALL_ALLOWED,
+        db_index=True,
+        editable=False,
+    )
+
+    def get_ancestors(self, ascending=False):
+        ancestors = type(self)._base_manager.filter(
+            tree_id=self.tree_id,
+            lft__lt=self.lft,
+            rght__gt=self.rght,
+        )
+        return ancestors.order_by('-lft' if ascending else 'lft')
+
+    def get_descendants(self, include_self=False):
+        descendants = type(self)._base_manager.filter(
+            tree_id=self.tree_id,
+            lft__gte=self.lft,
+            rght__lte=self.rght,
+        )
+        if not include_self:
+            descendants = descendants.exclude(pk=self.pk)
+        return descendants.order_by('lft')
+
+    def is_leaf_node(self):
+        return self.rght - self.lft == 1
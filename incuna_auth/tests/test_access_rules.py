@@ -0,0 +1,139 @@
+import mock
+from django.apps import apps
+from django.contrib.auth.models import AnonymousUser, Group, Permission
+from django.core.cache import caches
+from django.db.models.signals import post_save
+from django.test import TestCase
+
+from incuna_auth import access_rules
+from .factories import UserFactory
+from .utils import RequestTestCase
+
+
+class TestAccessRule(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.user = UserFactory.create()
+        self.group = Group.objects.create(name='Members')
+
+    def allows(self, rule, user=None):
+        user = self.user if user is None else user
+        generation = access_rules.get_generation()
+        credentials = access_rules.Credentials.for_user(user, generation)
+        return rule.allows(user, credentials)
+
+    def test_anonymous(self):
+        self.assertFalse(self.allows(access_rules.AccessRule(), AnonymousUser()))
+
+    def test_inactive(self):
+        self.user.is_active = False
+        self.assertFalse(self.allows(access_rules.AccessRule()))
+
+    def test_groups(self):
+        rule = access_rules.AccessRule(groups=['Members', 'Other'])
+        self.assertFalse(self.allows(rule))
+        self.user.groups.add(self.group)
+        self.assertTrue(self.allows(rule))
+
+    def test_permissions(self):
+        permission = Permission.objects.get(codename='change_group')
+        rule = access_rules.AccessRule(permissions=['auth.change_group'])
+        self.assertFalse(self.allows(rule))
+
+        self.group.permissions.add(permission)
+        self.user.groups.add(self.group)
+        self.user = type(self.user).objects.get(pk=self.user.pk)
+        self.assertTrue(self.allows(rule))
+
+    def test_staff(self):
+        rule = access_rules.AccessRule(staff=True)
+        self.assertFalse(self.allows(rule))
+        self.user.is_staff = True
+        self.assertTrue(self.allows(rule))
+
+    def test_superuser(self):
+        rule = access_rules.AccessRule(groups=['Members'], staff=True)
+        self.user.is_superuser = True
+        self.assertTrue(self.allows(rule))
+
+    def test_register(self):
+        self.addCleanup(access_rules.rules.pop, 'members')
+        access_rules.register('members', groups=['Members'])
+        self.assertEqual(access_rules.rules['members'].groups, ('Members',))
+
+
+class TestGetCredentials(RequestTestCase):
+    def setUp(self):
+        caches['default'].clear()
+        # The locmem default cache stands in for a shared one.
+        patcher = mock.patch.object(access_rules, 'get_cache')
+        patcher.start().return_value = caches['default']
+        self.addCleanup(patcher.stop)
+        self.group = Group.objects.create(name='Members')
+        self.request = self.create_request(add_session=True)
+        self.request.user.groups.add(self.group)
+
+    def next_request(self):
+        """Returns a new request in the same session."""
+        request = self.create_request(user=self.request.user)
+        request.session = self.request.session
+        return request
+
+    def test_get_credentials(self):
+        credentials = access_rules.get_credentials(self.request)
+        self.assertEqual(credentials.group_ids, {self.group.pk})
+        self.assertIs(access_rules.get_credentials(self.request), credentials)
+
+    def test_saved_in_session(self):
+        access_rules.get_credentials(self.request)
+        with self.assertNumQueries(0):
+            credentials = access_rules.get_credentials(self.next_request())
+        self.assertEqual(credentials.group_ids, {self.group.pk})
+
+    def test_group_change(self):
+        """Assert that changing groups invalidates saved credentials."""
+        access_rules.get_credentials(self.request)
+        self.request.user.groups.remove(self.group)
+        credentials = access_rules.get_credentials(self.next_request())
+        self.assertEqual(credentials.group_ids, set())
+
+    def test_other_user(self):
+        """Assert that credentials saved for one user aren't used for another."""
+        access_rules.get_credentials(self.request)
+        request = self.create_request()
+        request.session = self.request.session
+        self.assertEqual(access_rules.get_credentials(request).group_ids, set())
+
+
+class TestGetCredentialsNoSharedCache(RequestTestCase):
+    def setUp(self):
+        self.request = self.create_request(add_session=True)
+
+    def test_get_cache(self):
+        self.assertIsNone(access_rules.get_cache())
+
+    def test_not_saved_in_session(self):
+        """Assert that credentials can't outlive changes other processes make."""
+        access_rules.get_credentials(self.request)
+        self.assertNotIn(access_rules.SESSION_KEY, self.request.session)
+
+    def test_group_ids_not_kept(self):
+        group = Group.objects.create(name='Members')
+        rule = access_rules.AccessRule(groups=['Members'])
+        self.assertEqual(rule.get_group_ids(None), {group.pk})
+        group.delete()
+        self.assertEqual(rule.get_group_ids(None), set())
+
+
+class TestConnectReceivers(TestCase):
+    def test_connected_when_ready(self):
+        """Assert that the receivers are connected by the app config, not on import."""
+        config = apps.get_app_config('incuna_auth')
+        with mock.patch.object(access_rules, 'connect_receivers') as connect:
+            config.ready()
+        connect.assert_called_once_with()
+
+    def test_connected_once(self):
+        receivers = len(post_save._live_receivers(Group))
+        access_rules.connect_receivers()
+        self.assertEqual(len(post_save._live_receivers(Group)), receivers)
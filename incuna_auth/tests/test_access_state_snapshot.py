@@ -0,0 +1,111 @@
+import mock
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.test import override_settings, TestCase
+
+from incuna_auth import access_state_cache, access_state_snapshot
+from incuna_auth.middleware.policy import PROTECTED, UNPROTECTED
+from incuna_auth.models import AccessStateExtensionMixin as AccessState
+
+
+ALL = AccessState.STATE_ALL_ALLOWED
+AUTH = AccessState.STATE_AUTH_ONLY
+INHERIT = AccessState.STATE_INHERIT
+CUSTOM = 'custom'
+
+
+class TestAccessStateSnapshot(TestCase):
+    rows = [
+        (1, None, INHERIT, '/'),
+        (2, 1, AUTH, '/members/'),
+        (3, 2, INHERIT, '/members/news/'),
+        (4, 1, INHERIT, '/about/'),
+        (5, 4, CUSTOM, '/about/team/'),
+        (6, 5, INHERIT, '/about/team/hidden/'),
+        (7, 6, ALL, '/about/team/hidden/page/'),
+    ]
+    active_pks = {1, 2, 3, 4, 5, 7}
+
+    def setUp(self):
+        self.snapshot = access_state_snapshot.AccessStateSnapshot(
+            self.rows,
+            self.active_pks,
+        )
+
+    def test_arrays(self):
+        self.assertEqual(list(self.snapshot.parents), [-1, 0, 1, 0, 3, 4, 5])
+        effective_states = [
+            self.snapshot.state_names[code] for code in self.snapshot.effective_states
+        ]
+        self.assertEqual(effective_states, [ALL, AUTH, AUTH, ALL, CUSTOM, CUSTOM, ALL])
+
+    def test_get_access_state(self):
+        get_access_state = self.snapshot.get_access_state
+        self.assertEqual(get_access_state('/'), ALL)
+        self.assertEqual(get_access_state('/members/'), AUTH)
+        self.assertEqual(get_access_state('/members/news/'), AUTH)
+        self.assertEqual(get_access_state('/about/team/'), CUSTOM)
+
+    def test_best_match(self):
+        """Assert that a path gets the state of the page with the longest matching URL."""
+        self.assertEqual(self.snapshot.get_access_state('/members/news/2018/'), AUTH)
+        self.assertEqual(self.snapshot.get_access_state('/other/'), ALL)
+
+    def test_inactive(self):
+        """Assert that inactive pages are skipped, as are their descendants."""
+        self.assertEqual(self.snapshot.get_access_state('/about/team/hidden/'), CUSTOM)
+        self.assertIsNone(self.snapshot.get_access_state('/about/team/hidden/page/'))
+
+    def test_page_policy(self):
+        """Assert that the exported policy decides paths as the snapshot would."""
+        page_policy = self.snapshot.page_policy([AUTH, CUSTOM, ALL])
+        paths = {
+            'members/news/2018/': PROTECTED,
+            'about/': UNPROTECTED,
+            'about/team/': PROTECTED,
+            'about/team/hidden/': PROTECTED,
+            'about/team/hidden/page/': UNPROTECTED,
+            'other/': UNPROTECTED,
+        }
+        for path, decision in paths.items():
+            self.assertEqual(page_policy.decide(path), decision, path)
+
+    def test_no_page(self):
+        snapshot = access_state_snapshot.AccessStateSnapshot(self.rows[1:3], {2, 3})
+        self.assertIsNone(snapshot.get_access_state('/other/'))
+        self.assertEqual(snapshot.get_access_state('/members/'), AUTH)
+
+
+@override_settings(INCUNA_AUTH_ACCESS_STATE_CACHE='default')
+class TestGetSnapshot(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        access_state_snapshot.snapshots.clear()
+        self.addCleanup(access_state_snapshot.snapshots.clear)
+        self.model = mock.MagicMock()
+
+    def get_snapshot(self):
+        from_model = 'incuna_auth.access_state_snapshot.AccessStateSnapshot.from_model'
+        with mock.patch(from_model) as from_model:
+            from_model.side_effect = lambda model, version: mock.Mock(version=version)
+            snapshot = access_state_snapshot.get_snapshot(self.model)
+        return snapshot, from_model.call_count
+
+    def test_reused(self):
+        snapshot, builds = self.get_snapshot()
+        self.assertEqual(builds, 1)
+        self.assertEqual(self.get_snapshot(), (snapshot, 0))
+
+    def test_rebuilt(self):
+        """Assert that the snapshot is rebuilt after a page changes."""
+        snapshot, builds = self.get_snapshot()
+        access_state_cache.invalidate()
+        new_snapshot, builds = self.get_snapshot()
+        self.assertNotEqual(new_snapshot, snapshot)
+        self.assertEqual(builds, 1)
+
+    @override_settings(INCUNA_AUTH_ACCESS_STATE_CACHE=None)
+    def test_no_shared_cache(self):
+        """Assert that snapshots can't be used without a cache to version them."""
+        with self.assertRaises(ImproperlyConfigured):
+            self.get_snapshot()
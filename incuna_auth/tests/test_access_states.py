@@ -0,0 +1,411 @@
+import mock
+from django.contrib.auth.models import AnonymousUser
+from django.db import models
+from django.db.models import F
+from django.db.models.signals import post_save, pre_save
+from django.test import TestCase
+
+from incuna_auth import access_states
+from incuna_auth.models import AccessStateExtensionMixin as AccessState
+from .factories import UserFactory
+from .models import IntegerTreePage, MPTTTreePage, node_moved, TreePage
+
+
+ALL = AccessState.STATE_ALL_ALLOWED
+AUTH = AccessState.STATE_AUTH_ONLY
+INHERIT = AccessState.STATE_INHERIT
+
+
+class TestEffectiveStates(TestCase):
+    def test_effective_states(self):
+        rows = [
+            (1, None, INHERIT),
+            (2, 1, AUTH),
+            (3, 2, INHERIT),
+            (4, 3, INHERIT),
+            (5, 1, INHERIT),
+            (6, None, AUTH),
+            (7, 6, ALL),
+        ]
+        expected = {ALL: [1, 5, 7], AUTH: [2, 3, 4, 6]}
+        self.assertEqual(access_states.effective_states(rows), expected)
+
+    def test_effective_states_parent_state(self):
+        """Assert that resources whose parent isn't given inherit parent_state."""
+        rows = [(3, 2, INHERIT), (4, 3, ALL)]
+        expected = {AUTH: [3], ALL: [4]}
+        self.assertEqual(access_states.effective_states(rows, AUTH), expected)
+
+    def test_bulk_update_effective_states(self):
+        model = mock.MagicMock()
+        pks = list(range(access_states.UPDATE_BATCH_SIZE + 1))
+        access_states.bulk_update_effective_states(model, {AUTH: pks})
+
+        manager = model._base_manager
+        self.assertEqual(manager.filter.call_count, 2)
+        manager.filter.assert_called_with(pk__in=pks[-1:])
+        manager.filter.return_value.update.assert_called_with(
+            effective_access_state=AUTH,
+        )
+
+
+class TestReceivers(TestCase):
+    def make_page(self, access_state, pk=1, parent_id=None):
+        page = mock.MagicMock(pk=pk, parent_id=parent_id, access_state=access_state)
+        page._effective_access_state_changed = False
+        return page
+
+    def set_effective_state(self, page, database_states):
+        """Call set_effective_state, with the given effective states in the database."""
+        sender = mock.MagicMock()
+        values_list = sender._base_manager.filter.return_value.values_list
+        values_list.return_value.first.side_effect = database_states
+        type(page)._base_manager = sender._base_manager
+        access_states.set_effective_state(sender, page)
+
+    def test_set_effective_state(self):
+        page = self.make_page(AUTH)
+        self.set_effective_state(page, [AUTH])
+        self.assertEqual(page.effective_access_state, AUTH)
+        self.assertFalse(page._effective_access_state_changed)
+
+    def test_set_effective_state_inherited(self):
+        page = self.make_page(INHERIT, parent_id=2)
+        self.set_effective_state(page, [AUTH, ALL])
+        self.assertEqual(page.effective_access_state, AUTH)
+        self.assertTrue(page._effective_access_state_changed)
+
+    def test_set_effective_state_root(self):
+        page = self.make_page(INHERIT, pk=None)
+        self.set_effective_state(page, [])
+        self.assertEqual(page.effective_access_state, ALL)
+        self.assertTrue(page._effective_access_state_changed)
+
+    def test_set_effective_state_raw(self):
+        page = self.make_page(AUTH)
+        access_states.set_effective_state(mock.MagicMock(), page, raw=True)
+        self.assertFalse(page._effective_access_state_changed)
+
+    def test_update_descendant_states(self):
+        page = self.make_page(AUTH)
+        page.is_leaf_node.return_value = False
+        page._effective_access_state_changed = True
+        page.effective_access_state = AUTH
+        values_list = page.get_descendants.return_value.order_by.return_value.values_list
+        values_list.return_value = [(2, 1, INHERIT)]
+
+        with mock.patch.object(access_states, 'bulk_update_effective_states') as update:
+            access_states.update_descendant_states(type(page), page)
+
+        page.get_descendants.assert_called_once_with(include_self=False)
+        update.assert_called_once_with(type(page), {AUTH: [2]})
+
+    def test_update_descendant_states_unchanged(self):
+        page = self.make_page(AUTH)
+        page.is_leaf_node.return_value = False
+        access_states.update_descendant_states(type(page), page)
+        self.assertFalse(page.get_descendants.called)
+
+    def test_update_descendant_states_update_fields(self):
+        """Assert that the page's own state is saved, even if update_fields omit it."""
+        page = self.make_page(AUTH)
+        page.is_leaf_node.return_value = True
+        page._effective_access_state_changed = True
+        page.effective_access_state = AUTH
+        sender = mock.MagicMock()
+        access_states.update_descendant_states(
+            sender,
+            page,
+            update_fields=frozenset(['access_state']),
+        )
+        sender._base_manager.filter.assert_called_once_with(pk=1)
+        sender._base_manager.filter.return_value.update.assert_called_once_with(
+            effective_access_state=AUTH,
+        )
+
+    def test_update_descendant_states_leaf(self):
+        page = self.make_page(AUTH)
+        page.is_leaf_node.return_value = True
+        page._effective_access_state_changed = True
+        access_states.update_descendant_states(type(page), page)
+        self.assertFalse(page.get_descendants.called)
+
+
+def make_tree(children, parent=None, tree_id=1, left=1, level=0, model=TreePage):
+    """
+    Saves a tree of pages, numbered as django-mptt would, from nested lists.
+
+    `children` is a list of (name, access_state, children) tuples. Returns the next
+    left value and a dictionary of name -> page.
+    """
+    pages = {}
+    for name, access_state, grandchildren in children:
+        page = model.objects.create(
+            parent=parent,
+            access_state=access_state,
+            tree_id=tree_id,
+            lft=left,
+            level=level,
+        )
+        left, descendants = make_tree(
+            grandchildren,
+            page,
+            tree_id,
+            left + 1,
+            level + 1,
+            model,
+        )
+        page.rght = left
+        page.save()
+        pages[name] = page
+        pages.update(descendants)
+        left += 1
+    return left, pages
+
+
+def move_subtree(page, target):
+    """
+    Moves a page and its descendants to another tree, as the last child of `target`.
+
+    The tree is renumbered with UPDATEs and node_moved is sent, as django-mptt does.
+    """
+    pages = type(page)._base_manager
+    size = page.rght - page.lft + 1
+    subtree = list(page.get_descendants(include_self=True).values_list('pk', flat=True))
+
+    # Close the gap the subtree leaves, and open one for it after target's children.
+    old_tree = pages.filter(tree_id=page.tree_id).exclude(pk__in=subtree)
+    old_tree.filter(lft__gt=page.rght).update(lft=F('lft') - size)
+    old_tree.filter(rght__gt=page.rght).update(rght=F('rght') - size)
+    new_tree = pages.filter(tree_id=target.tree_id)
+    new_tree.filter(lft__gt=target.rght).update(lft=F('lft') + size)
+    new_tree.filter(rght__gte=target.rght).update(rght=F('rght') + size)
+
+    offset = target.rght - page.lft
+    pages.filter(pk__in=subtree).update(
+        tree_id=target.tree_id,
+        lft=F('lft') + offset,
+        rght=F('rght') + offset,
+        level=F('level') + target.level + 1 - page.level,
+    )
+    pages.filter(pk=page.pk).update(parent=target)
+    page.refresh_from_db()
+    target.refresh_from_db()
+    model = type(page)
+    node_moved.send(sender=model, instance=page, target=target, position='last-child')
+
+
+def connect_effective_state_receivers(test_case, model=MPTTTreePage):
+    """Connects the receivers that EFFECTIVE_ACCESS_STATE would, until the test ends."""
+    receivers = (
+        (pre_save, access_states.set_effective_state),
+        (post_save, access_states.update_descendant_states),
+        (node_moved, access_states.update_moved_states),
+    )
+    for signal, receiver in receivers:
+        signal.connect(receiver, sender=model)
+        test_case.addCleanup(signal.disconnect, receiver, sender=model)
+
+
+class TestVisibleTo(TestCase):
+    model = TreePage
+
+    def setUp(self):
+        _, self.pages = make_tree(model=self.model, children=[
+            ('home', INHERIT, [
+                ('members', AUTH, [
+                    ('news', INHERIT, [
+                        ('public', ALL, []),
+                    ]),
+                ]),
+                ('about', INHERIT, []),
+            ]),
+        ])
+        _, other_tree = make_tree([('private', AUTH, [])], tree_id=2, model=self.model)
+        self.pages.update(other_tree)
+
+    def assertVisible(self, queryset, names):
+        expected = sorted(self.pages[name].pk for name in names)
+        self.assertEqual(sorted(queryset.values_list('pk', flat=True)), expected)
+
+    def test_anonymous(self):
+        visible = access_states.visible_to(self.model.objects.all(), AnonymousUser())
+        self.assertVisible(visible, ['home', 'public', 'about'])
+
+    def test_authenticated(self):
+        visible = access_states.visible_to(self.model.objects.all(), UserFactory.create())
+        self.assertVisible(visible, self.pages)
+
+    def test_protected_states(self):
+        visible = access_states.visible_to(
+            self.model.objects.all(),
+            AnonymousUser(),
+            protected_states=[ALL, INHERIT],
+        )
+        self.assertVisible(visible, self.pages)
+
+    def test_effective_access_state_field(self):
+        """Assert that an effective_access_state field is used if there is one."""
+        model = mock.MagicMock()
+        model._meta.get_fields.return_value = [mock.Mock()]
+        model._meta.get_fields.return_value[0].name = 'effective_access_state'
+
+        expression = access_states.effective_access_state(model)
+
+        self.assertEqual(expression.source_expressions[0].name, 'effective_access_state')
+        self.assertFalse(model._base_manager.filter.called)
+
+    def test_one_query(self):
+        with self.assertNumQueries(1):
+            list(access_states.visible_to(self.model.objects.all(), AnonymousUser()))
+
+    def test_queryset_mixin(self):
+        class QuerySet(access_states.AccessStateQuerySetMixin, models.QuerySet):
+            pass
+
+        queryset = QuerySet(model=self.model).filter(level__gt=0)
+        self.assertVisible(queryset.visible_to(AnonymousUser()), ['public', 'about'])
+
+
+class TestGetInheritedAccessStates(TestCase):
+    model = TreePage
+
+    def setUp(self):
+        _, self.pages = make_tree(model=self.model, children=[
+            ('home', INHERIT, [
+                ('members', AUTH, [
+                    ('news', INHERIT, [
+                        ('story', INHERIT, []),
+                        ('public', ALL, []),
+                    ]),
+                ]),
+                ('about', INHERIT, []),
+            ]),
+        ])
+
+    def get_states(self, *names):
+        pks = [self.pages[name].pk for name in names]
+        states = access_states.get_inherited_access_states(self.model, pks)
+        return [states[pk] for pk in pks]
+
+    def test_supported(self):
+        self.assertTrue(access_states.supports_recursive_cte(self.model))
+
+    def test_get_inherited_access_states(self):
+        names = ('home', 'members', 'news', 'story', 'public', 'about')
+        with self.assertNumQueries(1):
+            states = self.get_states(*names)
+        self.assertEqual(states, [INHERIT, AUTH, AUTH, AUTH, ALL, INHERIT])
+
+    def test_batches(self):
+        with mock.patch.object(access_states, 'LOOKUP_BATCH_SIZE', 2):
+            with self.assertNumQueries(2):
+                states = self.get_states('story', 'public', 'about')
+        self.assertEqual(states, [AUTH, ALL, INHERIT])
+
+
+class TestSetSubtreeAccessState(TestCase):
+    def setUp(self):
+        _, self.pages = make_tree([
+            ('home', INHERIT, [
+                ('members', ALL, [
+                    ('news', INHERIT, [
+                        ('public', ALL, []),
+                    ]),
+                ]),
+                ('about', INHERIT, []),
+            ]),
+        ])
+        _, other_tree = make_tree([('other', INHERIT, [])], tree_id=2)
+        self.pages.update(other_tree)
+
+    def get_states(self):
+        states = dict(TreePage.objects.values_list('pk', 'access_state'))
+        return {name: states[page.pk] for name, page in self.pages.items()}
+
+    def select(self, *names):
+        return TreePage.objects.filter(pk__in=[self.pages[name].pk for name in names])
+
+    def test_subtree_roots(self):
+        roots = access_states.subtree_roots(self.select('public', 'members', 'other'))
+        self.assertEqual(roots, [self.pages['members'], self.pages['other']])
+
+    def test_set_subtree_access_state(self):
+        queryset = self.select('members', 'news')
+        bump = 'incuna_auth.access_state_cache.bump_generation'
+        with mock.patch(bump) as bump_generation:
+            with self.assertNumQueries(2):
+                count = access_states.set_subtree_access_state(queryset, AUTH)
+
+        self.assertEqual(count, 3)
+        bump_generation.assert_called_once_with(sender=TreePage, using='default')
+        expected = {
+            'home': INHERIT,
+            'members': AUTH,
+            'news': AUTH,
+            'public': AUTH,
+            'about': INHERIT,
+            'other': INHERIT,
+        }
+        self.assertEqual(self.get_states(), expected)
+
+    def test_set_subtree_access_state_empty(self):
+        count = access_states.set_subtree_access_state(TreePage.objects.none(), AUTH)
+        self.assertEqual(count, 0)
+
+
+class TestMPTTTree(TestCase):
+    """Test effective access states on a tree maintained as django-mptt would."""
+    def setUp(self):
+        connect_effective_state_receivers(self)
+        _, self.pages = make_tree([
+            ('home', AUTH, [
+                ('news', INHERIT, [
+                    ('story', INHERIT, []),
+                ]),
+            ]),
+        ], model=MPTTTreePage)
+        _, other_tree = make_tree([('public', ALL, [])], tree_id=2, model=MPTTTreePage)
+        self.pages.update(other_tree)
+
+    def get_states(self):
+        states = dict(MPTTTreePage.objects.values_list('pk', 'effective_access_state'))
+        return {name: states[page.pk] for name, page in self.pages.items()}
+
+    def test_inherit_chain(self):
+        expected = {'home': AUTH, 'news': AUTH, 'story': AUTH, 'public': ALL}
+        self.assertEqual(self.get_states(), expected)
+
+    def test_move_subtree(self):
+        move_subtree(self.pages['news'], self.pages['public'])
+
+        story = MPTTTreePage.objects.get(pk=self.pages['story'].pk)
+        ancestors = story.get_ancestors(ascending=True)
+        self.assertEqual(list(ancestors), [self.pages['news'], self.pages['public']])
+        expected = {'home': AUTH, 'news': ALL, 'story': ALL, 'public': ALL}
+        self.assertEqual(self.get_states(), expected)
+
+    def test_save_update_fields(self):
+        """Assert that saving only access_state still updates effective states."""
+        news = self.pages['news']
+        news.access_state = ALL
+        news.save(update_fields=['access_state'])
+        expected = {'home': AUTH, 'news': ALL, 'story': ALL, 'public': ALL}
+        self.assertEqual(self.get_states(), expected)
+
+    def test_move_subtree_changed_state(self):
+        """Assert that a moved page with its own access state passes it on."""
+        news = self.pages['news']
+        news.access_state = AUTH
+        news.save()
+        move_subtree(news, self.pages['public'])
+        expected = {'home': AUTH, 'news': AUTH, 'story': AUTH, 'public': ALL}
+        self.assertEqual(self.get_states(), expected)
+
+
+class TestVisibleToIntegerAccessStates(TestVisibleTo):
+    model = IntegerTreePage
+
+
+class TestGetInheritedIntegerAccessStates(TestGetInheritedAccessStates):
+    model = IntegerTreePage
@@ -1,5 +1,7 @@
 from unittest import TestCase
 
+from django.test.utils import override_settings
+
 from incuna_auth.backends import CustomUserModelBackend
 
 from .factories import UserFactory
@@ -38,3 +40,36 @@ class TestCustomUserModelBackend(TestCase):
         user.save()
         result = self.backend.authenticate(username, 'wrong_password')
         self.assertEqual(result, None)
+
+    def test_user_by_email_duplicated(self):
+        email = 'user4@name.com'
+        password = 'pass'
+        users = UserFactory.create_batch(2, email=email)
+        for user in users:
+            user.set_password(password)
+            user.save()
+        result = self.backend.authenticate(email.upper(), password)
+        self.assertEqual(result, users[0])
+
+    @override_settings(INCUNA_AUTH_EMAIL_LOOKUP='lower')
+    def test_user_by_email_lower(self):
+        email = 'User5@Name.com'
+        password = 'pass'
+        user = UserFactory.create(email=email)
+        user.set_password(password)
+        user.save()
+
+        users = self.backend.get_users_by_email(email)
+        self.assertIn('LOWER(', str(users.query))
+        result = self.backend.authenticate(email.upper(), password)
+        self.assertEqual(result, user)
+
+    @override_settings(INCUNA_AUTH_EMAIL_LOOKUP='exact')
+    def test_user_by_email_exact(self):
+        email = 'user6@name.com'
+        password = 'pass'
+        user = UserFactory.create(email=email)
+        user.set_password(password)
+        user.save()
+        result = self.backend.authenticate(email.upper(), password)
+        self.assertEqual(result, user)
@@ -0,0 +1,99 @@
+import io
+import os
+import tempfile
+
+from django.core.management import call_command, CommandError
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from incuna_auth.middleware import LoginRequiredMiddleware, policy
+
+
+def make_temporary_file(test_case):
+    """Returns the name of a new temporary file, removed when the test finishes."""
+    handle, filename = tempfile.mkstemp()
+    os.close(handle)
+    test_case.addCleanup(os.remove, filename)
+    return filename
+
+
+@override_settings(LOGIN_EXEMPT_URLS=[r'^public/'], LOGIN_PROTECTED_URLS=[r'^'])
+class TestClassifyUrls(TestCase):
+    paths = '/public/page/\n\n/private/?next=/\n'
+
+    def call(self, *args, **kwargs):
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        call_command('classify_urls', *args, stdout=stdout, stderr=stderr, **kwargs)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_stdin(self):
+        stdout, stderr = self.call(stdin=io.StringIO(self.paths))
+        expected = [
+            '\t'.join((policy.EXEMPT, '^public/', '/public/page/')),
+            '\t'.join((policy.PROTECTED, '^', '/private/')),
+        ]
+        self.assertEqual(stdout.splitlines(), expected)
+        self.assertEqual(stderr.strip(), '1 exempt, 1 protected, 0 unprotected')
+
+    def test_file(self):
+        filename = make_temporary_file(self)
+        with io.open(filename, 'w', encoding='utf-8') as paths_file:
+            paths_file.write(u'/unknown/\n')
+
+        stdout, stderr = self.call(
+            filename,
+            middleware='incuna_auth.middleware.permission.UrlPermissionMiddleware',
+            summary=True,
+        )
+        self.assertEqual(stdout.strip(), '0 exempt, 1 protected, 0 unprotected')
+        self.assertEqual(stderr, '')
+
+
+@override_settings(LOGIN_EXEMPT_URLS=[r'^public/'], LOGIN_PROTECTED_URLS=[r'^private/'])
+class TestCompileUrlPolicy(TestCase):
+    def setUp(self):
+        self.filename = make_temporary_file(self)
+
+    def call(self, *args):
+        stdout = io.StringIO()
+        call_command('compile_url_policy', *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_compile(self):
+        output = self.call(self.filename)
+        expected = 'Wrote 4 URL patterns (0 dynamic) to {}'.format(self.filename)
+        self.assertEqual(output.strip(), expected)
+
+        with override_settings(LOGIN_URL_POLICY_FILE=self.filename):
+            middleware = LoginRequiredMiddleware(check=False)
+            saved_policy = middleware.saved_url_policy
+            self.assertIsNotNone(saved_policy)
+            self.assertIs(middleware.get_url_policy(), saved_policy)
+            self.assertEqual(saved_policy.decide('public/'), policy.EXEMPT)
+            self.assertEqual(saved_policy.decide('private/'), policy.PROTECTED)
+
+    def test_compile_setting(self):
+        with override_settings(LOGIN_URL_POLICY_FILE=self.filename):
+            self.call()
+            middleware = LoginRequiredMiddleware(check=False)
+            self.assertIsNotNone(middleware.saved_url_policy)
+
+    def test_settings_changed(self):
+        """Assert that the saved policy is discarded when the settings change."""
+        self.call(self.filename)
+        with override_settings(LOGIN_URL_POLICY_FILE=self.filename):
+            middleware = LoginRequiredMiddleware(check=False)
+            with override_settings(LOGIN_PROTECTED_URLS=[r'^']):
+                self.assertIsNone(middleware.saved_url_policy)
+                decision = middleware.get_url_policy().decide('other/')
+                self.assertEqual(decision, policy.PROTECTED)
+
+    def test_invalid_pattern(self):
+        with override_settings(LOGIN_EXEMPT_URLS=[r'^public/(']):
+            with self.assertRaisesRegexp(CommandError, 'LOGIN_EXEMPT_URLS'):
+                self.call(self.filename)
+
+    def test_no_output(self):
+        with self.assertRaises(CommandError):
+            self.call()
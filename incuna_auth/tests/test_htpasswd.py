@@ -0,0 +1,164 @@
+import os
+import tempfile
+import warnings
+from base64 import b64encode
+
+import mock
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase
+from django.test.utils import override_settings
+
+from incuna_auth.middleware import basic_auth, htpasswd
+
+
+class TestParsePasswordFile(SimpleTestCase):
+    def test_parse(self):
+        lines = [
+            b'# Staging accounts\n',
+            b'\n',
+            b'alice:md5$salt$hash\n',
+            b'  bob:{SHA}abc=  \n',
+            b'no-hash\n',
+        ]
+        expected = {b'alice': 'md5$salt$hash', b'bob': '{SHA}abc='}
+        self.assertEqual(htpasswd.parse_password_file(lines), expected)
+
+
+class TestVerifyPassword(SimpleTestCase):
+    def test_django_hash(self):
+        encoded = make_password('secret')
+        self.assertTrue(htpasswd.verify_password(b'secret', encoded))
+        self.assertFalse(htpasswd.verify_password(b'wrong', encoded))
+
+    def test_sha_hash(self):
+        # As written by `htpasswd -s`.
+        encoded = '{SHA}5en6G6MezRroT3XKqkdPOmY/BfQ='
+        self.assertTrue(htpasswd.verify_password(b'secret', encoded))
+        self.assertFalse(htpasswd.verify_password(b'wrong', encoded))
+
+    def test_apr1_hash(self):
+        # As written by `htpasswd -m` (and by default).
+        encoded = '$apr1$abcdefgh$h9FWgUz3n9YxylKLlR5SQ/'
+        self.assertTrue(htpasswd.verify_password(b'secret', encoded))
+        self.assertFalse(htpasswd.verify_password(b'wrong', encoded))
+
+    def test_apr1_hash_long_password(self):
+        encoded = '$apr1$xy$ydi4vLfD5LxrQlAISGcwV/'
+        password = b'a longer password than sixteen bytes'
+        self.assertTrue(htpasswd.verify_password(password, encoded))
+
+    def test_unknown_hash(self):
+        self.assertFalse(htpasswd.verify_password(b'secret', 'secret'))
+        self.assertFalse(htpasswd.is_supported('secret'))
+
+
+class PasswordFileTestCase(SimpleTestCase):
+    def setUp(self):
+        handle, self.filename = tempfile.mkstemp()
+        os.close(handle)
+        self.addCleanup(os.remove, self.filename)
+        self.write_accounts(alice='secret')
+
+    def write_accounts(self, **accounts):
+        self.write_lines(*(
+            '{0}:{1}\n'.format(username, make_password(password)).encode('ascii')
+            for username, password in accounts.items()
+        ))
+
+    def write_lines(self, *lines):
+        with open(self.filename, 'wb') as password_file:
+            password_file.writelines(lines)
+
+        # Make sure the modification time changes, however coarse the filesystem's.
+        stat = os.stat(self.filename)
+        mtime = getattr(self, 'mtime', stat.st_mtime) + 10
+        os.utime(self.filename, (stat.st_atime, mtime))
+        self.mtime = mtime
+
+
+class TestPasswordFile(PasswordFileTestCase):
+    def test_check(self):
+        password_file = htpasswd.PasswordFile(self.filename)
+        self.assertTrue(password_file.check(b'alice', b'secret'))
+        self.assertFalse(password_file.check(b'alice', b'wrong'))
+        self.assertFalse(password_file.check(b'bob', b'secret'))
+
+    def test_missing_file(self):
+        with self.assertRaises(ImproperlyConfigured):
+            htpasswd.PasswordFile(self.filename + '.missing')
+
+    def test_unsupported_hash(self):
+        """Assert that accounts that could never log in are warned about."""
+        self.write_lines(b'alice:secret\n', b'bob:$apr1$xy$ydi4vLfD5LxrQlAISGcwV/\n')
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            htpasswd.PasswordFile(self.filename)
+        self.assertEqual(len(caught), 1)
+        self.assertIn('for: alice', str(caught[0].message))
+
+    def test_garbled_file(self):
+        self.write_lines(b'alice:\xe9\n')
+        with self.assertRaises(ImproperlyConfigured):
+            htpasswd.PasswordFile(self.filename)
+
+    def test_successful_check_remembered(self):
+        password_file = htpasswd.PasswordFile(self.filename)
+        password_file.check(b'alice', b'secret')
+
+        with mock.patch.object(htpasswd, 'verify_password') as verify_password:
+            self.assertTrue(password_file.check(b'alice', b'secret'))
+        self.assertFalse(verify_password.called)
+
+    def test_failed_check_not_remembered(self):
+        password_file = htpasswd.PasswordFile(self.filename)
+        password_file.check(b'alice', b'wrong')
+        self.assertEqual(len(password_file.verified), 0)
+
+    def test_reloaded_when_changed(self):
+        password_file = htpasswd.PasswordFile(self.filename)
+        self.assertTrue(password_file.check(b'alice', b'secret'))
+
+        self.write_accounts(alice='changed', bob='secret')
+        self.assertFalse(password_file.check(b'alice', b'secret'))
+        self.assertTrue(password_file.check(b'alice', b'changed'))
+        self.assertTrue(password_file.check(b'bob', b'secret'))
+
+    def test_not_reloaded_when_unchanged(self):
+        password_file = htpasswd.PasswordFile(self.filename)
+        with mock.patch.object(password_file, 'read') as read:
+            password_file.check(b'alice', b'secret')
+        self.assertFalse(read.called)
+
+    def test_accounts_kept_when_file_removed(self):
+        password_file = htpasswd.PasswordFile(self.filename)
+        os.rename(self.filename, self.filename + '.old')
+        self.addCleanup(os.rename, self.filename + '.old', self.filename)
+        self.assertTrue(password_file.check(b'alice', b'secret'))
+
+    def test_accounts_kept_when_file_garbled(self):
+        password_file = htpasswd.PasswordFile(self.filename)
+        self.write_lines(b'alice:\xe9\n')
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            self.assertTrue(password_file.check(b'alice', b'secret'))
+        self.assertEqual(len(caught), 1)
+        self.assertIn(self.filename, str(caught[0].message))
+
+
+class TestBasicAuthWithPasswordFile(PasswordFileTestCase):
+    def make_request(self, username, password):
+        auth = b64encode('{0}:{1}'.format(username, password).encode('utf-8'))
+        request = mock.Mock()
+        request.META = {'HTTP_AUTHORIZATION': 'Basic ' + auth.decode('ascii')}
+        return request
+
+    def test_accounts_from_file(self):
+        with override_settings(BASIC_WWW_AUTHENTICATION_FILE=self.filename):
+            middleware = basic_auth.BasicAuthenticationMiddleware()
+            response = middleware.process_request(self.make_request('alice', 'secret'))
+            self.assertIsNone(response)
+
+            # The settings' account isn't used.
+            response = middleware.process_request(self.make_request('user', 'pass'))
+            self.assertEqual(response.status_code, 401)
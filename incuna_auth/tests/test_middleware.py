@@ -10,6 +10,7 @@ from django.urls import reverse
 from incuna_auth.middleware import (
     basic_auth,
     FeinCMSLoginRequiredMiddleware,
+    login_required,
     LoginRequiredMiddleware,
 )
 from incuna_auth.models import AccessStateExtensionMixin as AccessState
@@ -83,6 +84,54 @@ class TestLoginRequiredMiddleware(RequestTestCase):
         response = self.middleware.process_request(request)
         self.assertEqual(response.status_code, 403)
 
+    @override_settings(LOGIN_EXEMPT_URLS=[r'^fake-request/'])
+    def test_exempt_url_setting(self):
+        request = self.make_request(auth=False)
+        response = self.middleware.process_request(request)
+        self.assertIsNone(response)
+
+    @override_settings(LOGIN_PROTECTED_URLS=[r'^other/'])
+    def test_protected_url_setting(self):
+        request = self.make_request(auth=False)
+        response = self.middleware.process_request(request)
+        self.assertIsNone(response)
+
+        request = self.make_request(auth=False, url='/other/')
+        response = self.middleware.process_request(request)
+        self.assertEqual(response.status_code, 302)
+
+    def test_lazy_compilation(self):
+        """Assert that the patterns are only compiled when they're first used."""
+        login_required.protected_urls.reset()
+        self.assertIsNone(login_required.protected_urls.patterns)
+
+        patterns = self.middleware.get_protected_url_patterns()
+        self.assertEqual([pattern.pattern for pattern in patterns], ['^'])
+        self.assertIs(patterns, self.middleware.get_protected_url_patterns())
+
+    @override_settings(LOGIN_EXEMPT_URLS=[r'^public/'], LOGIN_PROTECTED_URLS=[r'^a/'])
+    def test_url_list_attributes(self):
+        """Assert that the URL lists can still be read from the class attributes."""
+        exempt_urls = [settings.LOGIN_URL, settings.LOGOUT_URL, r'^public/']
+        self.assertEqual(LoginRequiredMiddleware.login_exempt_urls, exempt_urls)
+        self.assertEqual(self.middleware.login_protected_urls, [r'^a/'])
+
+        with self.assertRaises(AttributeError):
+            self.middleware.login_exempt_urls = []
+
+    @mock.patch(EXEMPT_URLS, NO_URLS)
+    @mock.patch(PROTECTED_URLS, ALL_URLS)
+    def test_new_style(self):
+        """Assert that the middleware can be listed in MIDDLEWARE."""
+        view_response = mock.Mock()
+        middleware = LoginRequiredMiddleware(False, lambda request: view_response)
+
+        response = middleware(self.make_request(auth=False))
+        self.assertEqual(response.status_code, 302)
+
+        response = middleware(self.make_request(auth=True))
+        self.assertIs(response, view_response)
+
 
 class TestFeinCMSLoginRequiredMiddleware(RequestTestCase):
     middleware = FeinCMSLoginRequiredMiddleware()
@@ -204,3 +253,82 @@ class TestBasicAuthMiddleware(TestCase):
         request = self.DummyRequest('basic', 'other_user', 'other_pass')
         result = self.middleware.process_request(request)
         self.assertEqual(result.status_code, basic_auth.challenge().status_code)
+
+    def test_is_authenticated_malformed(self):
+        headers = (
+            'basic',
+            'basic not-base64!',
+            'basic ' + base64_encode_for_py2or3('no colon'),
+            'basic ' + b64encode(b'\xff:\xfe').decode('ascii'),
+        )
+        for header in headers:
+            self.assertIs(basic_auth.is_authenticated(header), False)
+
+    def test_malformed_header_challenged(self):
+        request = self.DummyRequest()
+        request.META = {'HTTP_AUTHORIZATION': 'basic not-base64!'}
+        result = self.middleware.process_request(request)
+        self.assertEqual(result.status_code, 401)
+
+    def test_accepted_header_remembered(self):
+        request = self.DummyRequest('basic', 'user', 'pass')
+        self.middleware.process_request(request)
+
+        with mock.patch.object(basic_auth, 'is_authenticated') as is_authenticated:
+            result = self.middleware.process_request(request)
+        self.assertIsNone(result)
+        self.assertFalse(is_authenticated.called)
+
+        # Only a keyed digest of the header is kept.
+        key = list(self.middleware.accepted.data)[0]
+        self.assertNotIn(b'pass', key)
+
+    def test_rejected_header_not_remembered(self):
+        request = self.DummyRequest('basic', 'other_user', 'other_pass')
+        self.middleware.process_request(request)
+        self.assertEqual(len(self.middleware.accepted), 0)
+
+    def test_settings_change_forgets_accepted_headers(self):
+        request = self.DummyRequest('basic', 'user', 'pass')
+        self.middleware.process_request(request)
+
+        with override_settings(BASIC_WWW_AUTHENTICATION_PASSWORD='new'):
+            result = self.middleware.process_request(request)
+        self.assertEqual(result.status_code, 401)
+
+    @override_settings(BASIC_WWW_AUTHENTICATION_EXEMPT_URLS=[r'^health/$'])
+    def test_exempt_url(self):
+        self.middleware = basic_auth.BasicAuthenticationMiddleware()
+
+        request = self.DummyRequest(None)
+        request.path_info = '/health/'
+        self.assertIsNone(self.middleware.process_request(request))
+
+        request.path_info = '/health/other/'
+        result = self.middleware.process_request(request)
+        self.assertEqual(result.status_code, 401)
+
+    def test_challenge_header_worked_out_once(self):
+        request = self.DummyRequest(None)
+        self.middleware.process_request(request)
+
+        with mock.patch.object(basic_auth, 'get_challenge_header') as get_header:
+            response = self.middleware.process_request(request)
+        self.assertFalse(get_header.called)
+        self.assertEqual(response['WWW-Authenticate'], 'Basic realm="Restricted Access"')
+
+    @override_settings(WWW_AUTHENTICATION_REALM='Staging')
+    def test_challenge_header_realm(self):
+        response = self.middleware.process_request(self.DummyRequest(None))
+        self.assertEqual(response['WWW-Authenticate'], 'Basic realm="Staging"')
+
+    def test_new_style(self):
+        """Assert that the middleware can be listed in MIDDLEWARE."""
+        view_response = mock.Mock()
+        middleware = basic_auth.BasicAuthenticationMiddleware(lambda r: view_response)
+
+        response = middleware(self.DummyRequest(None))
+        self.assertEqual(response.status_code, 401)
+
+        response = middleware(self.DummyRequest('basic', 'user', 'pass'))
+        self.assertIs(response, view_response)
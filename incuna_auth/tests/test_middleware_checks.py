@@ -24,3 +24,24 @@ class TestCheckRequestHasUser(TestCase):
         ))
         with self.assertRaisesRegexp(ImproperlyConfigured, expected_error):
             self.middleware()
+
+    @override_settings(MIDDLEWARE=[requirement], MIDDLEWARE_CLASSES=[])
+    def test_check_passes_middleware(self):
+        self.middleware(get_response=lambda request: None)
+
+    @override_settings(MIDDLEWARE=['django.middleware.common.CommonMiddleware'])
+    def test_check_fails_middleware(self):
+        expected_error = "MIDDLEWARE does not contain AuthenticationMiddleware."
+        with self.assertRaisesRegexp(ImproperlyConfigured, expected_error):
+            self.middleware(get_response=lambda request: None)
+
+    @override_settings(MIDDLEWARE_CLASSES=[])
+    def test_check_positional(self):
+        """Assert that check can still be passed positionally."""
+        self.middleware(False)
+
+    @override_settings(MIDDLEWARE=[requirement])
+    def test_get_response_positional(self):
+        get_response = lambda request: None  # noqa: E731
+        middleware = self.middleware(get_response)
+        self.assertIs(middleware.get_response, get_response)
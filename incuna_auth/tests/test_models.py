@@ -1,9 +1,13 @@
+import sys
+
 import mock
 
-from django.db import models as django_models
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.db import connection, models as django_models
 from django.test import TestCase
 
-from incuna_auth import models
+from incuna_auth import access_state_cache, access_states, models
+from .models import IntegerTreePage, TreePage
 
 
 CUSTOM_STATE = ('custom', 'Custom state')
@@ -29,6 +33,61 @@ class TestAccessStateExtensionMixin(TestCase):
         expected_states = (CUSTOM_STATE,) + BASE_STATES
         self.assertEqual(expected_states, self.AccessState.ACCESS_STATES)
 
+    def test_access_state_codes(self):
+        """Assert that base states keep their codes, and custom states follow them."""
+        expected = {'base_all': 0, 'base_auth': 1, 'base_inherit': 2, 'custom': 3}
+        self.assertEqual(self.AccessState.ACCESS_STATE_CODES, expected)
+
+    def test_states_mask(self):
+        mask = self.AccessState.states_mask(['base_auth', 'custom'])
+        self.assertEqual(mask, 0b1010)
+        states = sorted(self.AccessState.mask_states(mask))
+        self.assertEqual(states, ['base_auth', 'custom'])
+
+    def test_custom_state_codes(self):
+        """Assert that custom states can be given codes that don't depend on order."""
+        class AccessState(models.AccessStateExtensionMixin):
+            CUSTOM_STATES = (('second', 'Second'), CUSTOM_STATE)
+            CUSTOM_STATE_CODES = {'custom': 10, 'second': 11}
+
+        self.assertEqual(AccessState.ACCESS_STATE_CODES['custom'], 10)
+        self.assertEqual(AccessState.ACCESS_STATE_CODES['second'], 11)
+
+    def test_handle_model_integer_access_states(self):
+        """Assert that INTEGER_ACCESS_STATES adds an indexed AccessStateField."""
+        class AccessState(models.AccessStateExtensionMixin):
+            CUSTOM_STATES = (CUSTOM_STATE,)
+            CUSTOM_STATE_CODES = {'custom': 10}
+            INTEGER_ACCESS_STATES = True
+
+        access = AccessState()
+        model = mock.MagicMock()
+        access.model = model
+
+        access.handle_model()
+
+        name, field = model.add_to_class.call_args[0]
+        self.assertEqual(name, 'access_state')
+        self.assertIsInstance(field, models.AccessStateField)
+        self.assertEqual(field.state_codes, AccessState.ACCESS_STATE_CODES)
+        self.assertTrue(field.db_index)
+
+    def test_integer_access_states_positional_codes(self):
+        """Assert that custom states' codes can't silently depend on their order."""
+        access = self.AccessState()
+        access.INTEGER_ACCESS_STATES = True
+        with self.assertRaises(ImproperlyConfigured):
+            access.make_access_state_field()
+
+    def test_integer_access_states_duplicate_codes(self):
+        class AccessState(models.AccessStateExtensionMixin):
+            CUSTOM_STATES = (CUSTOM_STATE,)
+            CUSTOM_STATE_CODES = {'custom': 1}
+            INTEGER_ACCESS_STATES = True
+
+        with self.assertRaises(ImproperlyConfigured):
+            AccessState().make_access_state_field()
+
     def test_handle_model(self):
         """
         Assert that add_to_class is called twice on the model, with correct parameters.
@@ -60,6 +119,74 @@ class TestAccessStateExtensionMixin(TestCase):
             mock.call('access_state', expected_field),
         ])
 
+    def test_handle_model_effective_access_state(self):
+        """Assert that EFFECTIVE_ACCESS_STATE adds the field and its receivers."""
+        access = self.AccessState()
+        access.EFFECTIVE_ACCESS_STATE = True
+        model = mock.MagicMock()
+        access.model = model
+        mptt_signals = mock.MagicMock()
+        modules = {
+            'mptt': mock.MagicMock(signals=mptt_signals),
+            'mptt.signals': mptt_signals,
+        }
+
+        with mock.patch.dict(sys.modules, modules):
+            with mock.patch.object(models, 'pre_save') as pre_save:
+                with mock.patch.object(models, 'post_save') as post_save:
+                    access.handle_model()
+
+        self.assertEqual(model.add_to_class.call_count, 3)
+        name, field = model.add_to_class.call_args[0]
+        self.assertEqual(name, 'effective_access_state')
+        self.assertTrue(field.db_index)
+        self.assertFalse(field.editable)
+
+        pre_save.connect.assert_called_once_with(
+            access_states.set_effective_state,
+            sender=model,
+        )
+        post_save.connect.assert_any_call(
+            access_states.update_descendant_states,
+            sender=model,
+        )
+        mptt_signals.node_moved.connect.assert_any_call(
+            access_states.update_moved_states,
+            sender=model,
+        )
+
+    def test_handle_model_cache_invalidation(self):
+        """Assert that changes to the model invalidate cached access states."""
+        access = self.AccessState()
+        model = mock.MagicMock()
+        access.model = model
+        mptt_signals = mock.MagicMock()
+        modules = {
+            'mptt': mock.MagicMock(signals=mptt_signals),
+            'mptt.signals': mptt_signals,
+        }
+
+        with mock.patch.dict(sys.modules, modules):
+            with mock.patch.object(models, 'post_delete') as post_delete:
+                with mock.patch.object(models, 'post_save') as post_save:
+                    access.handle_model()
+
+        receiver = access_state_cache.bump_generation
+        post_save.connect.assert_called_once_with(receiver, sender=model)
+        post_delete.connect.assert_called_once_with(receiver, sender=model)
+        mptt_signals.node_moved.connect.assert_called_once_with(receiver, sender=model)
+
+    def test_handle_model_state_rules(self):
+        """Assert that STATE_RULES are registered for RulePermissionMiddleware."""
+        access = self.AccessState()
+        access.STATE_RULES = {'custom': {'groups': ['Members']}}
+        access.model = mock.MagicMock()
+
+        with mock.patch('incuna_auth.access_rules.register') as register:
+            access.handle_model()
+
+        register.assert_called_once_with('custom', groups=['Members'])
+
     def test_handle_modeladmin(self):
         """
         Assert that add_extension_options is called once on the modeladmin.
@@ -73,3 +200,73 @@ class TestAccessStateExtensionMixin(TestCase):
         access.handle_modeladmin(modeladmin)
 
         modeladmin.add_extension_options.assert_called_once_with('access_state')
+
+
+class TestAccessStateField(TestCase):
+    def test_round_trip(self):
+        page = IntegerTreePage.objects.create(access_state='base_auth')
+        page = IntegerTreePage.objects.get(pk=page.pk)
+        self.assertEqual(page.access_state, 'base_auth')
+
+        stored = IntegerTreePage.objects.values_list('access_state', flat=True).query
+        with connection.cursor() as cursor:
+            cursor.execute(str(stored))
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_filter(self):
+        page = IntegerTreePage.objects.create(access_state='base_auth')
+        IntegerTreePage.objects.create(access_state='base_all')
+        states = ['base_auth', 'base_inherit']
+        pages = IntegerTreePage.objects.filter(access_state__in=states)
+        self.assertEqual(list(pages), [page])
+
+    def test_full_clean(self):
+        IntegerTreePage(access_state='base_all').full_clean()
+        with self.assertRaises(ValidationError):
+            IntegerTreePage(access_state='other').full_clean()
+
+    def test_to_python(self):
+        field = IntegerTreePage._meta.get_field('access_state')
+        self.assertEqual(field.to_python('1'), 'base_auth')
+        self.assertEqual(field.to_python('base_auth'), 'base_auth')
+
+    def test_deconstruct(self):
+        field = IntegerTreePage._meta.get_field('access_state')
+        name, path, args, kwargs = field.deconstruct()
+        self.assertEqual(kwargs['state_codes'], field.state_codes)
+
+
+class TestSubtreeActions(TestCase):
+    class AccessState(models.AccessStateExtensionMixin):
+        model = TreePage
+
+    def test_handle_modeladmin(self):
+        """Assert that MPTT models get an action for each access state."""
+        modeladmin = mock.MagicMock(actions=['delete_selected'])
+        self.AccessState().handle_modeladmin(modeladmin)
+
+        names = [getattr(action, '__name__', action) for action in modeladmin.actions]
+        expected = [
+            'delete_selected',
+            'set_subtree_access_state_base_all',
+            'set_subtree_access_state_base_auth',
+            'set_subtree_access_state_base_inherit',
+        ]
+        self.assertEqual(names, expected)
+
+    def test_action(self):
+        action = self.AccessState().make_subtree_action('base_auth', 'Logged in')
+        modeladmin = mock.MagicMock()
+        request = mock.MagicMock()
+        queryset = TreePage.objects.none()
+
+        set_state = 'incuna_auth.access_states.set_subtree_access_state'
+        with mock.patch(set_state, return_value=2) as set_subtree_access_state:
+            action(modeladmin, request, queryset)
+
+        set_subtree_access_state.assert_called_once_with(queryset, 'base_auth')
+        modeladmin.message_user.assert_called_once_with(
+            request,
+            'Updated the access state of 2 resources.',
+        )
+        self.assertIn('Logged in', str(action.short_description))
@@ -0,0 +1,63 @@
+from django.apps import apps
+from django.db import connection
+from django.db.migrations.state import ProjectState
+from django.test import TransactionTestCase
+
+from incuna_auth.operations import CreateLowerEmailIndex
+
+
+class TestCreateLowerEmailIndex(TransactionTestCase):
+    def apply(self, operation, editor, backwards=False):
+        state = ProjectState.from_apps(apps)
+        if backwards:
+            operation.database_backwards('tests', editor, state, state)
+        else:
+            operation.database_forwards('tests', editor, state, state)
+
+    def collect_sql(self, operation, backwards=False):
+        with connection.schema_editor(collect_sql=True) as editor:
+            self.apply(operation, editor, backwards)
+        return editor.collected_sql
+
+    def get_index_names(self, table):
+        with connection.cursor() as cursor:
+            return set(connection.introspection.get_constraints(cursor, table))
+
+    def test_sql(self):
+        operation = CreateLowerEmailIndex()
+        qn = connection.ops.quote_name
+        expected = 'CREATE INDEX {0} ON {1} (LOWER({2}));'.format(
+            qn('auth_user_email_lower'),
+            qn('auth_user'),
+            qn('email'),
+        )
+        self.assertEqual(self.collect_sql(operation), [expected])
+
+        expected = 'DROP INDEX {0};'.format(qn('auth_user_email_lower'))
+        self.assertEqual(self.collect_sql(operation, backwards=True), [expected])
+
+    def test_apply(self):
+        operation = CreateLowerEmailIndex()
+        with connection.schema_editor() as editor:
+            self.apply(operation, editor)
+        self.assertIn('auth_user_email_lower', self.get_index_names('auth_user'))
+        with connection.schema_editor() as editor:
+            self.apply(operation, editor, backwards=True)
+        self.assertNotIn('auth_user_email_lower', self.get_index_names('auth_user'))
+
+    def test_other_model(self):
+        """Assert that the table and column are those of the model and field given."""
+        operation = CreateLowerEmailIndex('tests.TreePage', 'access_state', name='lower')
+        qn = connection.ops.quote_name
+        expected = 'CREATE INDEX {0} ON {1} (LOWER({2}));'.format(
+            qn('lower'),
+            qn('tests_treepage'),
+            qn('access_state'),
+        )
+        self.assertEqual(self.collect_sql(operation), [expected])
+
+    def test_deconstruct(self):
+        operation = CreateLowerEmailIndex(name='lower')
+        name, args, kwargs = operation.deconstruct()
+        self.assertEqual(name, 'CreateLowerEmailIndex')
+        self.assertEqual(kwargs, {'name': 'lower'})
@@ -1,4 +1,5 @@
 import mock
+from django.test.utils import override_settings
 
 from incuna_auth.middleware import permission
 from incuna_auth.middleware.utils import compile_urls
@@ -156,3 +157,30 @@ class TestUrlPermissionMiddleware(RequestTestCase):
         method = self.middleware_path.format('get_protected_url_patterns')
         with mock.patch(method, return_value=[]):
             self.assertFalse(self.middleware.is_resource_protected(request))
+
+    @override_settings(INCUNA_AUTH_URL_DECISION_CACHE_SIZE=5)
+    def test_decision_cache_setting(self):
+        """Assert that the decision cache is sized by the setting."""
+        request = self.make_request()
+        self.assertTrue(self.middleware.is_resource_protected(request))
+        self.assertTrue(self.middleware.is_resource_protected(request))
+
+        cache = self.middleware.get_url_policy().cache
+        self.assertEqual(cache.max_size, 5)
+        self.assertEqual(cache.hits, 1)
+
+    def test_policy_reused(self):
+        """Assert that the policy is only rebuilt when the pattern lists change."""
+        policy = self.middleware.get_url_policy()
+        self.assertIs(policy, self.middleware.get_url_policy())
+
+        method = self.middleware_path.format('get_protected_url_patterns')
+        with mock.patch(method, return_value=[]):
+            self.assertIsNot(policy, self.middleware.get_url_policy())
+
+    def test_policy_reused_new_lists(self):
+        """Assert that hooks building new lists of the same patterns don't rebuild."""
+        method = self.middleware_path.format('get_exempt_url_patterns')
+        with mock.patch(method, side_effect=lambda: compile_urls([r'^login/'])):
+            policy = self.middleware.get_url_policy()
+            self.assertIs(policy, self.middleware.get_url_policy())
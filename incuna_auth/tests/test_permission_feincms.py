@@ -1,10 +1,37 @@
+import sys
+
 import mock
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models.signals import post_delete, post_save
+from django.test import override_settings
 
-from incuna_auth.middleware import permission_feincms
+from incuna_auth import access_state_cache
+from incuna_auth.middleware import permission_feincms, policy
+from incuna_auth.middleware.permission_rules import RulePermissionMiddleware
 from incuna_auth.models import AccessStateExtensionMixin as AccessState
+from . import models
+from .models import MPTTTreePage, TreePage
+from .test_access_states import (
+    connect_effective_state_receivers,
+    make_tree,
+    move_subtree,
+)
 from .utils import RequestTestCase
 
 
+def forget_resolutions(cls=permission_feincms.FeinCMSPermissionMiddleware):
+    """
+    Forgets the resolution methods, keys and ids cached on a middleware class and its
+    subclasses, which patching their methods makes out of date.
+    """
+    for name in ('_resolution_methods', '_resolution_key', '_resolution_id'):
+        if name in vars(cls):
+            delattr(cls, name)
+    for subclass in cls.__subclasses__():
+        forget_resolutions(subclass)
+
+
 class TestFeinCMSPermissionMiddleware(RequestTestCase):
     middleware_class = permission_feincms.FeinCMSPermissionMiddleware
     middleware_path = (
@@ -20,6 +47,7 @@ class TestFeinCMSPermissionMiddleware(RequestTestCase):
             self.access_state = access_state
 
     def setUp(self):
+        self.addCleanup(forget_resolutions)
         self.middleware = self.middleware_class()
 
     def make_request(self, access_state=CUSTOM_STATE, **kwargs):
@@ -42,6 +70,89 @@ class TestFeinCMSPermissionMiddleware(RequestTestCase):
         expected_state = self.CUSTOM_STATE
         self.assertEqual(expected_state, access_state)
 
+    def test_get_request_page(self):
+        """Assert that the page found is kept for FeinCMS to reuse."""
+        request = self.make_request()
+        page = request.feincms_page
+        page._cached_url = '/'
+        with mock.patch(self.get_page_method, return_value=page) as get_page:
+            self.assertEqual(self.middleware._get_request_page(request), page)
+
+        get_page.assert_called_once_with('')
+        self.assertEqual(request._feincms_page, page)
+
+    def test_get_request_page_found(self):
+        """Assert that a page FeinCMS has already found isn't looked up again."""
+        request = self.make_request()
+        request.feincms_page._cached_url = '/'
+        request._feincms_page = request.feincms_page
+        with mock.patch(self.get_page_method) as get_page:
+            page = self.middleware._get_request_page(request)
+
+        self.assertEqual(page, request.feincms_page)
+        self.assertFalse(get_page.called)
+
+    def test_get_request_page_best_match(self):
+        """Assert that an ancestor found by best match isn't given to FeinCMS."""
+        request = self.make_request(url='/parent/child/')
+        page = request.feincms_page
+        page._cached_url = '/parent/'
+        with mock.patch(self.get_page_method, return_value=page) as get_page:
+            self.assertEqual(self.middleware._get_request_page(request), page)
+            self.assertEqual(self.middleware._get_request_page(request), page)
+
+        self.assertEqual(get_page.call_count, 1)
+        self.assertFalse(hasattr(request, '_feincms_page'))
+
+    def test_get_request_page_other_url(self):
+        """Assert that a page FeinCMS holds for another URL isn't trusted."""
+        request = self.make_request()
+        request._feincms_page = self.DummyFeinCMSPage(AccessState.STATE_ALL_ALLOWED)
+        request._feincms_page._cached_url = '/other/'
+        with mock.patch(self.get_page_method, return_value=request.feincms_page):
+            page = self.middleware._get_request_page(request)
+        self.assertEqual(page, request.feincms_page)
+
+    def test_get_request_page_overridden(self):
+        """Assert that middlewares finding other pages don't share them with FeinCMS."""
+        class Middleware(permission_feincms.FeinCMSPermissionMiddleware):
+            def _get_page_from_path(self, path):
+                return other_page
+
+        other_page = self.DummyFeinCMSPage(self.CUSTOM_STATE)
+        other_page._cached_url = '/'
+        request = self.make_request()
+        request.feincms_page._cached_url = '/'
+        request._feincms_page = request.feincms_page
+
+        self.assertEqual(Middleware()._get_request_page(request), other_page)
+        self.assertEqual(request._feincms_page, request.feincms_page)
+
+    def test_get_request_page_not_found(self):
+        """Assert that a missing page isn't stored, so FeinCMS can raise its 404."""
+        request = self.make_request()
+        with mock.patch(self.get_page_method, return_value=None):
+            self.assertIsNone(self.middleware._get_request_page(request))
+        self.assertFalse(hasattr(request, '_feincms_page'))
+
+    def test_get_resource_access_state_snapshot(self):
+        """Assert that the access state comes from the snapshot if it's enabled."""
+        request = self.make_request()
+        snapshot = mock.MagicMock()
+        snapshot.get_access_state.return_value = self.CUSTOM_STATE
+
+        with mock.patch.object(self.middleware, 'get_access_state_snapshot') as get:
+            get.return_value = snapshot
+            with mock.patch(self.get_page_method) as get_page:
+                access_state = self.middleware._get_resource_access_state(request)
+
+        self.assertEqual(access_state, self.CUSTOM_STATE)
+        snapshot.get_access_state.assert_called_once_with('/')
+        self.assertFalse(get_page.called)
+
+    def test_get_access_state_snapshot_disabled(self):
+        self.assertIsNone(self.middleware.get_access_state_snapshot())
+
     def test_get_resource_access_state_no_page(self):
         """Assert that the access_state is None when feincms_page is None."""
         request = self.make_request()
@@ -78,6 +189,92 @@ class TestFeinCMSPermissionMiddleware(RequestTestCase):
         expected_state = self.CUSTOM_STATE
         self.assertEqual(expected_state, access_state)
 
+    def test_get_resource_access_state_inherited_mptt(self):
+        """Assert that MPTT pages fetch their ancestors' states in a single query."""
+        request = self.make_request(access_state=AccessState.STATE_INHERIT)
+        page = request.feincms_page
+        page.get_ancestors = mock.MagicMock()
+        ancestors = page.get_ancestors.return_value.exclude.return_value
+        states = ancestors.values_list.return_value.__getitem__
+        states.return_value = [self.CUSTOM_STATE]
+
+        with mock.patch(self.get_page_method, return_value=page):
+            access_state = self.middleware._get_resource_access_state(request)
+
+        self.assertEqual(access_state, self.CUSTOM_STATE)
+        page.get_ancestors.assert_called_once_with(ascending=True)
+        page.get_ancestors.return_value.exclude.assert_called_once_with(
+            access_state=AccessState.STATE_INHERIT,
+        )
+        states.assert_called_once_with(slice(None, 1))
+
+    def test_get_resource_access_state_inherited_mptt_root(self):
+        """Assert that MPTT pages whose ancestors all inherit are unrestricted."""
+        request = self.make_request(access_state=AccessState.STATE_INHERIT)
+        page = request.feincms_page
+        page.get_ancestors = mock.MagicMock()
+        ancestors = page.get_ancestors.return_value.exclude.return_value
+        ancestors.values_list.return_value.__getitem__.return_value = []
+
+        with mock.patch(self.get_page_method, return_value=page):
+            self.assertIsNone(self.middleware._get_resource_access_state(request))
+
+    def test_get_inherited_access_state_mptt_tree(self):
+        """Assert that an MPTT page inherits through a chain of ancestors, until moved."""
+        _, pages = make_tree([
+            ('home', AccessState.STATE_AUTH_ONLY, [
+                ('news', AccessState.STATE_INHERIT, [
+                    ('story', AccessState.STATE_INHERIT, []),
+                ]),
+            ]),
+        ], model=MPTTTreePage)
+        _, other_tree = make_tree([
+            ('public', AccessState.STATE_ALL_ALLOWED, []),
+        ], tree_id=2, model=MPTTTreePage)
+
+        with self.assertNumQueries(1):
+            access_state = self.middleware._get_inherited_access_state(pages['story'])
+        self.assertEqual(access_state, AccessState.STATE_AUTH_ONLY)
+
+        move_subtree(pages['news'], other_tree['public'])
+        story = MPTTTreePage.objects.get(pk=pages['story'].pk)
+        access_state = self.middleware._get_inherited_access_state(story)
+        self.assertEqual(access_state, AccessState.STATE_ALL_ALLOWED)
+
+    @override_settings(INCUNA_AUTH_INHERITANCE_RESOLVER='cte')
+    def test_get_inherited_access_state_cte(self):
+        """Assert that non-MPTT resources can be resolved with a single query."""
+        root = TreePage.objects.create(access_state=AccessState.STATE_AUTH_ONLY)
+        page = root
+        for _ in range(3):
+            page = TreePage.objects.create(parent=page)
+
+        with self.assertNumQueries(1):
+            access_state = self.middleware._get_inherited_access_state(page)
+        self.assertEqual(access_state, AccessState.STATE_AUTH_ONLY)
+
+    @override_settings(INCUNA_AUTH_INHERITANCE_RESOLVER='cte')
+    def test_get_inherited_access_state_cte_unsupported(self):
+        """Assert that following parents one at a time is the fallback."""
+        parent_page = self.DummyFeinCMSPage(self.CUSTOM_STATE)
+        page = self.DummyFeinCMSPage(AccessState.STATE_INHERIT)
+        page.parent = parent_page
+
+        supported = 'incuna_auth.access_states.supports_recursive_cte'
+        with mock.patch(supported, return_value=False):
+            access_state = self.middleware._get_inherited_access_state(page)
+        self.assertEqual(access_state, self.CUSTOM_STATE)
+
+    def test_get_resource_access_state_effective(self):
+        """Assert that a page's effective_access_state is used if it has one."""
+        request = self.make_request(access_state=AccessState.STATE_INHERIT)
+        request.feincms_page.effective_access_state = self.CUSTOM_STATE
+
+        with mock.patch(self.get_page_method, return_value=request.feincms_page):
+            access_state = self.middleware._get_resource_access_state(request)
+
+        self.assertEqual(access_state, self.CUSTOM_STATE)
+
     def test_get_resource_access_state_null_parent(self):
         """
         Assert that the method doesn't explode when the Page has a parent which is None.
@@ -112,3 +309,348 @@ class TestFeinCMSPermissionMiddleware(RequestTestCase):
         with mock.patch(self.get_page_method, return_value=request.feincms_page):
             with mock.patch(get_states_method, return_value=[state]):
                 self.assertFalse(self.middleware.is_resource_protected(request))
+
+
+class TestRequestMemoization(RequestTestCase):
+    """Assert that stacked middlewares resolve each request's access state once."""
+    get_page_method = TestFeinCMSPermissionMiddleware.get_page_method
+
+    class CustomMiddleware(permission_feincms.FeinCMSPermissionMiddleware):
+        def get_protected_states(self):
+            return ['custom']
+
+    class OtherPageMiddleware(permission_feincms.FeinCMSPermissionMiddleware):
+        def _get_page_from_path(self, path):
+            return None
+
+    def setUp(self):
+        self.addCleanup(forget_resolutions)
+        self.page = TestFeinCMSPermissionMiddleware.DummyFeinCMSPage('custom')
+
+    def test_shared(self):
+        request = self.create_request()
+        middlewares = (
+            permission_feincms.FeinCMSPermissionMiddleware(),
+            self.CustomMiddleware(),
+        )
+        with mock.patch(self.get_page_method, return_value=self.page) as get_page:
+            protected = [m.is_resource_protected(request) for m in middlewares]
+
+        self.assertEqual(protected, [False, True])
+        self.assertEqual(get_page.call_count, 1)
+
+    def test_per_request(self):
+        middleware = self.CustomMiddleware()
+        with mock.patch(self.get_page_method, return_value=self.page) as get_page:
+            middleware.is_resource_protected(self.create_request())
+            middleware.is_resource_protected(self.create_request())
+        self.assertEqual(get_page.call_count, 2)
+
+    def test_resolution_key(self):
+        """Assert that only middlewares resolving pages the same way share."""
+        key = permission_feincms.FeinCMSPermissionMiddleware().get_resolution_key()
+        self.assertEqual(self.CustomMiddleware().get_resolution_key(), key)
+        self.assertNotEqual(self.OtherPageMiddleware().get_resolution_key(), key)
+
+    def test_resolution_key_any_hook(self):
+        """Assert that overriding any method that isn't a decision method counts."""
+        class SharedPageMiddleware(permission_feincms.FeinCMSPermissionMiddleware):
+            def _finds_feincms_pages(self):
+                return False
+
+        class NewHookMiddleware(permission_feincms.FeinCMSPermissionMiddleware):
+            def get_page_queryset(self):
+                return None
+
+        key = permission_feincms.FeinCMSPermissionMiddleware().get_resolution_key()
+        self.assertNotEqual(SharedPageMiddleware().get_resolution_key(), key)
+        self.assertNotEqual(NewHookMiddleware().get_resolution_key(), key)
+        self.assertIn('get_page_queryset', NewHookMiddleware.get_resolution_methods())
+
+    def test_resolution_key_decision_methods(self):
+        """Assert that middlewares only deciding differently share."""
+        key = permission_feincms.FeinCMSPermissionMiddleware().get_resolution_key()
+        self.assertEqual(RulePermissionMiddleware().get_resolution_key(), key)
+
+
+class TestLeanPageFetch(RequestTestCase):
+    def setUp(self):
+        self.addCleanup(forget_resolutions)
+        self.middleware = permission_feincms.FeinCMSPermissionMiddleware()
+        page_model = mock.MagicMock(spec=['objects', '_mptt_meta'])
+        page_model._mptt_meta = mock.MagicMock(
+            tree_id_attr='tree_id',
+            left_attr='lft',
+            right_attr='rght',
+            level_attr='level',
+        )
+        self.page_model = page_model
+        self.pages = page_model.objects.active.return_value.filter.return_value
+        self.page = self.pages.only.return_value.order_by.return_value.first.return_value
+
+        models = mock.MagicMock(Page=page_model)
+        patcher = mock.patch.dict(sys.modules, {
+            'feincms': mock.MagicMock(),
+            'feincms.module': mock.MagicMock(),
+            'feincms.module.page': mock.MagicMock(models=models),
+            'feincms.module.page.models': models,
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_use_lean_page_fetch(self):
+        self.assertFalse(self.middleware.use_lean_page_fetch())
+        with override_settings(INCUNA_AUTH_LEAN_PAGE_FETCH=True):
+            self.assertTrue(self.middleware.use_lean_page_fetch())
+
+    @override_settings(INCUNA_AUTH_LEAN_PAGE_FETCH=True)
+    def test_use_lean_page_fetch_overridden(self):
+        """Assert that an overridden _get_page_from_path is always used."""
+        class Middleware(permission_feincms.FeinCMSPermissionMiddleware):
+            def _get_page_from_path(self, path):
+                pass
+
+        self.assertFalse(Middleware().use_lean_page_fetch())
+
+    def test_get_lean_page_from_path(self):
+        page = self.middleware._get_lean_page_from_path('a/b/')
+
+        self.assertEqual(page, self.page)
+        self.page_model.objects.active.return_value.filter.assert_called_once_with(
+            _cached_url__in=['/', '/a/', '/a/b/'],
+        )
+        self.pages.only.assert_called_once_with(
+            'parent',
+            'access_state',
+            'tree_id',
+            'lft',
+            'rght',
+            'level',
+        )
+        self.pages.only.return_value.order_by.assert_called_once_with('-_cached_url')
+
+    def test_get_lean_page_from_path_inactive_ancestors(self):
+        self.page.are_ancestors_active.return_value = False
+        self.assertIsNone(self.middleware._get_lean_page_from_path('a/'))
+
+    def test_get_lean_page_from_path_effective_access_state(self):
+        self.page_model.effective_access_state = None
+        self.middleware._get_lean_page_from_path('a/')
+        fields = self.pages.only.call_args[0]
+        self.assertEqual(fields[-1], 'effective_access_state')
+
+    @override_settings(INCUNA_AUTH_LEAN_PAGE_FETCH=True)
+    def test_get_request_page_lean(self):
+        """Assert that a lean page isn't shared with FeinCMS."""
+        request = self.create_request()
+        self.assertEqual(self.middleware._get_request_page(request), self.page)
+        self.assertFalse(hasattr(request, '_feincms_page'))
+
+
+@override_settings(INCUNA_AUTH_ACCESS_STATE_CACHE='default')
+class TestFeinCMSPermissionMiddlewareCache(TestFeinCMSPermissionMiddleware):
+    """Run the same tests with access states cached, and test the caching itself."""
+    def setUp(self):
+        super(TestFeinCMSPermissionMiddlewareCache, self).setUp()
+        caches['default'].clear()
+
+    def get_access_state(self, request, page):
+        with mock.patch(self.get_page_method, return_value=page) as get_page:
+            access_state = self.middleware._get_cached_resource_access_state(request)
+        return access_state, get_page.call_count
+
+    def test_cached(self):
+        request = self.make_request()
+        page = request.feincms_page
+        self.assertEqual(self.get_access_state(request, page), (self.CUSTOM_STATE, 1))
+        self.assertEqual(self.get_access_state(request, page), (self.CUSTOM_STATE, 0))
+
+    def test_cached_no_page(self):
+        """Assert that paths without a page are cached too."""
+        request = self.make_request()
+        self.assertEqual(self.get_access_state(request, None), (None, 1))
+        self.assertEqual(self.get_access_state(request, None), (None, 0))
+
+    def test_cached_per_path(self):
+        page = self.DummyFeinCMSPage(self.CUSTOM_STATE)
+        self.get_access_state(self.make_request(url='/one/'), page)
+        other_request = self.make_request(url='/two/')
+        self.assertEqual(self.get_access_state(other_request, None), (None, 1))
+
+    def test_bump_generation(self):
+        """Assert that changing a resource invalidates every cached access state."""
+        request = self.make_request()
+        page = request.feincms_page
+        self.get_access_state(request, page)
+
+        access_state_cache.invalidate()
+        page.access_state = AccessState.STATE_AUTH_ONLY
+        expected = (AccessState.STATE_AUTH_ONLY, 1)
+        self.assertEqual(self.get_access_state(self.make_request(), page), expected)
+
+    def test_bump_generation_on_commit(self):
+        """Assert that cached access states are only invalidated on commit."""
+        with mock.patch('django.db.transaction.on_commit') as on_commit:
+            access_state_cache.bump_generation(sender=MPTTTreePage, using='default')
+        on_commit.assert_called_once_with(access_state_cache.invalidate, using='default')
+
+    def test_subtree_moved(self):
+        """Assert that moving pages invalidates cached access states (on node_moved)."""
+        access = AccessState()
+        access.model = MPTTTreePage
+        mptt_signals = mock.MagicMock(node_moved=models.node_moved)
+        modules = {
+            'mptt': mock.MagicMock(signals=mptt_signals),
+            'mptt.signals': mptt_signals,
+        }
+        with mock.patch.dict(sys.modules, modules):
+            access.connect_cache_invalidation()
+        receiver = access_state_cache.bump_generation
+        for signal in (post_save, post_delete, models.node_moved):
+            self.addCleanup(signal.disconnect, receiver, sender=MPTTTreePage)
+        connect_effective_state_receivers(self)
+
+        _, pages = make_tree([
+            ('home', AccessState.STATE_AUTH_ONLY, [
+                ('news', AccessState.STATE_INHERIT, [
+                    ('story', AccessState.STATE_INHERIT, []),
+                ]),
+            ]),
+        ], model=MPTTTreePage)
+        _, other_tree = make_tree([
+            ('public', AccessState.STATE_ALL_ALLOWED, []),
+        ], tree_id=2, model=MPTTTreePage)
+
+        def get_access_state():
+            story = MPTTTreePage.objects.get(pk=pages['story'].pk)
+            return self.get_access_state(self.make_request(), story)
+
+        self.assertEqual(get_access_state(), (AccessState.STATE_AUTH_ONLY, 1))
+        self.assertEqual(get_access_state(), (AccessState.STATE_AUTH_ONLY, 0))
+        with mock.patch('django.db.transaction.on_commit') as on_commit:
+            move_subtree(pages['news'], other_tree['public'])
+        # Until the move is committed, other processes still see the page where it was.
+        self.assertEqual(get_access_state(), (AccessState.STATE_AUTH_ONLY, 0))
+
+        for (callback,), kwargs in on_commit.call_args_list:
+            callback()
+        self.assertEqual(get_access_state(), (None, 1))
+
+    @override_settings(INCUNA_AUTH_ACCESS_STATE_SNAPSHOT=True)
+    def test_not_cached_with_snapshot(self):
+        """Assert that paths' access states aren't cached as well as snapshotted."""
+        request = self.make_request()
+        snapshot = mock.Mock(spec=['get_access_state'])
+        snapshot.get_access_state.return_value = self.CUSTOM_STATE
+        middleware = self.middleware
+        with mock.patch.object(middleware, 'get_access_state_snapshot') as get_snapshot:
+            get_snapshot.return_value = snapshot
+            with mock.patch.object(caches['default'], 'get_many') as get_many:
+                access_state = middleware._get_cached_resource_access_state(request)
+        self.assertEqual(access_state, self.CUSTOM_STATE)
+        self.assertFalse(get_many.called)
+
+    def test_bump_generation_missing(self):
+        """Assert that a generation is created if there isn't one to bump."""
+        access_state_cache.invalidate()
+        self.assertIsNotNone(caches['default'].get(access_state_cache.GENERATION_KEY))
+
+    def test_cached_per_resolution(self):
+        """Assert that middlewares resolving pages differently don't share entries."""
+        class LooseMiddleware(permission_feincms.FeinCMSPermissionMiddleware):
+            def _get_resource_access_state(self, request):
+                return None
+
+        class StrictMiddleware(permission_feincms.FeinCMSPermissionMiddleware):
+            def _get_page_from_path(self, path):
+                return TestFeinCMSPermissionMiddleware.DummyFeinCMSPage(
+                    AccessState.STATE_AUTH_ONLY,
+                )
+
+        loose, strict = LooseMiddleware(), StrictMiddleware()
+        self.assertNotEqual(loose.get_resolution_id(), strict.get_resolution_id())
+
+        request = self.make_request()
+        self.assertIsNone(loose._get_cached_resource_access_state(request))
+        access_state = strict._get_cached_resource_access_state(request)
+        self.assertEqual(access_state, AccessState.STATE_AUTH_ONLY)
+
+    def test_resolution_cached(self):
+        """Assert that the resolution key and id are only worked out once per class."""
+        self.middleware.get_resolution_key()
+        self.middleware.get_resolution_id()
+        with mock.patch.object(self.middleware_class, 'get_resolution_methods') as get:
+            self.middleware_class().get_resolution_key()
+            self.middleware_class().get_resolution_id()
+        self.assertFalse(get.called)
+
+    def test_resolution_id_stable(self):
+        """Assert that the identity doesn't depend on the instance or process."""
+        self.assertEqual(
+            self.middleware.get_resolution_id(),
+            self.middleware_class().get_resolution_id(),
+        )
+
+    def test_single_round_trip(self):
+        """Assert that the generation and the access state are fetched together."""
+        request = self.make_request()
+        page = request.feincms_page
+        self.get_access_state(request, page)
+
+        cache = caches['default']
+        get_generation = 'incuna_auth.access_state_cache.get_generation'
+        with mock.patch(get_generation) as get_generation:
+            with mock.patch.object(cache, 'get_many', wraps=cache.get_many) as get_many:
+                access_state = self.get_access_state(request, page)
+        self.assertEqual(access_state, (self.CUSTOM_STATE, 0))
+        self.assertEqual(get_many.call_count, 1)
+        self.assertFalse(get_generation.called)
+
+    def test_resource_protected_cached(self):
+        request = self.make_request(access_state=AccessState.STATE_AUTH_ONLY)
+        with mock.patch(self.get_page_method, return_value=request.feincms_page):
+            self.assertTrue(self.middleware.is_resource_protected(request))
+        with mock.patch(self.get_page_method) as get_page:
+            self.assertTrue(self.middleware.is_resource_protected(request))
+        self.assertFalse(get_page.called)
+
+
+@override_settings(INCUNA_AUTH_ACCESS_STATE_CACHE='default')
+class TestFeinCMSUrlPermissionMiddleware(RequestTestCase):
+    get_snapshot = 'incuna_auth.access_state_snapshot.get_snapshot'
+
+    def setUp(self):
+        self.middleware = permission_feincms.FeinCMSUrlPermissionMiddleware()
+        self.middleware.get_page_model = mock.MagicMock()
+        self.snapshot = mock.MagicMock()
+        self.snapshot.page_policy.return_value = policy.PagePolicy([
+            ('/members/', policy.PROTECTED),
+        ])
+
+    def test_is_resource_protected(self):
+        with mock.patch(self.get_snapshot, return_value=self.snapshot):
+            request = self.create_request(url='/members/news/')
+            self.assertTrue(self.middleware.is_resource_protected(request))
+            request = self.create_request(url='/about/')
+            self.assertFalse(self.middleware.is_resource_protected(request))
+
+        self.snapshot.page_policy.assert_called_once_with([AccessState.STATE_AUTH_ONLY])
+
+    @override_settings(INCUNA_AUTH_ACCESS_STATE_CACHE=None)
+    def test_no_shared_cache(self):
+        """Assert that other processes' changes can't go unnoticed."""
+        with self.assertRaises(ImproperlyConfigured):
+            permission_feincms.FeinCMSUrlPermissionMiddleware()
+
+    def test_rebuilt_with_snapshot(self):
+        """Assert that the policy is exported again when the snapshot changes."""
+        with mock.patch(self.get_snapshot, return_value=self.snapshot):
+            url_policy = self.middleware.get_url_policy()
+            self.assertIs(self.middleware.get_url_policy(), url_policy)
+
+        new_snapshot = mock.MagicMock()
+        with mock.patch(self.get_snapshot, return_value=new_snapshot):
+            self.assertIs(
+                self.middleware.get_url_policy(),
+                new_snapshot.page_policy.return_value,
+            )
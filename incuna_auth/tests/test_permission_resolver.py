@@ -0,0 +1,128 @@
+from django.conf import settings
+from django.conf.urls import url
+from django.conf.urls.i18n import i18n_patterns
+from django.contrib.auth import views
+from django.test.utils import override_settings
+from django.utils import translation
+
+from incuna_auth.middleware import permission_resolver
+from .utils import RequestTestCase
+
+
+login_view = views.LoginView.as_view()
+
+# This module is also a URLconf, with only a login page, for ROOT_URLCONF tests.
+urlpatterns = [
+    url(r'^sign-in/$', login_view, name='login'),
+]
+
+
+class I18nUrls(object):
+    """A URLconf whose only page is prefixed with the language, except by default."""
+    urlpatterns = i18n_patterns(
+        url(r'^secret/$', login_view, name='secret'),
+        prefix_default_language=False,
+    )
+
+
+class TestRuleMatches(RequestTestCase):
+    # Wrapped in staticmethod so it isn't bound to the test case.
+    callback = staticmethod(login_view)
+
+    def test_view_name(self):
+        self.assertTrue(permission_resolver.rule_matches('login', self.callback, 'login'))
+        self.assertFalse(permission_resolver.rule_matches('log', self.callback, 'login'))
+
+    def test_wildcard(self):
+        rule_matches = permission_resolver.rule_matches
+        self.assertTrue(rule_matches('admin:*', self.callback, 'admin:index'))
+        self.assertFalse(rule_matches('admin:*', self.callback, 'login'))
+
+    def test_dotted_path(self):
+        rule = 'django.contrib.auth.views.*'
+        self.assertTrue(permission_resolver.rule_matches(rule, self.callback, None))
+
+    def test_view_class(self):
+        rule_matches = permission_resolver.rule_matches
+        self.assertTrue(rule_matches(views.LoginView, self.callback, 'login'))
+        self.assertTrue(rule_matches(self.callback, self.callback, 'login'))
+        self.assertFalse(rule_matches(views.LogoutView, self.callback, 'login'))
+
+
+class TestResolverPermissionMiddleware(RequestTestCase):
+    class Middleware(permission_resolver.ResolverPermissionMiddleware):
+        def get_exempt_views(self):
+            return ['login', 'password_reset*']
+
+    def setUp(self):
+        self.middleware = self.Middleware()
+
+    def is_protected(self, url):
+        request = self.create_request(url=url)
+        return self.middleware.is_resource_protected(request)
+
+    def test_protected(self):
+        self.assertTrue(self.is_protected('/password/change/'))
+        self.assertTrue(self.is_protected('/logout/'))
+
+    def test_exempt(self):
+        self.assertFalse(self.is_protected('/login/'))
+        self.assertFalse(self.is_protected('/password/reset/'))
+        self.assertFalse(self.is_protected('/password/reset/done/'))
+
+    def test_unresolved(self):
+        self.assertFalse(self.is_protected('/not-a-url/'))
+
+    def test_protected_view_keys(self):
+        """Assert that the protected views are worked out once."""
+        keys = self.middleware.get_protected_view_keys()
+        view_names = set(name for callback, name in keys)
+        self.assertIn('password_change', view_names)
+        self.assertNotIn('login', view_names)
+        self.assertIs(keys, self.middleware.get_protected_view_keys())
+
+    def test_resolve_cached(self):
+        view = self.middleware.resolve_view('/login/')
+        self.assertEqual(view[1], 'login')
+        self.assertIs(view, self.middleware.resolve_view('/login/'))
+        self.assertEqual(self.middleware.resolve_cache.hits, 1)
+
+    def test_unresolved_cached(self):
+        self.assertIsNone(self.middleware.resolve_view('/not-a-url/'))
+        self.assertIsNone(self.middleware.resolve_view('/not-a-url/'))
+        self.assertEqual(self.middleware.resolve_cache.hits, 1)
+
+    @override_settings(INCUNA_AUTH_RESOLVE_CACHE_SIZE=0)
+    def test_cache_disabled(self):
+        middleware = self.Middleware()
+        self.assertIsNone(middleware.resolve_view('/not-a-url/'))
+        self.assertEqual(len(middleware.resolve_cache), 0)
+
+    def test_root_urlconf_changed(self):
+        """Assert that nothing resolved under another ROOT_URLCONF is reused."""
+        self.assertTrue(self.is_protected('/logout/'))
+        self.assertFalse(self.is_protected('/sign-in/'))
+
+        with override_settings(ROOT_URLCONF=__name__):
+            self.assertFalse(self.is_protected('/logout/'))
+            self.assertFalse(self.is_protected('/sign-in/'))
+            keys = self.middleware.get_protected_view_keys()
+            self.assertEqual(keys, frozenset())
+
+        self.assertTrue(self.is_protected('/logout/'))
+
+    def test_cached_per_language(self):
+        """Assert that a path resolved in one language isn't reused in another."""
+        request = self.create_request(url='/secret/')
+        request.urlconf = I18nUrls
+        with translation.override('de'):
+            self.assertFalse(self.middleware.is_resource_protected(request))
+        with translation.override(settings.LANGUAGE_CODE):
+            self.assertTrue(self.middleware.is_resource_protected(request))
+
+    def test_clear_caches(self):
+        self.middleware.get_protected_view_keys()
+        self.middleware.resolve_view('/login/')
+        with override_settings(ROOT_URLCONF=__name__):
+            self.assertEqual(self.middleware.protected_views, {})
+            self.assertEqual(len(self.middleware.resolve_cache), 0)
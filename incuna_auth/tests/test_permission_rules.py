@@ -0,0 +1,55 @@
+import mock
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.core.cache import caches
+from django.urls import reverse
+
+from incuna_auth import access_rules
+from incuna_auth.middleware import permission_rules
+from .utils import RequestTestCase
+
+
+class TestRulePermissionMiddleware(RequestTestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.middleware = permission_rules.RulePermissionMiddleware()
+        self.group = Group.objects.create(name='Members')
+        rules = {'members': access_rules.AccessRule(groups=['Members'])}
+        patcher = mock.patch.object(access_rules, 'rules', rules)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_request(self, access_state='members', **kwargs):
+        get_access_state = mock.Mock(return_value=access_state)
+        self.middleware._get_request_access_state = get_access_state
+        return self.create_request(add_session=True, **kwargs)
+
+    def test_get_protected_states(self):
+        self.assertEqual(self.middleware.get_protected_states(), ['members'])
+
+    def test_allowed(self):
+        request = self.make_request()
+        request.user.groups.add(self.group)
+        self.assertTrue(self.middleware.is_resource_protected(request))
+        self.assertIsNone(self.middleware.process_request(request))
+
+    def test_denied(self):
+        """Assert that logged-in users aren't sent back to the login page."""
+        request = self.make_request()
+        response = self.middleware.process_request(request)
+        self.assertEqual(response.status_code, 403)
+
+    def test_denied_anonymous(self):
+        request = self.make_request(auth=False)
+        response = self.middleware.process_request(request)
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].startswith(reverse(settings.LOGIN_URL)))
+
+    def test_anonymous(self):
+        request = self.make_request(auth=False)
+        self.assertTrue(self.middleware.deny_access_condition(request))
+
+    def test_unprotected(self):
+        request = self.make_request(access_state='other')
+        self.assertFalse(self.middleware.is_resource_protected(request))
+        self.assertFalse(self.middleware.deny_access_condition(request))
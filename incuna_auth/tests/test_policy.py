@@ -0,0 +1,251 @@
+import json
+import os
+import re
+import tempfile
+import warnings
+from unittest import TestCase
+
+from incuna_auth.middleware import policy
+from incuna_auth.middleware.utils import compile_urls
+
+
+class TestAsAlternative(TestCase):
+    def assertAlternative(self, pattern, expected):
+        self.assertEqual(policy.as_alternative(re.compile(pattern)), expected)
+
+    def test_plain_pattern(self):
+        self.assertAlternative(r'^static/', r'^static/')
+
+    def test_groups_made_non_capturing(self):
+        self.assertAlternative(
+            r'^blog/(?P<slug>[-\w]+)/(\d+)/$',
+            r'^blog/(?:[-\w]+)/(?:\d+)/$',
+        )
+
+    def test_character_class_untouched(self):
+        self.assertAlternative(r'^[]()]+(a)', r'^[]()]+(?:a)')
+
+    def test_escaped_parenthesis_untouched(self):
+        self.assertAlternative(r'^\(a\)', r'^\(a\)')
+
+    def test_lookahead_untouched(self):
+        self.assertAlternative(r'^(?!admin/)', r'^(?!admin/)')
+
+    def test_uncombinable(self):
+        """Assert that patterns depending on the rest of the expression are refused."""
+        for pattern in (r'^(a)\1', r'^(?P<a>a)(?P=a)', r'(?i)^static/'):
+            self.assertIsNone(policy.as_alternative(re.compile(pattern)))
+
+
+class TestUrlPolicy(TestCase):
+    exempt = compile_urls([r'^login/$', r'^public/(?P<slug>\w+)/'])
+    protected = compile_urls([r'^public/', r'^private/(?P<slug>\w+)/'])
+
+    def test_combined(self):
+        url_policy = policy.UrlPolicy(self.exempt, self.protected)
+        self.assertIsNotNone(url_policy.matcher)
+
+    def test_literal_patterns_indexed(self):
+        """Assert that only the dynamic patterns end up in the combined matcher."""
+        url_policy = policy.UrlPolicy(self.exempt, self.protected)
+        self.assertEqual(url_policy.dynamic_indexes, [1, 3])
+        self.assertEqual(url_policy.literals.first_match('public/'), 2)
+
+    def test_first_pattern_wins(self):
+        """Assert that list order is respected across literal and dynamic patterns."""
+        patterns = compile_urls([r'^a/(\d+)/', r'^a/1'])
+        url_policy = policy.UrlPolicy([], patterns)
+        self.assertEqual(url_policy.match('a/1/'), (policy.PROTECTED, patterns[0]))
+        self.assertEqual(url_policy.match('a/1x'), (policy.PROTECTED, patterns[1]))
+
+        url_policy = policy.UrlPolicy([], patterns[::-1])
+        self.assertEqual(url_policy.match('a/1/'), (policy.PROTECTED, patterns[1]))
+
+    def test_decide(self):
+        url_policy = policy.UrlPolicy(self.exempt, self.protected)
+        self.assertEqual(url_policy.decide('login/'), policy.EXEMPT)
+        self.assertEqual(url_policy.decide('public/'), policy.PROTECTED)
+        self.assertEqual(url_policy.decide('private/page/'), policy.PROTECTED)
+        self.assertEqual(url_policy.decide('other/'), policy.UNPROTECTED)
+
+    def test_exempt_wins(self):
+        """Assert that a path matching both lists is exempt."""
+        url_policy = policy.UrlPolicy(self.exempt, self.protected)
+        self.assertEqual(url_policy.decide('public/page/'), policy.EXEMPT)
+        self.assertFalse(url_policy.is_protected('public/page/'))
+
+    def test_match_returns_pattern(self):
+        url_policy = policy.UrlPolicy(self.exempt, self.protected)
+        expected = (policy.PROTECTED, self.protected[1])
+        self.assertEqual(url_policy.match('private/page/'), expected)
+        self.assertEqual(url_policy.match('other/'), (policy.UNPROTECTED, None))
+
+    def test_fallback(self):
+        """Assert that uncombinable patterns are still matched, in the same order."""
+        exempt = compile_urls([r'(?i)^LOGIN/$'])
+        url_policy = policy.UrlPolicy(exempt, self.protected)
+        self.assertIsNone(url_policy.matcher)
+        self.assertEqual(url_policy.decide('login/'), policy.EXEMPT)
+        self.assertEqual(url_policy.decide('public/page/'), policy.PROTECTED)
+        self.assertEqual(url_policy.decide('other/'), policy.UNPROTECTED)
+
+    def test_no_patterns(self):
+        url_policy = policy.UrlPolicy([], [])
+        self.assertEqual(url_policy.decide('any/'), policy.UNPROTECTED)
+
+    def test_no_cache_by_default(self):
+        url_policy = policy.UrlPolicy(self.exempt, self.protected)
+        self.assertIsNone(url_policy.cache)
+
+    def test_cached_decisions(self):
+        """Assert that a cached decision is reused rather than matched again."""
+        url_policy = policy.UrlPolicy(self.exempt, self.protected, cache_size=10)
+        self.assertEqual(url_policy.decide('public/'), policy.PROTECTED)
+        self.assertEqual(url_policy.decide('public/'), policy.PROTECTED)
+        self.assertEqual(url_policy.decide('other/'), policy.UNPROTECTED)
+
+        info = url_policy.cache.info()
+        self.assertEqual((info['hits'], info['misses']), (1, 2))
+
+    def test_built_from(self):
+        url_policy = policy.UrlPolicy(self.exempt, self.protected)
+        self.assertTrue(url_policy.built_from(self.exempt, self.protected))
+        self.assertTrue(url_policy.built_from(list(self.exempt), self.protected))
+        recompiled = compile_urls([pattern.pattern for pattern in self.exempt])
+        self.assertTrue(url_policy.built_from(recompiled, self.protected))
+        self.assertFalse(url_policy.built_from(self.exempt[:1], self.protected))
+
+    def test_classify(self):
+        url_policy = policy.UrlPolicy(self.exempt, self.protected)
+        results = list(url_policy.classify(['/login/', 'private/page/', '/other/']))
+        expected = [
+            ('/login/', policy.EXEMPT, self.exempt[0]),
+            ('private/page/', policy.PROTECTED, self.protected[1]),
+            ('/other/', policy.UNPROTECTED, None),
+        ]
+        self.assertEqual(results, expected)
+
+
+class TestPagePolicy(TestCase):
+    def setUp(self):
+        self.policy = policy.PagePolicy([
+            ('/', policy.UNPROTECTED),
+            ('/members/', policy.PROTECTED),
+            ('/members/join/', policy.UNPROTECTED),
+        ])
+
+    def test_decide(self):
+        self.assertEqual(self.policy.decide('members/news/'), policy.PROTECTED)
+        self.assertEqual(self.policy.decide('members'), policy.PROTECTED)
+        self.assertEqual(self.policy.decide('members/join/'), policy.UNPROTECTED)
+        self.assertEqual(self.policy.decide('membership/'), policy.UNPROTECTED)
+
+    def test_is_protected(self):
+        self.assertTrue(self.policy.is_protected('members/'))
+        self.assertFalse(self.policy.is_protected(''))
+
+    def test_no_pages(self):
+        self.assertEqual(policy.PagePolicy().match('any/'), (policy.UNPROTECTED, None))
+
+    def test_classify(self):
+        results = list(self.policy.classify(['/members/news/', '/members/join/']))
+        expected = [
+            ('/members/news/', policy.PROTECTED, '/members/'),
+            ('/members/join/', policy.UNPROTECTED, '/members/join/'),
+        ]
+        self.assertEqual(results, expected)
+
+
+class TestPolicyFile(TestCase):
+    exempt_urls = [r'^login/$', r'^public/(?P<slug>\w+)/']
+    protected_urls = [r'^public/', r'(?i)^private/']
+
+    def setUp(self):
+        self.policy = policy.UrlPolicy(
+            compile_urls(self.exempt_urls),
+            compile_urls(self.protected_urls),
+        )
+        self.checksum = policy.policy_checksum(self.exempt_urls, self.protected_urls)
+
+        handle, self.filename = tempfile.mkstemp()
+        os.close(handle)
+        self.addCleanup(os.remove, self.filename)
+
+    def assertSameDecisions(self, url_policy):
+        paths = ('login/', 'public/', 'public/page/', 'PRIVATE/', 'other/')
+        for path in paths:
+            self.assertEqual(url_policy.decide(path), self.policy.decide(path))
+
+    def test_round_trip(self):
+        data = json.loads(json.dumps(self.policy.to_dict()))
+        loaded = policy.UrlPolicy.from_dict(data)
+        self.assertSameDecisions(loaded)
+
+        decision, pattern = loaded.match('public/page/')
+        self.assertEqual(decision, policy.EXEMPT)
+        self.assertEqual(pattern.pattern, self.exempt_urls[1])
+
+    def test_checksum(self):
+        self.assertNotEqual(
+            self.checksum,
+            policy.policy_checksum(self.exempt_urls, self.protected_urls[:1]),
+        )
+
+    def test_read_policy_file(self):
+        policy.write_policy_file(self.filename, self.policy, self.checksum)
+        loaded = policy.read_policy_file(self.filename, self.checksum, cache_size=5)
+        self.assertSameDecisions(loaded)
+        self.assertEqual(loaded.cache.max_size, 5)
+
+    def test_read_policy_file_out_of_date(self):
+        policy.write_policy_file(self.filename, self.policy, 'other')
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            self.assertIsNone(policy.read_policy_file(self.filename, self.checksum))
+        self.assertEqual(len(caught), 1)
+
+    def test_read_policy_file_truncated(self):
+        """Assert that a file missing part of the policy is ignored, not an error."""
+        data = dict(
+            self.policy.to_dict(),
+            version=policy.POLICY_FILE_VERSION,
+            checksum=self.checksum,
+        )
+        for key in ('decisions', 'literals', 'matcher'):
+            truncated = dict(data)
+            del truncated[key]
+            with open(self.filename, 'w') as policy_file:
+                json.dump(truncated, policy_file)
+
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                self.assertIsNone(policy.read_policy_file(self.filename, self.checksum))
+            self.assertEqual(len(caught), 1)
+
+    def test_read_policy_file_garbled(self):
+        data = dict(
+            self.policy.to_dict(),
+            version=policy.POLICY_FILE_VERSION,
+            checksum=self.checksum,
+            decisions=[['exempt']],
+        )
+        with open(self.filename, 'w') as policy_file:
+            json.dump(data, policy_file)
+
+        with warnings.catch_warnings(record=True):
+            warnings.simplefilter('always')
+            self.assertIsNone(policy.read_policy_file(self.filename, self.checksum))
+
+    def test_read_policy_file_not_dict(self):
+        with open(self.filename, 'w') as policy_file:
+            json.dump([], policy_file)
+
+        with warnings.catch_warnings(record=True):
+            warnings.simplefilter('always')
+            self.assertIsNone(policy.read_policy_file(self.filename, self.checksum))
+
+    def test_read_policy_file_invalid(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            self.assertIsNone(policy.read_policy_file(self.filename, self.checksum))
+        self.assertEqual(len(caught), 1)
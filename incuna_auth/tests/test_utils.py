@@ -0,0 +1,142 @@
+import re
+from unittest import TestCase
+
+from incuna_auth.middleware import utils
+
+
+class TestLRUCache(TestCase):
+    def test_get_missing(self):
+        cache = utils.LRUCache(2)
+        self.assertIsNone(cache.get('missing'))
+        self.assertEqual(cache.get('missing', 'default'), 'default')
+        self.assertEqual(cache.misses, 2)
+
+    def test_set_and_get(self):
+        cache = utils.LRUCache(2)
+        cache.set('key', 'value')
+        self.assertEqual(cache.get('key'), 'value')
+        self.assertEqual(cache.hits, 1)
+
+    def test_eviction(self):
+        """Assert that the least recently used item is evicted when the cache is full."""
+        cache = utils.LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_replace_does_not_evict(self):
+        cache = utils.LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.set('a', 3)
+        self.assertEqual(cache.get('a'), 3)
+        self.assertEqual(cache.evictions, 0)
+
+    def test_zero_size(self):
+        cache = utils.LRUCache(0)
+        cache.set('a', 1)
+        self.assertIsNone(cache.get('a'))
+
+    def test_clear(self):
+        cache = utils.LRUCache(2)
+        cache.set('a', 1)
+        cache.get('a')
+        cache.clear()
+
+        expected = {'hits': 0, 'misses': 0, 'evictions': 0, 'size': 0, 'max_size': 2}
+        self.assertEqual(cache.info(), expected)
+
+
+class TestLiteralPrefix(TestCase):
+    def assertLiteral(self, pattern, expected):
+        self.assertEqual(utils.literal_prefix(re.compile(pattern)), expected)
+
+    def test_anchored_prefix(self):
+        self.assertLiteral(r'^static/', ('static/', False))
+
+    def test_unanchored_prefix(self):
+        self.assertLiteral(r'api/public/', ('api/public/', False))
+
+    def test_exact(self):
+        self.assertLiteral(r'^login/$', ('login/', True))
+
+    def test_escaped_characters(self):
+        self.assertLiteral(r'^robots\.txt$', ('robots.txt', True))
+        self.assertLiteral(r'^price\$', ('price$', False))
+
+    def test_match_everything(self):
+        self.assertLiteral(r'^', ('', False))
+
+    def test_dynamic(self):
+        for pattern in (r'^blog/\d+/', r'^a.b', r'^(a|b)/', r'^files?/', r'^a\w'):
+            self.assertLiteral(pattern, None)
+
+    def test_flags(self):
+        self.assertIsNone(utils.literal_prefix(re.compile(r'^static/', re.IGNORECASE)))
+
+
+class TestPrefixIndex(TestCase):
+    def setUp(self):
+        self.index = utils.PrefixIndex()
+        self.index.add('static/', 2)
+        self.index.add('static/css/', 1)
+        self.index.add('login/', 0, exact=True)
+
+    def test_prefix(self):
+        self.assertEqual(list(self.index.matches('static/css/site.css')), [2, 1])
+        self.assertEqual(self.index.first_match('static/css/site.css'), 1)
+        self.assertEqual(self.index.first_match('static/'), 2)
+
+    def test_exact(self):
+        self.assertEqual(self.index.first_match('login/'), 0)
+        self.assertEqual(self.index.first_match('login/\n'), 0)
+        self.assertIsNone(self.index.first_match('login/next/'))
+
+    def test_no_match(self):
+        self.assertIsNone(self.index.first_match('stat'))
+        self.assertIsNone(self.index.first_match(''))
+
+    def test_empty_prefix(self):
+        self.index.add('', 3)
+        self.assertEqual(self.index.first_match('anything'), 3)
+
+    def test_existing_value_kept(self):
+        self.index.add('static/', 5)
+        self.assertEqual(self.index.first_match('static/'), 2)
+
+    def test_bool(self):
+        self.assertTrue(self.index)
+        self.assertFalse(utils.PrefixIndex())
+
+
+class TestPrefixIndexLongestMatch(TestCase):
+    def test_longest_match(self):
+        index = utils.PrefixIndex()
+        index.add('', 'root')
+        index.add('about/', 'about')
+        index.add('about/team/', 'team')
+        index.add('about', 'about-exact', exact=True)
+
+        self.assertEqual(index.longest_match('about/team/members/'), 'team')
+        self.assertEqual(index.longest_match('about/history/'), 'about')
+        self.assertEqual(index.longest_match('about'), 'about-exact')
+        self.assertEqual(index.longest_match('aboutus/'), 'root')
+
+    def test_longest_match_none(self):
+        self.assertIsNone(utils.PrefixIndex().longest_match('about/'))
+
+
+class TestCandidateUrls(TestCase):
+    def test_candidate_urls(self):
+        expected = ['/', '/a/', '/a/b/']
+        self.assertEqual(utils.candidate_urls('a/b'), expected)
+        self.assertEqual(utils.candidate_urls('/a/b/'), expected)
+
+    def test_candidate_urls_root(self):
+        self.assertEqual(utils.candidate_urls(''), ['/'])